@@ -117,4 +117,7 @@ for name, data in legacy_preprocessors.items():
     # Invert should not match any particular model.
     if "invert" in name:
         p.model_filename_filters = []
+    # Shuffle uses numpy random noise.
+    if name == "shuffle":
+        p.output_depends_on_seed = True
     add_supported_preprocessor(p)
@@ -27,6 +27,7 @@ class PreprocessorMarigold(Preprocessor):
         self.show_control_mode = True
         self.do_not_need_model = False
         self.sorting_priority = 100  # higher goes to top in the list
+        self.max_batch_size = 4
         self.diffusers_patcher = None
 
     def load_model(self):
@@ -41,28 +42,42 @@ class PreprocessorMarigold(Preprocessor):
 
         return
 
-    def __call__(self, input_image, resolution, slider_1=None, slider_2=None, slider_3=None, **kwargs):
-        input_image, remove_pad = resize_image_with_pad(input_image, resolution)
-
+    def run_model(self, input_images):
+        # input_images: uint8 array of shape (b, h, w, c)
         self.load_model()
 
-        H, W, C = input_image.shape
+        B, H, W, C = input_images.shape
 
         self.diffusers_patcher.prepare_memory_before_sampling(
-            batchsize=1, latent_width=W // 8, latent_height=H // 8
+            batchsize=B, latent_width=W // 8, latent_height=H // 8
         )
 
         with torch.no_grad():
-            img = numpy_to_pytorch(input_image).movedim(-1, 1)
+            img = numpy_to_pytorch(input_images)[0].movedim(-1, 1)
             img = self.diffusers_patcher.move_tensor_to_current_device(img)
 
             img = img * 2.0 - 1.0
             depth = self.diffusers_patcher.pipeline(img, num_inference_steps=20, show_pbar=False)
             depth = 0.5 - depth * 0.5
-            depth = depth.movedim(1, -1)[0].cpu().numpy()
-            depth_image = HWC3((depth * 255.0).clip(0, 255).astype(np.uint8))
+            depth = depth.movedim(1, -1).cpu().numpy()
+            depth_images = [HWC3((d * 255.0).clip(0, 255).astype(np.uint8)) for d in depth]
+
+        return depth_images
+
+    def __call__(self, input_image, resolution, slider_1=None, slider_2=None, slider_3=None, **kwargs):
+        input_image, remove_pad = resize_image_with_pad(input_image, resolution)
+        return remove_pad(self.run_model(input_image[None])[0])
+
+    def process_batch(self, input_images, resolution, slider_1=None, slider_2=None, slider_3=None, input_masks=None, **kwargs):
+        padded = [resize_image_with_pad(input_image, resolution) for input_image in input_images]
+        results = [None] * len(padded)
+
+        for indices in self.group_by_shape([image for image, _ in padded]):
+            depth_images = self.run_model(np.stack([padded[i][0] for i in indices]))
+            for i, depth_image in zip(indices, depth_images):
+                results[i] = padded[i][1](depth_image)
 
-        return remove_pad(depth_image)
+        return results
 
 
 add_supported_preprocessor(PreprocessorMarigold())
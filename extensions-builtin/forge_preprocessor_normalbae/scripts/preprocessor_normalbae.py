@@ -48,30 +48,45 @@ class PreprocessorNormalBae(Preprocessor):
 
         self.model_patcher = self.setup_model_patcher(model)
 
-    def __call__(self, input_image, resolution, slider_1=None, slider_2=None, slider_3=None, **kwargs):
-        input_image, remove_pad = resize_image_with_pad(input_image, resolution)
-
+    def run_model(self, input_images):
+        # input_images: uint8 array of shape (b, h, w, c)
         self.load_model()
 
         self.move_all_model_patchers_to_gpu()
 
-        assert input_image.ndim == 3
-        image_normal = input_image
+        assert input_images.ndim == 4
+        image_normal = input_images
 
         with torch.no_grad():
             image_normal = self.send_tensor_to_model_device(torch.from_numpy(image_normal))
             image_normal = image_normal / 255.0
-            image_normal = rearrange(image_normal, 'h w c -> 1 c h w')
+            image_normal = rearrange(image_normal, 'b h w c -> b c h w')
             image_normal = self.norm(image_normal)
 
             normal = self.model_patcher.model(image_normal)
             normal = normal[0][-1][:, :3]
             normal = ((normal + 1) * 0.5).clip(0, 1)
 
-            normal = rearrange(normal[0], 'c h w -> h w c').cpu().numpy()
-            normal_image = (normal * 255.0).clip(0, 255).astype(np.uint8)
+            normal = rearrange(normal, 'b c h w -> b h w c').cpu().numpy()
+            normal_images = (normal * 255.0).clip(0, 255).astype(np.uint8)
+
+        return normal_images
+
+    def __call__(self, input_image, resolution, slider_1=None, slider_2=None, slider_3=None, **kwargs):
+        input_image, remove_pad = resize_image_with_pad(input_image, resolution)
+        assert input_image.ndim == 3
+        return remove_pad(self.run_model(input_image[None])[0])
+
+    def process_batch(self, input_images, resolution, slider_1=None, slider_2=None, slider_3=None, input_masks=None, **kwargs):
+        padded = [resize_image_with_pad(input_image, resolution) for input_image in input_images]
+        results = [None] * len(padded)
+
+        for indices in self.group_by_shape([image for image, _ in padded]):
+            normal_images = self.run_model(np.stack([padded[i][0] for i in indices]))
+            for i, normal_image in zip(indices, normal_images):
+                results[i] = padded[i][1](normal_image)
 
-        return remove_pad(normal_image)
+        return results
 
 
 add_supported_preprocessor(PreprocessorNormalBae())
@@ -7,6 +7,7 @@ from PIL import Image
 import gradio as gr
 
 from modules.api import api
+from modules_forge.aux_model_cache import aux_model_cache
 from .global_state import (
     get_all_preprocessor_names,
     get_all_controlnet_names,
@@ -44,6 +45,10 @@ def controlnet_api(_: gr.Blocks, app: FastAPI):
         logger.debug(up_to_date_model_list)
         return {"model_list": up_to_date_model_list}
 
+    @app.get("/controlnet/model_cache")
+    async def model_cache():
+        return aux_model_cache.stats()
+
     @app.get("/controlnet/module_list")
     async def module_list():
         module_list = get_all_preprocessor_names()
@@ -0,0 +1,101 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+import numpy as np
+import torch
+
+from modules import shared
+from lib_controlnet.logging import logger
+
+
+def hash_ndarray(array: Optional[np.ndarray]) -> Optional[str]:
+    """Content hash of an array, including its shape and dtype."""
+    if array is None:
+        return None
+    array = np.ascontiguousarray(array)
+    h = hashlib.sha1(f"{array.shape}{array.dtype}".encode())
+    h.update(memoryview(array).cast("B"))
+    return h.hexdigest()
+
+
+def estimate_size(value: Any) -> Optional[int]:
+    """Size in bytes of a cacheable value, or None if the value cannot be cached."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.numel()
+    if isinstance(value, tuple):
+        sizes = [estimate_size(v) for v in value]
+        return None if None in sizes else sum(sizes)
+    return None
+
+
+class PreprocessorCache:
+    """
+    LRU cache of preprocessor results shared by all units and requests, limited by the total size of the
+    cached arrays. Preprocessor outputs can also be kept in the webui disk cache so that they survive a restart.
+    """
+
+    def __init__(self):
+        self.entries: OrderedDict = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.disk_cache = None
+
+    @property
+    def max_bytes(self) -> int:
+        return int(shared.opts.data.get("control_net_preprocessor_cache_size", 1024)) * 1024 * 1024
+
+    def get_disk_cache(self):
+        if not shared.opts.data.get("control_net_preprocessor_cache_to_disk", False):
+            return None
+        if self.disk_cache is None:
+            from modules import cache
+            self.disk_cache = cache.make_cache("controlnet-preprocessor")
+        return self.disk_cache
+
+    def get(self, key: Tuple, persistent: bool = False) -> Optional[Any]:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                return value
+
+        disk_cache = self.get_disk_cache() if persistent else None
+        if disk_cache is not None:
+            value = disk_cache.get(repr(key))
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def put(self, key: Tuple, value: Any, persistent: bool = False):
+        size = estimate_size(value)
+        if size is None or size > self.max_bytes:
+            return
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= estimate_size(old)
+            self.entries[key] = value
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= estimate_size(evicted)
+
+        disk_cache = self.get_disk_cache() if persistent else None
+        if disk_cache is not None:
+            try:
+                disk_cache.set(repr(key), value)
+            except Exception as e:
+                logger.warning(f"Failed to write preprocessor result to disk cache: {e}")
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+
+preprocessor_cache = PreprocessorCache()
@@ -30,13 +30,14 @@ from lib_controlnet.infotext import Infotext
 from modules_forge.forge_util import HWC3, numpy_to_pytorch
 from lib_controlnet.enums import HiResFixOption
 from lib_controlnet.api import controlnet_api
+from lib_controlnet.preprocessor_cache import preprocessor_cache, hash_ndarray
 
 import numpy as np
-import functools
 
 from PIL import Image
 from modules_forge.shared import try_load_supported_control_model
 from modules_forge.supported_controlnet import ControlModelPatcher
+from modules_forge.aux_model_cache import aux_model_cache
 
 # Gradio 3.32 bug fix
 import tempfile
@@ -47,9 +48,23 @@ os.makedirs(gradio_tempfile_path, exist_ok=True)
 global_state.update_controlnet_filenames()
 
 
-@functools.lru_cache(maxsize=shared.opts.data.get("control_net_model_cache_size", 5))
 def cached_controlnet_loader(filename):
-    return try_load_supported_control_model(filename)
+    return aux_model_cache.get_or_load(
+        ('controlnet', filename),
+        lambda: try_load_supported_control_model(filename),
+        category='controlnet',
+    )
+
+
+def apply_model_cache_limits():
+    aux_model_cache.set_limits(
+        max_bytes=int(shared.opts.data.get("control_net_aux_model_cache_size_mb", 8192)) * 1024 * 1024,
+        controlnet=int(shared.opts.data.get("control_net_model_cache_size", 5)),
+        ipadapter=int(shared.opts.data.get("control_net_ipadapter_cache_size", 5)),
+    )
+
+
+apply_model_cache_limits()
 
 
 class ControlNetCachedParameters:
@@ -290,6 +305,68 @@ class ControlNetForForgeOfficial(scripts.Script):
 
         return h, w, hr_y, hr_x
 
+    @staticmethod
+    def preprocessor_cache_key(unit: ControlNetUnit, preprocessor, input_image, input_mask, seed):
+        if preprocessor_cache.max_bytes <= 0:
+            return None
+        return (
+            unit.module,
+            hash_ndarray(input_image),
+            hash_ndarray(input_mask),
+            unit.processor_res,
+            unit.threshold_a,
+            unit.threshold_b,
+            seed if getattr(preprocessor, 'output_depends_on_seed', False) else None,
+        )
+
+    def run_preprocessor_batch(self, p, unit: ControlNetUnit, preprocessor, input_list, h, w, resize_mode):
+        """
+        Runs a preprocessor that supports batches on all batch inputs that are not cached yet, with one
+        process_batch call per processor resolution. Returns the outputs and their cache keys.
+        """
+        seed = set_numpy_seed(p)
+        logger.debug(f"Use numpy seed {seed}.")
+        logger.info(f"Using preprocessor: {unit.module}")
+
+        outputs = [None] * len(input_list)
+        cache_keys = [None] * len(input_list)
+        pending = {}
+
+        for i, (input_image, input_mask) in enumerate(input_list):
+            if unit.pixel_perfect:
+                unit.processor_res = external_code.pixel_perfect_resolution(
+                    input_image,
+                    target_H=h,
+                    target_W=w,
+                    resize_mode=resize_mode,
+                )
+
+            cache_keys[i] = self.preprocessor_cache_key(unit, preprocessor, input_image, input_mask, seed)
+            outputs[i] = preprocessor_cache.get(cache_keys[i], persistent=True) if cache_keys[i] else None
+            if outputs[i] is None:
+                pending.setdefault(unit.processor_res, []).append(i)
+
+        if len(input_list) > sum(len(indices) for indices in pending.values()):
+            logger.info(f"Using {len(input_list) - sum(len(indices) for indices in pending.values())} cached preprocessor results.")
+
+        for resolution, indices in pending.items():
+            logger.info(f'preprocessor resolution = {resolution}, batch of {len(indices)} images')
+            results = preprocessor.process_batch(
+                input_images=[input_list[i][0] for i in indices],
+                input_masks=[input_list[i][1] for i in indices],
+                resolution=resolution,
+                slider_1=unit.threshold_a,
+                slider_2=unit.threshold_b,
+            )
+            for i, preprocessor_output in zip(indices, results):
+                outputs[i] = preprocessor_output
+                if cache_keys[i] and judge_image_type(preprocessor_output) and preprocessor_output is not input_list[i][0]:
+                    preprocessor_cache.put(cache_keys[i], preprocessor_output, persistent=True)
+                else:
+                    cache_keys[i] = None
+
+        return outputs, cache_keys
+
     @torch.no_grad()
     def process_unit_after_click_generate(self,
                                           p: StableDiffusionProcessing,
@@ -311,6 +388,7 @@ class ControlNetForForgeOfficial(scripts.Script):
 
         input_list, resize_mode = self.get_input_data(p, unit, preprocessor, h, w)
         preprocessor_outputs = []
+        output_cache_keys = []
         control_masks = []
         preprocessor_output_is_image = False
         preprocessor_output = None
@@ -319,38 +397,57 @@ class ControlNetForForgeOfficial(scripts.Script):
             from tqdm import tqdm
             return tqdm(iterable) if use_tqdm else iterable
 
-        for input_image, input_mask in optional_tqdm(input_list, len(input_list) > 1):
-            if unit.pixel_perfect:
-                unit.processor_res = external_code.pixel_perfect_resolution(
-                    input_image,
-                    target_H=h,
-                    target_W=w,
-                    resize_mode=resize_mode,
-                )
-
-            seed = set_numpy_seed(p)
-            logger.debug(f"Use numpy seed {seed}.")
-            logger.info(f"Using preprocessor: {unit.module}")
-            logger.info(f'preprocessor resolution = {unit.processor_res}')
-
-            preprocessor_output = preprocessor(
-                input_image=input_image,
-                input_mask=input_mask,
-                resolution=unit.processor_res,
-                slider_1=unit.threshold_a,
-                slider_2=unit.threshold_b,
-            )
+        if len(input_list) > 1 and preprocessor.supports_batch():
+            preprocessor_outputs, output_cache_keys = self.run_preprocessor_batch(p, unit, preprocessor, input_list, h, w, resize_mode)
+            preprocessor_output = preprocessor_outputs[-1]
+            preprocessor_output_is_image = all(judge_image_type(x) for x in preprocessor_outputs)
+            input_image = input_list[-1][0]
+            control_masks = [input_mask for _, input_mask in input_list if input_mask is not None]
+        else:
+            for input_image, input_mask in optional_tqdm(input_list, len(input_list) > 1):
+                if unit.pixel_perfect:
+                    unit.processor_res = external_code.pixel_perfect_resolution(
+                        input_image,
+                        target_H=h,
+                        target_W=w,
+                        resize_mode=resize_mode,
+                    )
+
+                seed = set_numpy_seed(p)
+                logger.debug(f"Use numpy seed {seed}.")
+                logger.info(f"Using preprocessor: {unit.module}")
+                logger.info(f'preprocessor resolution = {unit.processor_res}')
+
+                cache_key = self.preprocessor_cache_key(unit, preprocessor, input_image, input_mask, seed)
+                preprocessor_output = preprocessor_cache.get(cache_key, persistent=True) if cache_key else None
+
+                if preprocessor_output is None:
+                    preprocessor_output = preprocessor(
+                        input_image=input_image,
+                        input_mask=input_mask,
+                        resolution=unit.processor_res,
+                        slider_1=unit.threshold_a,
+                        slider_2=unit.threshold_b,
+                    )
+                    # Only images are cached, other outputs such as embeddings may be modified by the control model.
+                    if cache_key and judge_image_type(preprocessor_output) and preprocessor_output is not input_image:
+                        preprocessor_cache.put(cache_key, preprocessor_output, persistent=True)
+                    else:
+                        cache_key = None
+                else:
+                    logger.info("Using cached preprocessor result.")
 
-            preprocessor_outputs.append(preprocessor_output)
+                preprocessor_outputs.append(preprocessor_output)
+                output_cache_keys.append(cache_key)
 
-            preprocessor_output_is_image = judge_image_type(preprocessor_output)
+                preprocessor_output_is_image = judge_image_type(preprocessor_output)
 
-            if input_mask is not None:
-                control_masks.append(input_mask)
+                if input_mask is not None:
+                    control_masks.append(input_mask)
 
-            if len(input_list) > 1 and not preprocessor_output_is_image:
-                logger.info('Batch wise input only support controlnet, control-lora, and t2i adapters!')
-                break
+                if len(input_list) > 1 and not preprocessor_output_is_image:
+                    logger.info('Batch wise input only support controlnet, control-lora, and t2i adapters!')
+                    break
 
         if has_high_res_fix:
             hr_option = unit.hr_option
@@ -365,22 +462,33 @@ class ControlNetForForgeOfficial(scripts.Script):
             ) and unit.save_detected_map:
                 p.extra_result_images.append(img)
 
+        def resized_control_cond(index, height, width):
+            """The preprocessor output resized to height x width, as an image and as a tensor."""
+            key = None if output_cache_keys[index] is None else ('resized', output_cache_keys[index], resize_mode, height, width)
+            resized = preprocessor_cache.get(key) if key else None
+            if resized is None:
+                control_cond = crop_and_resize_image(preprocessor_outputs[index], resize_mode, height, width)
+                resized = (control_cond, numpy_to_pytorch(control_cond).movedim(-1, 1))
+                if key:
+                    preprocessor_cache.put(key, resized)
+            return resized
+
         if preprocessor_output_is_image:
             params.control_cond = []
             params.control_cond_for_hr_fix = []
 
-            for preprocessor_output in preprocessor_outputs:
-                control_cond = crop_and_resize_image(preprocessor_output, resize_mode, h, w)
+            for i in range(len(preprocessor_outputs)):
+                control_cond, control_cond_tensor = resized_control_cond(i, h, w)
                 attach_extra_result_image(external_code.visualize_inpaint_mask(control_cond))
-                params.control_cond.append(numpy_to_pytorch(control_cond).movedim(-1, 1))
+                params.control_cond.append(control_cond_tensor)
 
             params.control_cond = torch.cat(params.control_cond, dim=0)[alignment_indices].contiguous()
 
             if has_high_res_fix:
-                for preprocessor_output in preprocessor_outputs:
-                    control_cond_for_hr_fix = crop_and_resize_image(preprocessor_output, resize_mode, hr_y, hr_x)
+                for i in range(len(preprocessor_outputs)):
+                    control_cond_for_hr_fix, control_cond_for_hr_fix_tensor = resized_control_cond(i, hr_y, hr_x)
                     attach_extra_result_image(external_code.visualize_inpaint_mask(control_cond_for_hr_fix), is_high_res=True)
-                    params.control_cond_for_hr_fix.append(numpy_to_pytorch(control_cond_for_hr_fix).movedim(-1, 1))
+                    params.control_cond_for_hr_fix.append(control_cond_for_hr_fix_tensor)
                 params.control_cond_for_hr_fix = torch.cat(params.control_cond_for_hr_fix, dim=0)[alignment_indices].contiguous()
             else:
                 params.control_cond_for_hr_fix = params.control_cond
@@ -605,9 +713,18 @@ def on_ui_settings():
         3, "Multi-ControlNet: ControlNet unit number (requires restart)", gr.Slider,
         {"minimum": 1, "maximum": 10, "step": 1}, section=section))
     shared.opts.add_option("control_net_model_cache_size", shared.OptionInfo(
-        5, "Model cache size (requires restart)", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1}, section=section))
+        5, "Model cache size", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1},
+        onchange=apply_model_cache_limits, section=section))
     shared.opts.add_option("control_net_ipadapter_cache_size", shared.OptionInfo(
-        5, "IPAdapter cache size (requires restart)", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1}, section=section))    
+        5, "IPAdapter cache size", gr.Slider, {"minimum": 1, "maximum": 10, "step": 1},
+        onchange=apply_model_cache_limits, section=section))
+    shared.opts.add_option("control_net_aux_model_cache_size_mb", shared.OptionInfo(
+        8192, "RAM budget for cached ControlNet, IP-Adapter, CLIP vision and preprocessor models (MB)", gr.Number,
+        onchange=apply_model_cache_limits, section=section).info("least recently used models are unloaded first"))
+    shared.opts.add_option("control_net_preprocessor_cache_size", shared.OptionInfo(
+        1024, "Preprocessor result cache size (MB)", gr.Slider, {"minimum": 0, "maximum": 16384, "step": 64}, section=section).info("0 = disable"))
+    shared.opts.add_option("control_net_preprocessor_cache_to_disk", shared.OptionInfo(
+        False, "Keep preprocessor results in the disk cache", gr.Checkbox, {"interactive": True}, section=section).info("results are reused after a restart"))
     shared.opts.add_option("control_net_no_detectmap", shared.OptionInfo(
         False, "Do not append detectmap to output", gr.Checkbox, {"interactive": True}, section=section))
     shared.opts.add_option("control_net_detectmap_autosaving", shared.OptionInfo(
@@ -5,7 +5,7 @@ import contextlib
 import os
 import math
 import time
-from cachetools import LRUCache
+from modules_forge.aux_model_cache import aux_model_cache
 
 import ldm_patched.modules.utils
 import ldm_patched.modules.model_management
@@ -265,17 +265,16 @@ def NPToTensor(image):
     return out
 
 class IPAdapter(nn.Module):
-    _cache = LRUCache(maxsize=shared.opts.data.get("control_net_ipadapter_cache_size", 5))
-
     # Factory method that caches off of the model filename
     @classmethod
     def create(cls, model_filename, ipadapter_model, cross_attention_dim=1024, output_cross_attention_dim=1024,
                clip_embeddings_dim=1024, clip_extra_context_tokens=4,
                is_sdxl=False, is_plus=False, is_full=False,
                is_faceid=False, is_instant_id=False):
-        if model_filename in cls._cache:
+        instance = aux_model_cache.get(('ipadapter', model_filename))
+        if instance is not None:
             logger.info(f"IPAdapter: Using cached layers for {model_filename}.")
-            return cls._cache[model_filename]
+            return instance
         else:
             logger.info(f"IPAdapter: Creating new layer instance for {model_filename}.")
             instance = cls(ipadapter_model, cross_attention_dim, output_cross_attention_dim,
@@ -283,7 +282,7 @@ class IPAdapter(nn.Module):
                            is_sdxl, is_plus, is_full, is_faceid, is_instant_id)
 
             if ldm_patched.modules.model_management.enable_ipadapter_layer_cache():
-                cls._cache[model_filename] = instance
+                aux_model_cache.put(('ipadapter', model_filename), instance, category='ipadapter')
 
             return instance
         
@@ -62,6 +62,7 @@ from scripts.iib.db.datamodel import (
 )
 from scripts.iib.db.update_image_data import update_image_data, rebuild_image_index, add_image_data_single
 from scripts.iib.logger import logger
+from scripts.iib.thumbnail import get_thumbnail_engine
 from scripts.iib.seq import seq
 import urllib.parse
 from scripts.iib.fastapi_video import range_requests_response, close_video_file_reader
@@ -537,21 +538,8 @@ def infinite_image_browsing_api(app: FastAPI, **kwargs):
         check_path_trust(path)
         if not cache_base_dir:
             return
-        # 生成缓存文件的路径
-        hash_dir = hashlib.md5((path + t).encode("utf-8")).hexdigest()
-        hash = hash_dir + size
-        cache_dir = os.path.join(cache_base_dir, "iib_cache", hash_dir)
-        cache_path = os.path.join(cache_dir, f"{size}.webp")
-
-        # 如果缓存文件存在，则直接返回该文件
-        if os.path.exists(cache_path):
-            return FileResponse(
-                cache_path,
-                media_type="image/webp",
-                headers={"Cache-Control": "max-age=31536000", "ETag": hash},
-            )
+        hash = hashlib.md5((path + t).encode("utf-8")).hexdigest() + size
 
-                
         # 如果小于64KB，直接返回原图
         if os.path.getsize(path) < 64 * 1024:
             return FileResponse(
@@ -559,16 +547,10 @@ def infinite_image_browsing_api(app: FastAPI, **kwargs):
                 media_type="image/" + path.split(".")[-1],
                 headers={"Cache-Control": "max-age=31536000", "ETag": hash},
             )
-        
 
-        # 如果缓存文件不存在，则生成缩略图并保存
-        with Image.open(path) as img:
-            w, h = size.split("x")
-            img.thumbnail((int(w), int(h)))
-            os.makedirs(cache_dir, exist_ok=True)
-            img.save(cache_path, "webp")
+        # 缩略图在线程池中生成，不阻塞事件循环；同一张图的并发请求共享同一个任务
+        cache_path = await get_thumbnail_engine().get(path, t, size)
 
-        # 返回缓存文件
         return FileResponse(
             cache_path,
             media_type="image/webp",
@@ -874,6 +856,7 @@ def infinite_image_browsing_api(app: FastAPI, **kwargs):
         regexp: str
         folder_paths: List[str] = None
         size: Optional[int] = 200
+        order_by: Optional[str] = "date" # "date" or "rank"; with "rank" the cursor is a result offset
 
     @app.post(db_api_base + "/search_by_substr", dependencies=[Depends(verify_secret)])
     async def search_by_substr(req: SearchBySubstrReq):
@@ -889,7 +872,8 @@ def infinite_image_browsing_api(app: FastAPI, **kwargs):
             cursor=req.cursor, 
             limit=req.size,
             regexp=req.regexp,
-            folder_paths=folder_paths
+            folder_paths=folder_paths,
+            order_by=req.order_by,
         )
         return {
             "files": filter_allowed_files([x.to_file_info() for x in imgs]),
@@ -13,12 +13,19 @@ from scripts.iib.tool import (
     find,
     unique_by,
 )
+from scripts.iib.db.tag_index import tag_bitmap_index
+from scripts.iib.logger import logger
 from contextlib import closing
 import os
+import queue
 import threading
 import re
 
 
+def escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
 class FileInfoDict(TypedDict):
     type: str
     date: float
@@ -71,11 +78,17 @@ class DataBase:
             return reg.search(item) is not None
 
         conn.create_function("regexp", 2, regexp)
+        # INSERT OR REPLACE into image must fire the delete trigger that keeps image_fts in sync
+        conn.execute("PRAGMA recursive_triggers = ON")
+        # WAL lets searches run while the index is being written and makes large write transactions cheaper
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
         try:
             Folder.create_table(conn)
             ImageTag.create_table(conn)
             Tag.create_table(conn)
             Image.create_table(conn)
+            ImageFts.create_table(conn)
             ExtraPath.create_table(conn)
             DirCoverCache.create_table(conn)
             GlobalSetting.create_table(conn)
@@ -115,6 +128,7 @@ class Image:
                 (self.path, self.exif, self.size, self.date),
             )
             self.id = cur.lastrowid
+        tag_bitmap_index.add_image(self.id, self.path, self.date)
 
     def update_path(self, conn: Connection, new_path: str, force=False):
         self.path = os.path.normpath(new_path)
@@ -122,6 +136,7 @@ class Image:
             if force: # force update path
                 cur.execute("DELETE FROM image WHERE path = ?", (self.path,))
             cur.execute("UPDATE image SET path = ? WHERE id = ?", (self.path, self.id))
+        tag_bitmap_index.update_path(self.id, self.path)
 
     @classmethod
     def get(cls, conn: Connection, id_or_path):
@@ -188,6 +203,7 @@ class Image:
         with closing(conn.cursor()) as cur:
             cur.execute("DELETE FROM image WHERE id = ?", (image_id,))
             conn.commit()
+        tag_bitmap_index.remove_images([image_id])
 
     @classmethod
     def safe_batch_remove(cls, conn: Connection, image_ids: List[int]) -> None:
@@ -207,12 +223,23 @@ class Image:
                 print(e)
             finally:
                 conn.commit()
+        tag_bitmap_index.remove_images(image_ids)
 
     @classmethod
     def find_by_substring(
         cls, conn: Connection, substring: str, limit: int = 500, cursor="", regexp="",
-        folder_paths: List[str] = []
+        folder_paths: List[str] = [], order_by="date"
     ) -> tuple[List["Image"], Cursor]:
+        """
+        Search images whose path or generation info contains substring, or whose generation info matches regexp.
+
+        Substring searches use the image_fts index when possible. Results are ordered by date with the date of the
+        last image as cursor, or with order_by="rank" by relevance with the offset of the next page as cursor.
+        """
+        fts_query = None if regexp else ImageFts.build_query(substring)
+        if order_by == "rank" and fts_query:
+            return cls.find_by_fts_rank(conn, fts_query, limit, cursor, folder_paths)
+
         api_cur = Cursor()
         with closing(conn.cursor()) as cur:
             params = []
@@ -220,6 +247,9 @@ class Image:
             if regexp:
                 where_clauses.append("(exif REGEXP ?)")
                 params.append(regexp)
+            elif fts_query:
+                where_clauses.append("(id IN (SELECT rowid FROM image_fts WHERE image_fts MATCH ?))")
+                params.append(fts_query)
             else:
                 where_clauses.append("(path LIKE ? OR exif LIKE ?)")
                 params.extend((f"%{substring}%", f"%{substring}%"))
@@ -229,8 +259,8 @@ class Image:
             if folder_paths:
                 folder_clauses = []
                 for folder_path in folder_paths:
-                    folder_clauses.append("(image.path LIKE ?)")
-                    params.append(os.path.join(folder_path, "%"))
+                    folder_clauses.append("(image.path LIKE ? ESCAPE '\\')")
+                    params.append(escape_like(os.path.join(folder_path, "")) + "%")
                 where_clauses.append("(" + " OR ".join(folder_clauses) + ")")
             sql = "SELECT * FROM image"
             if where_clauses:
@@ -242,19 +272,130 @@ class Image:
             rows = cur.fetchall()
 
         api_cur.has_next = len(rows) >= limit
-        images = []
-        deleted_ids = []
-        for row in rows:
-            img = cls.from_row(row)
-            if os.path.exists(img.path):
-                images.append(img)
-            else:
-                deleted_ids.append(img.id)
-        cls.safe_batch_remove(conn, deleted_ids)
+        images = [cls.from_row(row) for row in rows]
+        MissingImageReconciler.check(images)
         if images:
             api_cur.next = str(images[-1].date)
         return images, api_cur
 
+    @classmethod
+    def find_by_fts_rank(
+        cls, conn: Connection, fts_query: str, limit: int, cursor="", folder_paths: List[str] = []
+    ) -> tuple[List["Image"], Cursor]:
+        offset = int(cursor) if cursor else 0
+        with closing(conn.cursor()) as cur:
+            params = [fts_query]
+            sql = "SELECT image.* FROM image_fts JOIN image ON image.id = image_fts.rowid WHERE image_fts MATCH ?"
+            if folder_paths:
+                folder_clauses = []
+                for folder_path in folder_paths:
+                    folder_clauses.append("(image.path LIKE ? ESCAPE '\\')")
+                    params.append(escape_like(os.path.join(folder_path, "")) + "%")
+                sql += " AND (" + " OR ".join(folder_clauses) + ")"
+            sql += " ORDER BY image_fts.rank LIMIT ? OFFSET ?"
+            params.extend((limit, offset))
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+
+        images = [cls.from_row(row) for row in rows]
+        MissingImageReconciler.check(images)
+        return images, Cursor(has_next=len(rows) >= limit, next=str(offset + len(rows)))
+
+
+class ImageFts:
+    """
+    FTS5 index over image.path and image.exif (the raw generation info: prompt, negative prompt and parameters).
+
+    It is an external content table kept in sync with the image table by triggers. The trigram tokenizer gives the
+    same case-insensitive substring semantics as the LIKE scan it replaces, for queries of at least 3 characters.
+    """
+
+    available = False
+
+    @classmethod
+    def create_table(cls, conn):
+        with closing(conn.cursor()) as cur:
+            cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'image_fts'")
+            exists = cur.fetchone() is not None
+            try:
+                cur.execute(
+                    """CREATE VIRTUAL TABLE IF NOT EXISTS image_fts USING fts5(
+                        path, exif, content='image', content_rowid='id', tokenize='trigram'
+                    )"""
+                )
+            except sqlite3.OperationalError as e:
+                # sqlite built without fts5 or older than 3.34, searches fall back to LIKE
+                print(f"FTS5 index unavailable, using full table scans for search: {e}")
+                cls.available = False
+                return
+            cur.execute(
+                """CREATE TRIGGER IF NOT EXISTS image_fts_ai AFTER INSERT ON image BEGIN
+                    INSERT INTO image_fts(rowid, path, exif) VALUES (new.id, new.path, new.exif);
+                END"""
+            )
+            cur.execute(
+                """CREATE TRIGGER IF NOT EXISTS image_fts_ad AFTER DELETE ON image BEGIN
+                    INSERT INTO image_fts(image_fts, rowid, path, exif) VALUES ('delete', old.id, old.path, old.exif);
+                END"""
+            )
+            cur.execute(
+                """CREATE TRIGGER IF NOT EXISTS image_fts_au AFTER UPDATE OF path, exif ON image BEGIN
+                    INSERT INTO image_fts(image_fts, rowid, path, exif) VALUES ('delete', old.id, old.path, old.exif);
+                    INSERT INTO image_fts(rowid, path, exif) VALUES (new.id, new.path, new.exif);
+                END"""
+            )
+            if not exists:
+                print("Building full-text search index for existing images")
+                cur.execute("INSERT INTO image_fts(image_fts) VALUES ('rebuild')")
+        cls.available = True
+
+    @classmethod
+    def build_query(cls, substring: str) -> Optional[str]:
+        """Returns an FTS5 query matching substring anywhere, or None if the index can't answer it."""
+        if not cls.available or len(substring) < 3:
+            return None
+        return '"' + substring.replace('"', '""') + '"'
+
+
+class MissingImageReconciler:
+    """
+    Removes images whose files no longer exist from the index, in a background thread.
+
+    Search results are returned without touching the file system; the files of returned images are checked
+    afterwards so that deleted files stop showing up in later searches. Checks are best effort: when the
+    worker falls behind, new batches are dropped instead of queued.
+    """
+
+    max_queued_batches = 64
+    pending = queue.Queue(maxsize=max_queued_batches)
+    thread: Optional[threading.Thread] = None
+    lock = threading.Lock()
+
+    @classmethod
+    def check(cls, images: List[Image]):
+        if not images:
+            return
+        with cls.lock:
+            if cls.thread is None or not cls.thread.is_alive():
+                cls.thread = threading.Thread(target=cls.run, daemon=True)
+                cls.thread.start()
+        try:
+            cls.pending.put_nowait([(img.id, img.path) for img in images])
+        except queue.Full:
+            pass
+
+    @classmethod
+    def run(cls):
+        conn = DataBase.get_conn()
+        while True:
+            batch = cls.pending.get()
+            try:
+                deleted_ids = [id for id, path in batch if not os.path.exists(path)]
+                if deleted_ids:
+                    Image.safe_batch_remove(conn, deleted_ids)
+            except Exception as e:
+                logger.error(f"failed to remove missing images from index: {e}")
+
 
 class Tag:
     def __init__(self, name: str, score: int, type: str, count=0, color = ""):
@@ -279,6 +420,7 @@ class Tag:
         with closing(conn.cursor()) as cur:
             cur.execute("DELETE FROM tag WHERE id = ?", (tag_id,))
             conn.commit()
+        tag_bitmap_index.remove_tag(tag_id=tag_id)
 
     @classmethod
     def get(cls, conn: Connection, id):
@@ -372,6 +514,7 @@ class ImageTag:
                 "INSERT INTO image_tag (image_id, tag_id, created_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
                 (self.image_id, self.tag_id),
             )
+        tag_bitmap_index.add_tag(self.image_id, self.tag_id)
 
     def save_or_ignore(self, conn):
         with closing(conn.cursor()) as cur:
@@ -379,6 +522,7 @@ class ImageTag:
                 "INSERT OR IGNORE INTO image_tag (image_id, tag_id, created_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
                 (self.image_id, self.tag_id),
             )
+        tag_bitmap_index.add_tag(self.image_id, self.tag_id)
 
     @classmethod
     def get_tags_for_image(
@@ -449,6 +593,13 @@ class ImageTag:
         cursor="",
         folder_paths: List[str] = None,
     ) -> tuple[List[Image], Cursor]:
+        if tag_bitmap_index.enabled:
+            try:
+                return cls.get_images_by_tags_from_index(conn, tag_dict, limit, cursor, folder_paths)
+            except Exception as e:
+                print(f"Tag bitmap index query failed, falling back to sql: {e}")
+                tag_bitmap_index.invalidate()
+
         query = """
             SELECT image.id, image.path, image.size,image.date
             FROM image
@@ -493,8 +644,9 @@ class ImageTag:
         if folder_paths:
             folder_clauses = []
             for folder_path in folder_paths:
-                folder_clauses.append("(image.path LIKE ?)")
-                params.append(os.path.join(folder_path, "%"))
+                # % and _ in folder names are literal; LIKE ignores ASCII case, as the bitmap index does
+                folder_clauses.append("(image.path LIKE ? ESCAPE '\\')")
+                params.append(escape_like(os.path.join(folder_path, "")) + "%")
                 print(folder_path)
             where_clauses.append("(" + " OR ".join(folder_clauses) + ")")
 
@@ -528,6 +680,24 @@ class ImageTag:
                 api_cur.next = str(images[-1].date)
             return images, api_cur
 
+    @classmethod
+    def get_images_by_tags_from_index(
+        cls,
+        conn: Connection,
+        tag_dict: Dict[str, List[int]],
+        limit: int = 500,
+        cursor="",
+        folder_paths: List[str] = None,
+    ) -> tuple[List[Image], Cursor]:
+        ids, has_next = tag_bitmap_index.query(conn, tag_dict, limit, cursor, folder_paths)
+        images_by_id = {img.id: img for img in Image.get_by_ids(conn, ids)}
+        images = [images_by_id[id] for id in ids if id in images_by_id]
+        MissingImageReconciler.check(images)
+        api_cur = Cursor(has_next=has_next)
+        if images:
+            api_cur.next = str(images[-1].date)
+        return images, api_cur
+
     @classmethod
     def batch_get_tags_by_path(
         cls, conn: Connection, paths: List[str], type="custom"
@@ -573,6 +743,7 @@ class ImageTag:
             else:
                 cur.execute("DELETE FROM image_tag WHERE image_id = ?", (image_id,))
             conn.commit()
+        tag_bitmap_index.remove_tag(image_id=image_id, tag_id=tag_id)
 
 
 class Folder:
@@ -593,7 +764,8 @@ class Folder:
             cur.execute("CREATE INDEX IF NOT EXISTS folders_idx_path ON folders(path)")
 
     @classmethod
-    def check_need_update(cls, conn: Connection, folder_path: str):
+    def check_need_update(cls, conn: Connection, folder_path: str, modified_date: Optional[str] = None):
+        """modified_date: compare the record with this date instead of the current modified date of the folder"""
         folder_path = os.path.normpath(folder_path)
         with closing(conn.cursor()) as cur:
             if not os.path.exists(folder_path):
@@ -601,9 +773,15 @@ class Folder:
             cur.execute("SELECT * FROM folders WHERE path=?", (folder_path,))
             folder_record = cur.fetchone()  # 如果这个文件夹没有记录，或者修改时间与数据库不同，则需要修改
             return not folder_record or (
-                folder_record[2] != get_modified_date(folder_path)
+                folder_record[2] != (modified_date or get_modified_date(folder_path))
             )
 
+    @classmethod
+    def exists(cls, conn: Connection, folder_path: str):
+        with closing(conn.cursor()) as cur:
+            cur.execute("SELECT 1 FROM folders WHERE path = ?", (os.path.normpath(folder_path),))
+            return cur.fetchone() is not None
+
     @classmethod
     def update_modified_date_or_create(cls, conn: Connection, folder_path: str):
         folder_path = os.path.normpath(folder_path)
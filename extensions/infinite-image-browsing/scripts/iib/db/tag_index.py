@@ -0,0 +1,332 @@
+from array import array
+from bisect import bisect_left
+from contextlib import closing
+from sqlite3 import Connection
+from typing import Dict, Iterable, List, Optional
+import os
+import string
+import threading
+
+
+chunk_bits = 16
+chunk_mask = (1 << chunk_bits) - 1
+dense_chunk_bytes = (1 << chunk_bits) // 8
+max_sparse_chunk_len = 4096  # above this a sorted array of positions is larger than a dense bitmap of the chunk
+
+ascii_lower = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def fold_path_case(path: str) -> str:
+    """Lowercases ASCII letters only, the same way sqlite's LIKE ignores case, so that folder filters match the
+    same images as the sql fallback."""
+    return path.translate(ascii_lower)
+
+
+class Bitmap:
+    """
+    Compressed bitmap of non-negative ints in the style of roaring bitmaps.
+
+    Positions are split into chunks of 65536. A chunk is stored as a sorted array('H') of the low 16 bits while it
+    has up to 4096 positions and as a 8 KB bytearray after that, so a tag used by a few images takes a few bytes no
+    matter how many images there are. add and discard change chunks in place.
+    """
+
+    __slots__ = ("chunks",)
+
+    def __init__(self):
+        self.chunks: Dict[int, object] = {}
+
+    @classmethod
+    def from_positions(cls, positions: Iterable[int]) -> "Bitmap":
+        res = cls()
+        grouped: Dict[int, List[int]] = {}
+        for pos in positions:
+            grouped.setdefault(pos >> chunk_bits, []).append(pos & chunk_mask)
+        for key, lows in grouped.items():
+            lows = sorted(set(lows))
+            if len(lows) > max_sparse_chunk_len:
+                chunk = bytearray(dense_chunk_bytes)
+                for low in lows:
+                    chunk[low >> 3] |= 1 << (low & 7)
+                res.chunks[key] = chunk
+            else:
+                res.chunks[key] = array("H", lows)
+        return res
+
+    def add(self, pos: int):
+        key, low = pos >> chunk_bits, pos & chunk_mask
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            self.chunks[key] = array("H", [low])
+        elif isinstance(chunk, bytearray):
+            chunk[low >> 3] |= 1 << (low & 7)
+        elif not chunk or low > chunk[-1]:
+            chunk.append(low)
+        else:
+            i = bisect_left(chunk, low)
+            if i < len(chunk) and chunk[i] == low:
+                return
+            chunk.insert(i, low)
+
+        if isinstance(chunk, array) and len(chunk) > max_sparse_chunk_len:
+            dense = bytearray(dense_chunk_bytes)
+            for low in chunk:
+                dense[low >> 3] |= 1 << (low & 7)
+            self.chunks[key] = dense
+
+    def discard(self, pos: int):
+        key, low = pos >> chunk_bits, pos & chunk_mask
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            return
+        if isinstance(chunk, bytearray):
+            chunk[low >> 3] &= ~(1 << (low & 7)) & 0xFF
+        else:
+            i = bisect_left(chunk, low)
+            if i < len(chunk) and chunk[i] == low:
+                del chunk[i]
+
+    def __contains__(self, pos: int) -> bool:
+        key, low = pos >> chunk_bits, pos & chunk_mask
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            return False
+        if isinstance(chunk, bytearray):
+            return bool(chunk[low >> 3] & (1 << (low & 7)))
+        i = bisect_left(chunk, low)
+        return i < len(chunk) and chunk[i] == low
+
+    def chunk_int(self, key: int) -> int:
+        """Returns the chunk as an int with bit n set for position key * 65536 + n, for bitwise operations."""
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            return 0
+        if isinstance(chunk, bytearray):
+            return int.from_bytes(chunk, "little")
+        bits = bytearray(dense_chunk_bytes)
+        for low in chunk:
+            bits[low >> 3] |= 1 << (low & 7)
+        return int.from_bytes(bits, "little")
+
+
+class TagBitmapIndex:
+    """
+    In-memory inverted index from tag to images, used to answer match_images_by_tags without SQL joins.
+
+    Images get a position in date order and each tag is a compressed Bitmap of the positions of its images. Queries
+    walk the chunks from the newest down and combine them with bitwise AND/OR/NOT until enough images are found.
+    Images are expected to arrive mostly in date order; new images are appended and anything else marks the index
+    for a rebuild on the next query. The index is kept up to date by the write methods in datamodel; writes that
+    don't go through them call invalidate().
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.valid = False
+        self.enabled = os.getenv("IIB_TAG_BITMAP_INDEX", "true").lower() != "false"
+
+    def invalidate(self):
+        with self.lock:
+            self.valid = False
+
+    def build(self, conn: Connection):
+        with closing(conn.cursor()) as cur:
+            cur.execute("SELECT id, path, date FROM image ORDER BY date, id")
+            rows = cur.fetchall()
+            self.ids = [row[0] for row in rows]
+            self.paths = [row[1] for row in rows]
+            self.dates = [row[2] for row in rows]
+            self.pos_by_id = {id: pos for pos, id in enumerate(self.ids)}
+            self.id_by_path = {path: id for id, path in zip(self.ids, self.paths)}
+            self.max_id = max(self.ids, default=0)
+
+            positions: Dict[int, List[int]] = {}
+            cur.execute("SELECT image_id, tag_id FROM image_tag")
+            for image_id, tag_id in cur:
+                pos = self.pos_by_id.get(image_id)
+                if pos is not None:
+                    positions.setdefault(tag_id, []).append(pos)
+
+        self.tags = {tag_id: Bitmap.from_positions(pos) for tag_id, pos in positions.items()}
+        self.tagged = Bitmap.from_positions(pos for pos_list in positions.values() for pos in pos_list)
+        self.alive = Bitmap.from_positions(range(len(self.ids)))
+        self.folders: Dict[str, Bitmap] = {}
+        self.valid = True
+
+    def ensure_built(self, conn: Connection):
+        if self.valid:
+            with closing(conn.cursor()) as cur:
+                # images inserted by another process
+                cur.execute("SELECT MAX(id) FROM image")
+                if (cur.fetchone()[0] or 0) > self.max_id:
+                    self.valid = False
+        if not self.valid:
+            self.build(conn)
+
+    def add_image(self, image_id: int, path: str, date: str):
+        with self.lock:
+            if not self.valid:
+                return
+            if self.dates and date < self.dates[-1]:
+                self.valid = False
+                return
+            replaced = self.id_by_path.get(path)
+            if replaced is not None:
+                self.remove_images([replaced])
+            pos = len(self.ids)
+            self.ids.append(image_id)
+            self.paths.append(path)
+            self.dates.append(date)
+            self.pos_by_id[image_id] = pos
+            self.id_by_path[path] = image_id
+            self.max_id = max(self.max_id, image_id)
+            self.alive.add(pos)
+            folded_path = fold_path_case(path)
+            for prefix, bitmap in self.folders.items():
+                if folded_path.startswith(prefix):
+                    bitmap.add(pos)
+
+    def remove_images(self, image_ids: List[int]):
+        with self.lock:
+            if not self.valid:
+                return
+            for image_id in image_ids:
+                pos = self.pos_by_id.pop(image_id, None)
+                if pos is None:
+                    continue
+                if self.id_by_path.get(self.paths[pos]) == image_id:
+                    del self.id_by_path[self.paths[pos]]
+                self.alive.discard(pos)
+
+    def update_path(self, image_id: int, path: str):
+        with self.lock:
+            if not self.valid:
+                return
+            pos = self.pos_by_id.get(image_id)
+            if pos is None:
+                self.valid = False
+                return
+            replaced = self.id_by_path.get(path)
+            if replaced is not None and replaced != image_id:
+                self.remove_images([replaced])
+            self.id_by_path.pop(self.paths[pos], None)
+            self.paths[pos] = path
+            self.id_by_path[path] = image_id
+            self.folders = {}
+
+    def add_tag(self, image_id: int, tag_id: int):
+        with self.lock:
+            if not self.valid:
+                return
+            pos = self.pos_by_id.get(image_id)
+            if pos is None:
+                self.valid = False
+                return
+            bitmap = self.tags.get(tag_id)
+            if bitmap is None:
+                bitmap = self.tags[tag_id] = Bitmap()
+            bitmap.add(pos)
+            self.tagged.add(pos)
+
+    def remove_tag(self, image_id: Optional[int] = None, tag_id: Optional[int] = None):
+        with self.lock:
+            if not self.valid:
+                return
+            # images without tags are excluded from tag queries, so tagged is updated for images losing their last tag
+            if image_id and tag_id:
+                pos = self.pos_by_id.get(image_id)
+                if pos is not None and tag_id in self.tags:
+                    self.tags[tag_id].discard(pos)
+                    if not any(pos in bitmap for bitmap in self.tags.values()):
+                        self.tagged.discard(pos)
+            elif tag_id:
+                removed = self.tags.pop(tag_id, None)
+                if removed is None:
+                    return
+                for key in removed.chunks:
+                    still_tagged = 0
+                    for bitmap in self.tags.values():
+                        still_tagged |= bitmap.chunk_int(key)
+                    untagged = removed.chunk_int(key) & ~still_tagged
+                    while untagged:
+                        low = untagged.bit_length() - 1
+                        self.tagged.discard((key << chunk_bits) | low)
+                        untagged ^= 1 << low
+            else:
+                pos = self.pos_by_id.get(image_id)
+                if pos is None:
+                    return
+                for bitmap in self.tags.values():
+                    bitmap.discard(pos)
+                self.tagged.discard(pos)
+
+    def folder_bitmaps(self, folder_paths: List[str]) -> List[Bitmap]:
+        res = []
+        for folder_path in folder_paths:
+            prefix = fold_path_case(os.path.join(folder_path, ""))
+            bitmap = self.folders.get(prefix)
+            if bitmap is None:
+                bitmap = Bitmap.from_positions(pos for pos, path in enumerate(self.paths) if fold_path_case(path).startswith(prefix))
+                self.folders[prefix] = bitmap
+            res.append(bitmap)
+        return res
+
+    def query(
+        self,
+        conn: Connection,
+        tag_dict: Dict[str, List[int]],
+        limit: int,
+        cursor="",
+        folder_paths: List[str] = None,
+    ) -> tuple[List[int], bool]:
+        """Returns the ids of up to limit matching images, newest first, and whether there are more."""
+        with self.lock:
+            self.ensure_built(conn)
+
+            empty = Bitmap()
+            and_tags = [self.tags.get(tag_id, empty) for tag_id in tag_dict.get("and") or []]
+            or_tags = [self.tags.get(tag_id, empty) for tag_id in tag_dict.get("or") or []]
+            not_tags = [self.tags.get(tag_id, empty) for tag_id in tag_dict.get("not") or []]
+            folders = self.folder_bitmaps(folder_paths) if folder_paths else None
+
+            # only chunks that can contain a match are visited
+            keys = set(self.tagged.chunks)
+            for bitmap in and_tags:
+                keys.intersection_update(bitmap.chunks)
+            if tag_dict.get("or"):
+                keys.intersection_update(set().union(*(bitmap.chunks for bitmap in or_tags)))
+            if folders is not None:
+                keys.intersection_update(set().union(*(bitmap.chunks for bitmap in folders)))
+            end = bisect_left(self.dates, cursor) if cursor else len(self.dates)
+            keys = sorted((key for key in keys if key << chunk_bits < end), reverse=True)
+
+            ids = []
+            for key in keys:
+                bits = self.alive.chunk_int(key) & self.tagged.chunk_int(key)
+                for bitmap in and_tags:
+                    bits &= bitmap.chunk_int(key)
+                if tag_dict.get("or"):
+                    any_of = 0
+                    for bitmap in or_tags:
+                        any_of |= bitmap.chunk_int(key)
+                    bits &= any_of
+                for bitmap in not_tags:
+                    bits &= ~bitmap.chunk_int(key)
+                if folders is not None:
+                    in_folders = 0
+                    for bitmap in folders:
+                        in_folders |= bitmap.chunk_int(key)
+                    bits &= in_folders
+                if end < (key + 1) << chunk_bits:
+                    bits &= (1 << (end - (key << chunk_bits))) - 1
+
+                while bits and len(ids) < limit:
+                    low = bits.bit_length() - 1
+                    ids.append(self.ids[(key << chunk_bits) | low])
+                    bits ^= 1 << low
+                if len(ids) >= limit:
+                    break
+            return ids, len(ids) >= limit
+
+
+tag_bitmap_index = TagBitmapIndex()
@@ -1,8 +1,16 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from contextlib import closing
-from typing import Dict, List
+from typing import Dict, List, Optional
+import multiprocessing
 from scripts.iib.db.datamodel import Image as DbImg, Tag, ImageTag, DataBase, Folder
+from scripts.iib.db.tag_index import tag_bitmap_index
 import os
+import queue
+import threading
+import time
 from scripts.iib.tool import (
+    parse_generation_parameters,
     is_valid_media_path,
     get_modified_date,
     get_video_type,
@@ -29,17 +37,21 @@ def get_exif_data(file_path):
 
 
 def update_image_data(search_dirs: List[str], is_rebuild = False):
+    """
+    Index new and modified media files under search_dirs.
+
+    Folders are walked on this thread, metadata is parsed on a process pool and the results are written in large
+    batches with cached tag ids.
+    """
     conn = DataBase.get_conn()
-    tag_incr_count_rec: Dict[int, int] = {}
 
     if is_rebuild:
         Folder.remove_all(conn)
 
-    def safe_save_img_tag(img_tag: ImageTag):
-        tag_incr_count_rec[img_tag.tag_id] = (
-            tag_incr_count_rec.get(img_tag.tag_id, 0) + 1
-        )
-        img_tag.save_or_ignore(conn)  # 原先用来处理一些意外，但是写的正确完全没问题,去掉了try catch
+    pending_files: List[str] = []
+    stale_ids: Dict[str, int] = {}  # file path -> id of the outdated record to replace
+    existing_ids: Dict[str, int] = {}  # file path -> id of the record kept during a rebuild
+    updated_folders: List[str] = []
 
     # 递归处理每个文件夹
     def process_folder(folder_path: str):
@@ -49,27 +61,231 @@ def update_image_data(search_dirs: List[str], is_rebuild = False):
         for filename in os.listdir(folder_path):
             file_path = os.path.normpath(os.path.join(folder_path, filename))
             try:
-
                 if os.path.isdir(file_path):
                     process_folder(file_path)
                 elif is_valid_media_path(file_path):
-                    build_single_img_idx(conn, file_path, is_rebuild, safe_save_img_tag)
-                # neg暂时跳过感觉个没人会搜索这个
+                    img = DbImg.get(conn, file_path)
+                    if img and is_rebuild:
+                        existing_ids[file_path] = img.id
+                    elif img:
+                        if img.date == get_modified_date(img.path):  # 已存在的跳过
+                            continue
+                        stale_ids[file_path] = img.id
+                    pending_files.append(file_path)
             except Exception as e:
                 logger.error("Tag generation failed. Skipping this file. file:%s error: %s", file_path, e)
-        # 提交对数据库的更改
-        Folder.update_modified_date_or_create(conn, folder_path)
-        conn.commit()
+        updated_folders.append(folder_path)
 
     for dir in search_dirs:
         process_folder(dir)
-        conn.commit()
-    for tag_id in tag_incr_count_rec:
-        tag = Tag.get(conn, tag_id)
-        tag.count += tag_incr_count_rec[tag_id]
-        tag.save(conn)
+
+    writer = ImageIndexWriter(conn)
+    for result in parse_media_files(pending_files):
+        if result is None:
+            continue
+        file_path = result[0]
+        writer.add(*result, image_id=existing_ids.get(file_path), stale_id=stale_ids.get(file_path))
+    writer.close()
+
+    # 文件全部写入后再更新文件夹的修改时间，中断时下次会重新扫描
+    for folder_path in updated_folders:
+        Folder.update_modified_date_or_create(conn, folder_path)
     conn.commit()
 
+
+def parse_media_file(file_path: str):
+    """Runs in the index worker processes; returns (path, raw info, size, date, tags) or None on error."""
+    try:
+        info = get_exif_data(file_path)
+        tags = get_img_tags(file_path, info.params) if info.params else []
+        return file_path, info.raw_info, os.path.getsize(file_path), get_modified_date(file_path), tags
+    except Exception as e:
+        logger.error("Tag generation failed. Skipping this file. file:%s error: %s", file_path, e)
+        return None
+
+
+def parse_media_files(file_paths: List[str]):
+    workers = int(os.getenv("IIB_INDEX_WORKERS") or os.cpu_count() or 1)
+    # 文件较少时不值得启动进程池
+    if workers <= 1 or len(file_paths) < 64:
+        yield from map(parse_media_file, file_paths)
+        return
+
+    # fork 会复制已初始化 CUDA 和大量线程的 webui 进程，子进程可能死锁，所以使用 spawn
+    done = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            for result in executor.map(parse_media_file, file_paths, chunksize=32):
+                done += 1
+                yield result
+    except BrokenProcessPool as e:
+        logger.error("Index worker processes failed, parsing the remaining files on the current thread. error: %s", e)
+        yield from map(parse_media_file, file_paths[done:])
+
+
+class ImageIndexWriter:
+    """
+    Writes parsed images to the database in batches of batch_size images per transaction.
+
+    Tag ids are cached in memory and tag counts are updated once when the writer is closed.
+    """
+
+    def __init__(self, conn, batch_size=1000):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.tag_ids = {(tag.name, tag.type): tag.id for tag in Tag.get_all(conn)}
+        self.tag_incr_count_rec: Dict[int, int] = {}
+        self.pending = []
+
+    def get_tag_id(self, name: str, type: str):
+        key = (name, type)
+        tag_id = self.tag_ids.get(key)
+        if tag_id is None:
+            tag_id = Tag.get_or_create(self.conn, name, type).id
+            self.tag_ids[key] = tag_id
+        return tag_id
+
+    def add(self, file_path, raw_info, size, date, tags, image_id=None, stale_id=None):
+        self.pending.append((file_path, raw_info, size, date, tags, image_id, stale_id))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+
+        DbImg.safe_batch_remove(self.conn, [x[6] for x in batch if x[6] is not None])
+        with closing(self.conn.cursor()) as cur:
+            new_images = [x[:4] for x in batch if x[5] is None]
+            cur.executemany(
+                "INSERT OR REPLACE INTO image (path, exif, size, date) VALUES (?, ?, ?, ?)",
+                new_images,
+            )
+            image_ids = {x[0]: x[5] for x in batch if x[5] is not None}
+            for i in range(0, len(new_images), 500):
+                paths = [x[0] for x in new_images[i : i + 500]]
+                cur.execute(
+                    "SELECT id, path FROM image WHERE path IN ({})".format(",".join("?" * len(paths))),
+                    paths,
+                )
+                image_ids.update((path, id) for id, path in cur.fetchall())
+
+            image_tags = []
+            for file_path, _, _, _, tags, _, _ in batch:
+                image_id = image_ids[file_path]
+                for name, type in tags:
+                    if not name:
+                        continue
+                    tag_id = self.get_tag_id(name, type)
+                    self.tag_incr_count_rec[tag_id] = self.tag_incr_count_rec.get(tag_id, 0) + 1
+                    image_tags.append((image_id, tag_id))
+            cur.executemany(
+                "INSERT OR IGNORE INTO image_tag (image_id, tag_id, created_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
+                image_tags,
+            )
+        self.conn.commit()
+
+        for path, _, _, date in sorted(new_images, key=lambda x: x[3]):
+            tag_bitmap_index.add_image(image_ids[path], path, date)
+        for image_id, tag_id in image_tags:
+            tag_bitmap_index.add_tag(image_id, tag_id)
+
+    def close(self):
+        self.flush()
+        with closing(self.conn.cursor()) as cur:
+            cur.executemany(
+                "UPDATE tag SET count = count + ? WHERE id = ?",
+                [(count, tag_id) for tag_id, count in self.tag_incr_count_rec.items()],
+            )
+        self.tag_incr_count_rec = {}
+        self.conn.commit()
+
+
+class SavedImageIndexer:
+    """
+    Adds images saved by sd-webui to the index on a background thread, using the infotext sd-webui already has.
+
+    Only images in folders that are already indexed are added. Saved images are written in batches, and the
+    modified date of their folders is updated afterwards so the next update_image_data doesn't rescan them -
+    but only for folders that were up to date before the images were saved, so that files added by something
+    else are still picked up by the next rescan.
+    """
+
+    queue = None
+    lock = threading.Lock()
+    batch_interval = 1  # seconds to collect saved images before writing them
+    folder_dates: Dict[str, str] = {}  # folder -> its modified date before the first image of the batch was saved
+
+    @classmethod
+    def before_save(cls, file_path: str):
+        folder_path = os.path.dirname(os.path.normpath(os.path.abspath(file_path)))
+        with cls.lock:
+            if folder_path in cls.folder_dates or not os.path.isdir(folder_path):
+                return
+            cls.folder_dates[folder_path] = get_modified_date(folder_path)
+
+    @classmethod
+    def enqueue(cls, file_path: str, infotext: Optional[str]):
+        with cls.lock:
+            if cls.queue is None:
+                cls.queue = queue.Queue()
+                threading.Thread(target=cls.run, daemon=True).start()
+        cls.queue.put((os.path.normpath(os.path.abspath(file_path)), infotext))
+
+    @classmethod
+    def run(cls):
+        conn = DataBase.get_conn()
+        while True:
+            batch = [cls.queue.get()]
+            time.sleep(cls.batch_interval)
+            while not cls.queue.empty():
+                batch.append(cls.queue.get())
+            try:
+                cls.write(conn, batch)
+            except Exception as e:
+                logger.error("Failed to index saved images: %s", e)
+
+    @classmethod
+    def write(cls, conn, batch):
+        with cls.lock:
+            folder_dates, cls.folder_dates = cls.folder_dates, {}
+
+        writer = ImageIndexWriter(conn)
+        folders = set()
+        for file_path, infotext in batch:
+            folder_path = os.path.dirname(file_path)
+            if not (folder_path in folders or Folder.exists(conn, folder_path)):
+                continue
+            if not is_valid_media_path(file_path):
+                continue
+            folders.add(folder_path)
+
+            raw_info = None
+            tags = []
+            if infotext:
+                raw_info = infotext + ", Source Identifier: Stable Diffusion web UI"
+                params = parse_generation_parameters(raw_info)
+                parsed_params = ImageGenerationParams(meta=params["meta"], pos_prompt=params["pos_prompt"], extra=params)
+                tags = get_img_tags(file_path, parsed_params)
+            img = DbImg.get(conn, file_path)
+            writer.add(
+                file_path,
+                raw_info,
+                os.path.getsize(file_path),
+                get_modified_date(file_path),
+                tags,
+                stale_id=img.id if img else None,
+            )
+        writer.close()
+
+        for folder_path in folders:
+            date_before_save = folder_dates.get(folder_path)
+            if date_before_save and not Folder.check_need_update(conn, folder_path, date_before_save):
+                Folder.update_modified_date_or_create(conn, folder_path)
+        conn.commit()
+
+
 def add_image_data_single(file_path):
     conn = DataBase.get_conn()
     tag_incr_count_rec: Dict[int, int] = {}
@@ -108,6 +324,7 @@ def rebuild_image_index(search_dirs: List[str]):
         )
         cur.execute("""DELETE FROM tag WHERE tag.type <> 'custom'""")
         conn.commit()
+        tag_bitmap_index.invalidate()
         update_image_data(search_dirs=search_dirs, is_rebuild=True)
 
 
@@ -152,18 +369,20 @@ def build_single_img_idx(conn, file_path, is_rebuild, safe_save_img_tag):
 
     if not parsed_params:
         return
+    for name, type in get_img_tags(file_path, parsed_params):
+        tag = Tag.get_or_create(conn, name, type)
+        safe_save_img_tag(ImageTag(img.id, tag.id))
+
+
+def get_img_tags(file_path, parsed_params: ImageGenerationParams):
+    """Returns the (name, type) of the tags for an image with the given generation params."""
+    tags = []
     meta = parsed_params.meta
     lora = parsed_params.extra.get("lora", [])
     lyco = parsed_params.extra.get("lyco", [])
     pos = parsed_params.pos_prompt
-    size_tag = Tag.get_or_create(
-        conn,
-        str(meta.get("Size-1", 0)) + " * " + str(meta.get("Size-2", 0)),
-        type="size",
-    )
-    safe_save_img_tag(ImageTag(img.id, size_tag.id))
-    media_type_tag = Tag.get_or_create(conn, "Image" if is_image_file(file_path) else "Video", 'Media Type')
-    safe_save_img_tag(ImageTag(img.id, media_type_tag.id))
+    tags.append((str(meta.get("Size-1", 0)) + " * " + str(meta.get("Size-2", 0)), "size"))
+    tags.append(("Image" if is_image_file(file_path) else "Video", 'Media Type'))
     keys = [
         "Model",
         "Sampler",
@@ -179,21 +398,16 @@ def build_single_img_idx(conn, file_path, is_rebuild, safe_save_img_tag):
         v = case_insensitive_get(meta, k)
         if not v:
             continue
-        
-        tag = Tag.get_or_create(conn, str(v), k)
-        safe_save_img_tag(ImageTag(img.id, tag.id))
+
+        tags.append((str(v), k))
         if "Hires upscaler" == k:
-            tag = Tag.get_or_create(conn, 'Hires All', k)
-            safe_save_img_tag(ImageTag(img.id, tag.id))
+            tags.append(('Hires All', k))
         elif "Refiner" == k:
-            tag = Tag.get_or_create(conn, 'Refiner All', k)
-            safe_save_img_tag(ImageTag(img.id, tag.id))
+            tags.append(('Refiner All', k))
     for i in lora:
-        tag = Tag.get_or_create(conn, i["name"], "lora")
-        safe_save_img_tag(ImageTag(img.id, tag.id))
+        tags.append((i["name"], "lora"))
     for i in lyco:
-        tag = Tag.get_or_create(conn, i["name"], "lyco")
-        safe_save_img_tag(ImageTag(img.id, tag.id))
+        tags.append((i["name"], "lyco"))
     for k in pos:
-        tag = Tag.get_or_create(conn, k, "pos")
-        safe_save_img_tag(ImageTag(img.id, tag.id))
\ No newline at end of file
+        tags.append((k, "pos"))
+    return tags
@@ -1,14 +1,14 @@
-import hashlib
 import os
 from typing import List
-from scripts.iib.tool import get_formatted_date, get_cache_dir, is_image_file
-from concurrent.futures import ThreadPoolExecutor
+from scripts.iib.tool import get_formatted_date, is_image_file
+from scripts.iib.thumbnail import get_thumbnail_engine
+from concurrent.futures import ThreadPoolExecutor, wait
 import time
-from PIL import Image
 
 def generate_image_cache(dirs, size:str, verbose=False):
   start_time = time.time()
-  cache_base_dir = get_cache_dir()
+  engine = get_thumbnail_engine()
+  thumbnails = []
 
   def process_image(item):
     if item.is_dir():
@@ -23,35 +23,33 @@ def generate_image_cache(dirs, size:str, verbose=False):
       path = os.path.normpath(item.path)
       stat = item.stat()
       t = get_formatted_date(stat.st_mtime)
-      hash_dir = hashlib.md5((path + t).encode("utf-8")).hexdigest()
-      cache_dir = os.path.join(cache_base_dir, "iib_cache", hash_dir)
-      cache_path = os.path.join(cache_dir, f"{size}.webp")
-
-      if os.path.exists(cache_path):
-          verbose and print(f"Image cache already exists: {path}")
-          return
-
       if os.path.getsize(path) < 64 * 1024:
           verbose and print(f"Image size less than 64KB: {path}", "skip")
           return
-        
-      with Image.open(path) as img:
-          w, h = size.split("x")
-          img.thumbnail((int(w), int(h)))
-          os.makedirs(cache_dir, exist_ok=True)
-          img.save(cache_path, "webp")
 
-      verbose and print(f"Image cache generated: {path}")
+      # thumbnails are generated on the shared thumbnail engine, the same pool used by the api
+      future = engine.submit(path, t, size)
+      future.add_done_callback(lambda f: on_generated(path, f))
+      thumbnails.append(future)
     except Exception as e:
       print(f"Error generating image cache: {path}")
       print(e)
 
+  def on_generated(path, future):
+    e = future.exception()
+    if e is not None:
+      print(f"Error generating image cache: {path}")
+      print(e)
+    else:
+      verbose and print(f"Image cache generated: {path}")
+
   with ThreadPoolExecutor() as executor:
     for dir_path in dirs:
       folder_listing: List[os.DirEntry] = os.scandir(dir_path)
       for item in folder_listing:
         executor.submit(process_image, item)
 
+  wait(thumbnails)
   print("Image cache generation completed. ✨")
   end_time = time.time()
   execution_time = end_time - start_time
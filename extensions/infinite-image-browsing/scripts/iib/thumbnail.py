@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import os
+import string
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from PIL import Image
+
+from scripts.iib.tool import get_cache_dir
+from scripts.iib.logger import logger
+
+
+class ThumbnailCache:
+    """
+    On-disk thumbnail cache with a size budget.
+
+    Thumbnails are sharded into 256 directories by the first two characters of their hash.
+    The index of cached files is kept in memory in least recently used order and is rebuilt
+    from the files on disk in a background thread on startup; once the total size exceeds the
+    budget, the least recently used thumbnails are deleted.
+
+    Thumbnails from the old layout (iib_cache/<hash>/<size>.webp) are moved into the shards
+    on the first load, so that they are served again and count against the budget.
+    """
+
+    def __init__(self, base_dir: str, max_bytes: int):
+        self.dir = os.path.join(base_dir, "iib_cache", "thumbnails")
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # cache path -> file size
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.loaded = False
+        threading.Thread(target=self.load, daemon=True).start()
+
+    def path_for(self, key: str, size: str):
+        return os.path.join(self.dir, key[:2], f"{key}_{size}.webp")
+
+    def migrate_legacy(self):
+        legacy_dir = os.path.dirname(self.dir)
+        if not os.path.isdir(legacy_dir):
+            return
+        moved = 0
+        for item in os.scandir(legacy_dir):
+            key = item.name
+            if len(key) != 32 or any(c not in string.hexdigits for c in key) or not item.is_dir():
+                continue
+            for thumb in os.scandir(item.path):
+                if thumb.name.endswith(".webp"):
+                    target = self.path_for(key, thumb.name[:-len(".webp")])
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(thumb.path, target)
+                    moved += 1
+            try:
+                os.rmdir(item.path)
+            except OSError:
+                pass
+        if moved:
+            logger.info(f"moved {moved} thumbnails from the old cache layout")
+
+    def load(self):
+        try:
+            self.migrate_legacy()
+        except OSError as e:
+            logger.error(f"failed to migrate old thumbnail cache: {e}")
+
+        found = []
+        if os.path.isdir(self.dir):
+            for shard in os.scandir(self.dir):
+                if not shard.is_dir():
+                    continue
+                for item in os.scandir(shard.path):
+                    if item.name.endswith(".webp"):
+                        stat = item.stat()
+                        found.append((stat.st_mtime, item.path, stat.st_size))
+
+        found.sort()
+        with self.lock:
+            # thumbnails generated while loading are more recent than anything found on disk
+            recent = self.entries
+            self.entries = OrderedDict()
+            self.total_bytes = 0
+            for _, path, size in found:
+                if path not in recent:
+                    self.entries[path] = size
+                    self.total_bytes += size
+            for path, size in recent.items():
+                self.entries[path] = size
+                self.total_bytes += size
+            self.loaded = True
+            self.evict()
+
+    def contains(self, path: str):
+        with self.lock:
+            if path in self.entries:
+                if os.path.exists(path):
+                    self.entries.move_to_end(path)
+                    return True
+                # deleted outside of the cache, it is generated again
+                self.total_bytes -= self.entries.pop(path)
+                return False
+            if self.loaded:
+                return False
+
+        # index is still loading, fall back to the file system
+        if os.path.exists(path):
+            self.add(path)
+            return True
+        return False
+
+    def add(self, path: str):
+        size = os.path.getsize(path)
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(path, 0)
+            self.entries[path] = size
+            self.evict()
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            path, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class ThumbnailEngine:
+    """
+    Generates thumbnails on a bounded thread pool, off the event loop.
+
+    Concurrent requests for the same image and size share one generation job.
+    JPEG files are decoded at reduced resolution with draft() before resizing.
+    """
+
+    def __init__(self, max_workers: int, max_cache_bytes: int):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="iib_thumbnail")
+        self.cache = ThumbnailCache(get_cache_dir(), max_cache_bytes)
+        self.pending = {}
+        self.lock = threading.RLock()
+
+    def cache_path(self, path: str, t: str, size: str):
+        key = hashlib.md5((path + t).encode("utf-8")).hexdigest()
+        return self.cache.path_for(key, size)
+
+    def submit(self, path: str, t: str, size: str) -> Future:
+        cache_path = self.cache_path(path, t, size)
+        if self.cache.contains(cache_path):
+            future = Future()
+            future.set_result(cache_path)
+            return future
+
+        with self.lock:
+            future = self.pending.get(cache_path)
+            if future is None:
+                future = self.executor.submit(self.generate_thumbnail, path, size, cache_path)
+                self.pending[cache_path] = future
+                future.add_done_callback(lambda _: self.pending_done(cache_path))
+        return future
+
+    def pending_done(self, cache_path: str):
+        with self.lock:
+            self.pending.pop(cache_path, None)
+
+    def generate(self, path: str, t: str, size: str) -> str:
+        return self.submit(path, t, size).result()
+
+    async def get(self, path: str, t: str, size: str) -> str:
+        return await asyncio.wrap_future(self.submit(path, t, size))
+
+    def generate_thumbnail(self, path: str, size: str, cache_path: str):
+        w, h = (int(x) for x in size.split("x"))
+        with Image.open(path) as img:
+            if img.format == "JPEG":
+                img.draft("RGB", (w, h))
+            img.thumbnail((w, h))
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+            img.save(tmp_path, "webp")
+        os.replace(tmp_path, cache_path)
+        self.cache.add(cache_path)
+        return cache_path
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_thumbnail_engine() -> ThumbnailEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            max_workers = int(os.environ.get("IIB_THUMBNAIL_WORKERS") or min(4, os.cpu_count() or 1))
+            max_cache_mb = int(os.environ.get("IIB_THUMBNAIL_CACHE_MAX_MB", "4096"))
+            _engine = ThumbnailEngine(max_workers, max_cache_mb * 1024 * 1024)
+            logger.info(f"thumbnail engine started with {max_workers} workers, cache limit {max_cache_mb} MB")
+        return _engine
@@ -1,4 +1,5 @@
 from scripts.iib.api import infinite_image_browsing_api, send_img_path
+from scripts.iib.db.update_image_data import SavedImageIndexer
 from modules import script_callbacks, generation_parameters_copypaste as send
 from scripts.iib.tool import locale
 from scripts.iib.tool import read_sd_webui_gen_info_from_image
@@ -70,6 +71,22 @@ def on_ui_tabs():
             ),
         )
 
+def on_before_image_saved(params: script_callbacks.ImageSaveParams):
+    # 记录保存前文件夹的修改时间，用来判断文件夹在此之前是否已经是最新的
+    try:
+        SavedImageIndexer.before_save(params.filename)
+    except Exception as e:
+        logger.error("on_before_image_saved err %s", e)
+
+
+def on_image_saved(params: script_callbacks.ImageSaveParams):
+    # 新生成的图片直接用已有的生成信息加入索引，不需要重新扫描文件夹
+    try:
+        SavedImageIndexer.enqueue(params.filename, params.pnginfo.get("parameters"))
+    except Exception as e:
+        logger.error("on_image_saved err %s", e)
+
+
 def on_app_started(_: gr.Blocks, app: FastAPI) -> None:
     # 第一个参数是SD-WebUI传进来的gr.Blocks，但是不需要使用
     DEFAULT_BASE = "/infinite_image_browsing"
@@ -84,3 +101,5 @@ def on_app_started(_: gr.Blocks, app: FastAPI) -> None:
 
 script_callbacks.on_ui_tabs(on_ui_tabs)
 script_callbacks.on_app_started(on_app_started)
+script_callbacks.on_before_image_saved(on_before_image_saved)
+script_callbacks.on_image_saved(on_image_saved)
@@ -0,0 +1,115 @@
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from PIL import Image
+from tqdm import tqdm
+
+from modules import devices, lowvram
+
+from scripts import logger, utilities
+from scripts.tagger import Tagger
+
+DEFAULT_BATCH_SIZE = 16
+
+
+def get_square_rgb(data: Image.Image):
+    data_rgb = utilities.get_rgb_image(data)
+    size = max(data.size)
+    return utilities.resize_and_fill(data_rgb, (size, size))
+
+
+def load_square_rgb(path: str):
+    with Image.open(path) as img:
+        return get_square_rgb(img)
+
+
+class BatchInterrogator:
+    """
+    Runs several taggers over a list of images in one pass.
+    Images are read and preprocessed on a thread pool while the taggers work on the previous batch,
+    and each image is resized once per distinct input size, shared by all taggers taking that size.
+    """
+
+    def __init__(self, tagger_thresholds: list[tuple[Tagger, Optional[float]]], max_workers: int):
+        self.tagger_thresholds = tagger_thresholds
+        self.max_workers = max_workers
+        self.input_sizes: dict[Tagger, Optional[int]] = {}
+
+    def batch_size(self):
+        sizes = [getattr(tg, "batch_size", 0) for tg, _ in self.tagger_thresholds]
+        return max([DEFAULT_BATCH_SIZE] + sizes)
+
+    def load(self, path: str):
+        try:
+            square = load_square_rgb(path)
+        except Exception as e:
+            logger.warn(f"Cannot load {path}: {e}")
+            return None
+        resized: dict[Optional[int], Image.Image] = {None: square}
+        for size in set(self.input_sizes.values()):
+            if size is not None and size not in resized:
+                resized[size] = square if square.width == size else utilities.resize(square, (size, size))
+        return resized
+
+    def iter_batches(self, paths: list[str]):
+        batch_size = self.batch_size()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            for i in range(0, len(paths), batch_size):
+                batch = paths[i : i + batch_size]
+                pending.append((batch, [executor.submit(self.load, path) for path in batch]))
+                # keep one batch loading while the taggers run
+                if len(pending) > 1:
+                    batch, futures = pending.popleft()
+                    yield batch, [f.result() for f in futures]
+            while pending:
+                batch, futures = pending.popleft()
+                yield batch, [f.result() for f in futures]
+
+    def start(self):
+        lowvram.send_everything_to_cpu()
+        devices.torch_gc()
+        started = []
+        for tg, th in self.tagger_thresholds:
+            try:
+                tg.start()
+                self.input_sizes[tg] = tg.input_size()
+                started.append((tg, th))
+            except Exception as e:
+                tb = sys.exc_info()[2]
+                logger.error(e.with_traceback(tb))
+        self.tagger_thresholds = started
+
+    def stop(self):
+        for tg, _ in self.tagger_thresholds:
+            tg.stop()
+
+    def run(self, paths: list[str], on_result: Callable[[str, list[str]], None]):
+        """Calls on_result with each path and the tags predicted by the taggers, as soon as a batch is done."""
+        self.start()
+        failed: set[Tagger] = set()
+        try:
+            with tqdm(total=len(paths), desc="Interrogating") as progress:
+                for batch, loaded in self.iter_batches(paths):
+                    batch = [(path, images) for path, images in zip(batch, loaded) if images is not None]
+                    results = {path: [] for path, _ in batch}
+                    for tg, th in self.tagger_thresholds:
+                        if tg in failed or not batch:
+                            continue
+                        size = self.input_sizes[tg]
+                        try:
+                            tags_list = tg.predict_batch([images[size] for _, images in batch], th)
+                        except Exception as e:
+                            tb = sys.exc_info()[2]
+                            logger.error(e.with_traceback(tb))
+                            failed.add(tg)
+                            continue
+                        for (path, _), tags in zip(batch, tags_list):
+                            results[path] += tags
+                    for path, tags in results.items():
+                        on_result(path, tags)
+                    progress.update(len(loaded))
+        finally:
+            self.stop()
@@ -1,5 +1,6 @@
 from pathlib import Path
-import re, sys
+from concurrent.futures import ThreadPoolExecutor
+import re
 from typing import List, Set, Optional
 from enum import Enum
 
@@ -23,6 +24,8 @@ from . import (
     taggers_builtin
 )
 from .custom_scripts import CustomScripts
+from .thumbnails import thumbnail_cache, gallery_image, get_max_workers, is_image_path
+from .batch_interrogator import BatchInterrogator, get_square_rgb
 from .interrogator_names import BLIP2_CAPTIONING_NAMES, WD_TAGGERS, WD_TAGGERS_TIMM
 from scripts.tokenizer import clip_tokenizer
 from scripts.tagger import Tagger
@@ -30,11 +33,6 @@ from scripts.tagger import Tagger
 re_tags = re.compile(r"^([\s\S]+?)( \[\d+\])?$")
 re_newlines = re.compile(r"[\r\n]+")
 
-def get_square_rgb(data:Image.Image):
-    data_rgb = utilities.get_rgb_image(data)
-    size = max(data.size)
-    return utilities.resize_and_fill(data_rgb, (size, size))
-
 class DatasetTagEditor(Singleton):
     class SortBy(Enum):
         ALPHA = "Alphabetical Order"
@@ -688,63 +686,62 @@ class DatasetTagEditor(Singleton):
             f"Total {len(filepaths)} files under the directory including not image files."
         )
 
+        max_workers = get_max_workers()
+
+        def is_readable_image(img_path: str):
+            try:
+                # only reads the header
+                with Image.open(img_path):
+                    return True
+            except:
+                return False
+
         def load_images(filepaths: list[Path]):
-            imgpaths = []
-            images = {}
-            for img_path in filepaths:
-                if img_path.suffix == caption_ext:
-                    continue
-                try:
-                    img = Image.open(img_path)
-                except:
-                    continue
-                else:
-                    abs_path = str(img_path.absolute())
-                    images[abs_path] = img
-                    imgpaths.append(abs_path)
-            return imgpaths, images
-        
-        def load_thumbnails(images_raw: dict[str, Image.Image]):
-            images = {}
+            candidates = [
+                str(img_path.absolute()) for img_path in filepaths
+                if img_path.suffix != caption_ext and is_image_path(img_path)
+            ]
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                readable = list(executor.map(is_readable_image, candidates))
+            return [img_path for img_path, ok in zip(candidates, readable) if ok]
+
+        def load_gallery_images(imgpaths: list[str]):
             if max_res > 0:
-                for img_path, img in images_raw.items():
-                    img_res = int(max_res), int(max_res)
-                    images[img_path] = img.copy()
-                    images[img_path].thumbnail(img_res)
+                logger.write("Creating thumbnails...")
+                thumbnails = thumbnail_cache.get_all(imgpaths, int(max_res), max_workers)
+                return {img_path: gallery_image(thumb or img_path) for img_path, thumb in thumbnails.items()}
+            elif use_temp_dir:
+                # let gradio save a temporary copy, pixels are read when the gallery is shown
+                return {img_path: Image.open(img_path) for img_path in imgpaths}
             else:
-                for img_path, img in images_raw.items():
-                    if not use_temp_dir:
-                        img.already_saved_as = img_path
-                    images[img_path] = img
-            return images
+                return {img_path: gallery_image(img_path) for img_path in imgpaths}
+
+        def load_caption(abs_path: str):
+            img_path = Path(abs_path)
+            text_path = img_path.with_suffix(caption_ext)
+            caption_text = ""
+            if interrogate_method != self.InterrogateMethod.OVERWRITE:
+                # from modules/textual_inversion/dataset.py, modified
+                if text_path.is_file():
+                    caption_text = text_path.read_text("utf8")
+                elif load_caption_from_filename:
+                    caption_text = img_path.stem
+                    caption_text = re.sub(re_numbers_at_start, "", caption_text)
+                    if self.re_word:
+                        tokens = self.re_word.findall(caption_text)
+                        caption_text = (
+                            shared.opts.dataset_filename_join_string or ""
+                        ).join(tokens)
+
+            if replace_new_line:
+                caption_text = re_newlines.sub(",", caption_text)
+
+            caption_tags = [t.strip() for t in caption_text.split(",")]
+            return [t for t in caption_tags if t]
 
         def load_captions(imgpaths: list[str]):
-            taglists = []
-            for abs_path in imgpaths:
-                img_path = Path(abs_path)
-                text_path = img_path.with_suffix(caption_ext)
-                caption_text = ""
-                if interrogate_method != self.InterrogateMethod.OVERWRITE:
-                    # from modules/textual_inversion/dataset.py, modified
-                    if text_path.is_file():
-                        caption_text = text_path.read_text("utf8")
-                    elif load_caption_from_filename:
-                        caption_text = img_path.stem
-                        caption_text = re.sub(re_numbers_at_start, "", caption_text)
-                        if self.re_word:
-                            tokens = self.re_word.findall(caption_text)
-                            caption_text = (
-                                shared.opts.dataset_filename_join_string or ""
-                            ).join(tokens)
-
-                if replace_new_line:
-                    caption_text = re_newlines.sub(",", caption_text)
-
-                caption_tags = [t.strip() for t in caption_text.split(",")]
-                caption_tags = [t for t in caption_tags if t]
-                taglists.append(caption_tags)
-
-            return taglists
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                return list(executor.map(load_caption, imgpaths))
         
         tagger_thresholds:list[tuple[Tagger, float]] = []
         if interrogate_method != self.InterrogateMethod.NONE:
@@ -760,14 +757,12 @@ class DatasetTagEditor(Singleton):
                         tagger_thresholds.append((it, None))
 
         if kohya_json_path:
-            imgpaths, images_raw, taglists = kohya_metadata.read(
-                img_dir, kohya_json_path, use_temp_dir
-            )
+            imgpaths, taglists = kohya_metadata.read(img_dir, kohya_json_path)
         else:
-            imgpaths, images_raw = load_images(filepaths)
+            imgpaths = load_images(filepaths)
             taglists = load_captions(imgpaths)
         
-        self.images = load_thumbnails(images_raw)
+        self.images = load_gallery_images(imgpaths)
         
         interrogate_tags = {img_path : [] for img_path in imgpaths}
         
@@ -776,56 +771,27 @@ class DatasetTagEditor(Singleton):
             if (not taglists[i] or interrogate_method != self.InterrogateMethod.PREFILL)
         ]
 
-        if interrogate_method != self.InterrogateMethod.NONE and img_to_interrogate:
-            logger.write("Preprocess images...")
-            max_workers = shared.opts.dataset_editor_num_cpu_workers
-            if max_workers < 0:
-                import os
-                max_workers = os.cpu_count() + 1
-            
-            def gen_data(paths:list[str], images:dict[str, Image.Image]):
-                for img_path in paths:
-                    yield images[img_path]
-            
-            from concurrent.futures import ThreadPoolExecutor
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                result = list(executor.map(get_square_rgb, gen_data(img_to_interrogate, images_raw)))
-            logger.write("Preprocess completed")
-            
-            for tg, th in tqdm(tagger_thresholds):
-                use_pipe = True
-                tg.start()
-
-                try:
-                    tg.predict_pipe(None)
-                except NotImplementedError:
-                    use_pipe = False
-                except Exception as e:
-                    tb = sys.exc_info()[2]
-                    logger.error(e.with_traceback(tb))
-                    continue
-                try:
-                    if use_pipe:
-                        for img_path, tags in tqdm(zip(img_to_interrogate, tg.predict_pipe(result, th)), desc=tg.name(), total=len(img_to_interrogate)):
-                            interrogate_tags[img_path] += tags
-                    else:
-                        for img_path, data in tqdm(zip(img_to_interrogate, result), desc=tg.name(), total=len(img_to_interrogate)):
-                            interrogate_tags[img_path] += tg.predict(data, th)
-                except Exception as e:
-                    tb = sys.exc_info()[2]
-                    logger.error(e.with_traceback(tb))
-                finally:
-                    tg.stop()
-        
-        for img_path, tags in zip(imgpaths, taglists):
+        def merge_tags(img_path: str, tags: list[str]):
             if (interrogate_method == self.InterrogateMethod.PREFILL and not tags) or (interrogate_method == self.InterrogateMethod.OVERWRITE):
                 tags = interrogate_tags[img_path]
             elif interrogate_method == self.InterrogateMethod.PREPEND:
                 tags = interrogate_tags[img_path] + tags
             elif interrogate_method != self.InterrogateMethod.PREFILL:
                 tags = tags + interrogate_tags[img_path]
+            self.dataset.append_data(ds.Data(img_path, ",".join(tags)))
 
-            self.set_tags_by_image_path(img_path, tags)
+        for img_path, tags in zip(imgpaths, taglists):
+            merge_tags(img_path, tags)
+
+        if interrogate_method != self.InterrogateMethod.NONE and img_to_interrogate and tagger_thresholds:
+            # all taggers run in one pass over the images; results are written to the dataset batch by batch
+            caption_tags = dict(zip(imgpaths, taglists))
+
+            def on_result(img_path: str, tags: list[str]):
+                interrogate_tags[img_path] = tags
+                merge_tags(img_path, caption_tags[img_path])
+
+            BatchInterrogator(tagger_thresholds, max_workers).run(img_to_interrogate, on_result)
 
         for i, p in enumerate(sorted(self.dataset.datas.keys())):
             self.img_idx[p] = i
@@ -908,7 +874,7 @@ class DatasetTagEditor(Singleton):
         self.tag_tokens.clear()
         self.img_idx.clear()
         self.dataset_dir = ""
-        for img in self.images:
+        for img in self.images.values():
             if isinstance(img, Image.Image):
                 img.close()
         self.images.clear()
@@ -93,11 +93,13 @@ class WaifuDiffusionTagger:
             self.model = None
             devices.torch_gc()
 
-    # brought from https://huggingface.co/spaces/SmilingWolf/wd-v1-4-tags/blob/main/app.py and modified
-    def apply(self, image: Image.Image):
+    def input_size(self):
         if not self.model:
-            return dict()
+            return None
+        _, height, _, _ = self.model.get_inputs()[0].shape
+        return height
 
+    def preprocess(self, image: Image.Image):
         from modules import images
 
         _, height, width, _ = self.model.get_inputs()[0].shape
@@ -105,15 +107,34 @@ class WaifuDiffusionTagger:
         # the way to fill empty pixels is quite different from original one;
         # original: fill by white pixels
         # this: repeat the pixels on the edge
-        image = images.resize_image(2, image.convert("RGB"), width, height)
+        image = image.convert("RGB")
+        if image.size != (width, height):
+            image = images.resize_image(2, image, width, height)
         image_np = np.array(image, dtype=np.float32)
         # PIL RGB to OpenCV BGR
-        image_np = image_np[:, :, ::-1]
-        image_np = np.expand_dims(image_np, 0)
+        return image_np[:, :, ::-1]
 
+    def run(self, batch: np.ndarray):
         input_name = self.model.get_inputs()[0].name
         label_name = self.model.get_outputs()[0].name
-        probs = self.model.run([label_name], {input_name: image_np})[0]
-        labels: List[Tuple[str, float]] = list(zip(self.labels, probs[0].astype(float)))
-
+        probs = self.model.run([label_name], {input_name: batch})[0]
+        labels: List[List[Tuple[str, float]]] = [list(zip(self.labels, p.astype(float))) for p in probs]
         return labels
+
+    # brought from https://huggingface.co/spaces/SmilingWolf/wd-v1-4-tags/blob/main/app.py and modified
+    def apply(self, image: Image.Image):
+        if not self.model:
+            return dict()
+
+        return self.run(np.expand_dims(self.preprocess(image), 0))[0]
+
+    def apply_multi(self, images: List[Image.Image]):
+        if not self.model:
+            return [dict() for _ in images]
+
+        batch_dim = self.model.get_inputs()[0].shape[0]
+        if isinstance(batch_dim, int) and batch_dim != len(images):
+            # exported with a fixed batch size
+            return [self.apply(image) for image in images]
+
+        return self.run(np.stack([self.preprocess(image) for image in images]))
@@ -35,6 +35,7 @@ class WaifuDiffusionTaggerTimm:
         self.MODEL_REPO = model_repo
         self.model = None
         self.transform = None
+        self.data_config = None
         self.labels = []
 
     def load(self):
@@ -55,9 +56,8 @@ class WaifuDiffusionTaggerTimm:
             state_dict = timm.models.load_state_dict_from_hf(self.MODEL_REPO)
             self.model.load_state_dict(state_dict)
             self.model.to(devices.device)
-            self.transform = create_transform(
-                **resolve_data_config(self.model.pretrained_cfg, model=self.model)
-            )
+            self.data_config = resolve_data_config(self.model.pretrained_cfg, model=self.model)
+            self.transform = create_transform(**self.data_config)
 
         path_label = huggingface_hub.hf_hub_download(
             self.MODEL_REPO, self.LABEL_FILENAME
@@ -88,6 +88,26 @@ class WaifuDiffusionTaggerTimm:
         return labels
     
 
+    def input_size(self):
+        if not self.model:
+            return None
+        _, height, _ = self.data_config["input_size"]
+        return height
+
+    def apply_batch(self, images: list[Image.Image], batch_size: int):
+        if not self.model:
+            return [[] for _ in images]
+
+        labels: list[list[Tuple[str, float]]] = []
+        with torch.inference_mode():
+            for i in range(0, len(images), batch_size):
+                batch = torch.stack([self.transform(image) for image in images[i : i + batch_size]])
+                batch = batch[:, [2, 1, 0]].to(devices.device)
+                features = self.model.forward(batch)
+                probs = F.sigmoid(features).detach().cpu().numpy()
+                labels.extend(list(zip(self.labels, p.astype(float))) for p in probs)
+        return labels
+
     def apply_multi(self, images: list[Image.Image], batch_size: int):
         if not self.model:
             return []
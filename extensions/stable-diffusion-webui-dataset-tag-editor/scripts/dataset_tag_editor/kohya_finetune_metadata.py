@@ -43,43 +43,30 @@ def write(dataset, dataset_dir, out_path, in_path=None, overwrite=False, save_as
         json.dump(result, f, indent=2)
 
 
-def read(dataset_dir, json_path, use_temp_dir:bool):
+def read(dataset_dir, json_path):
     dataset_dir = Path(dataset_dir)
     json_path = Path(json_path)
     metadata = json.loads(json_path.read_text('utf8'))
     imgpaths = []
-    images = {}
     taglists = []
 
-    def load_image(img_path):
-        img_path = Path(path)
-        try:
-            img = Image.open(img_path)
-        except:
-            return None, None
-        else:
-            abs_path = str(img_path.absolute())
-            if not use_temp_dir:
-                img.already_saved_as = abs_path
-            return abs_path, img
+    def get_image_path(img_path):
+        img_path = Path(img_path)
+        if not img_path.is_file() or img_path.suffix.lower() not in Image.registered_extensions():
+            return None
+        return str(img_path.absolute())
 
     for image_key, img_md in metadata.items():
         img_path = Path(image_key)
         abs_path = None
-        img = None
         if img_path.is_file():
-            abs_path, img = load_image(img_path)
-            if abs_path is None or img is None:
-                continue
-            images[abs_path] = img
+            abs_path = get_image_path(img_path)
         else:
             for path in glob(str(dataset_dir.absolute() / (image_key + '.*'))):
-                abs_path, img = load_image(path)
-                if abs_path is None or img is None:
-                    continue
-                images[abs_path] = img
-                break
-        if abs_path is None or img is None:
+                abs_path = get_image_path(path)
+                if abs_path is not None:
+                    break
+        if abs_path is None:
             continue
         caption = img_md.get('caption')
         tags = img_md.get('tags')
@@ -91,4 +78,4 @@ def read(dataset_dir, json_path, use_temp_dir:bool):
         imgpaths.append(abs_path)
         taglists.append(tags)
     
-    return imgpaths, images, taglists
\ No newline at end of file
+    return imgpaths, taglists
\ No newline at end of file
@@ -81,25 +81,36 @@ class DeepDanbooru(Tagger):
 
     # brought from webUI modules/deepbooru.py and modified
     def predict(self, image: Image.Image, threshold: Optional[float] = None):
-        from modules import images
-        
-        pic = images.resize_image(2, image.convert("RGB"), 512, 512)
-        a = np.expand_dims(np.array(pic, dtype=np.float32), 0) / 255
+        return self.predict_batch([image], threshold)[0]
+
+    def predict_batch(self, images: list[Image.Image], threshold: Optional[float] = None):
+        from modules import images as webui_images
+
+        pics = [
+            image.convert("RGB") if image.size == (512, 512) else webui_images.resize_image(2, image.convert("RGB"), 512, 512)
+            for image in images
+        ]
+        a = np.stack([np.array(pic, dtype=np.float32) for pic in pics]) / 255
 
         with torch.no_grad(), devices.autocast():
             x = torch.from_numpy(a).to(devices.device)
-            y = db.model.model(x)[0].detach().cpu().numpy()
+            ys = db.model.model(x).detach().cpu().numpy()
 
-        tags = []
+        results = []
+        for y in ys:
+            tags = []
+            for tag, probability in zip(db.model.model.tags, y):
+                if threshold and probability < threshold:
+                    continue
+                if not shared.opts.dataset_editor_use_rating and tag.startswith("rating:"):
+                    continue
+                tags.append(get_replaced_tag(tag))
+            results.append(tags)
 
-        for tag, probability in zip(db.model.model.tags, y):
-            if threshold and probability < threshold:
-                continue
-            if not shared.opts.dataset_editor_use_rating and tag.startswith("rating:"):
-                continue
-            tags.append(get_replaced_tag(tag))
+        return results
 
-        return tags
+    def input_size(self):
+        return 512
 
     def name(self):
         return 'DeepDanbooru'
@@ -121,11 +132,14 @@ class WaifuDiffusion(Tagger):
     # brought from https://huggingface.co/spaces/SmilingWolf/wd-v1-4-tags/blob/main/app.py and modified
     # set threshold<0 to use default value for now...
     def predict(self, image: Image.Image, threshold: Optional[float] = None):
+        return self.labels_to_tags(self.tagger_inst.apply(image), threshold)
+
+    def predict_batch(self, images: list[Image.Image], threshold: Optional[float] = None):
+        return [self.labels_to_tags(labels, threshold) for labels in self.tagger_inst.apply_multi(images)]
+
+    def labels_to_tags(self, labels, threshold: Optional[float] = None):
         # may not use ratings
         # rating = dict(labels[:4])
-
-        labels = self.tagger_inst.apply(image)
-        
         if not shared.opts.dataset_editor_use_rating:
             labels = labels[4:]
 
@@ -138,6 +152,9 @@ class WaifuDiffusion(Tagger):
 
         return tags
 
+    def input_size(self):
+        return self.tagger_inst.input_size()
+
     def name(self):
         return self.repo_name
 
@@ -151,17 +168,10 @@ class WaifuDiffusionTimm(WaifuDiffusion):
     def predict_pipe(self, data: list[Image.Image], threshold: Optional[float] = None):
         for labels_list in self.tagger_inst.apply_multi(data, batch_size=self.batch_size):
             for labels in labels_list:
-                if not shared.opts.dataset_editor_use_rating:
-                    labels = labels[4:]
-
-                if threshold is not None:
-                    if threshold < 0:
-                        threshold = self.threshold
-                    tags = [get_replaced_tag(tag) for tag, value in labels if value > threshold]
-                else:
-                    tags = [get_replaced_tag(tag) for tag, _ in labels]
+                yield self.labels_to_tags(labels, threshold)
 
-                yield tags
+    def predict_batch(self, images: list[Image.Image], threshold: Optional[float] = None):
+        return [self.labels_to_tags(labels, threshold) for labels in self.tagger_inst.apply_batch(images, self.batch_size)]
 
 
 class Z3D_E621(Tagger):
@@ -178,10 +188,12 @@ class Z3D_E621(Tagger):
     # brought from https://huggingface.co/spaces/SmilingWolf/wd-v1-4-tags/blob/main/app.py and modified
     # set threshold<0 to use default value for now...
     def predict(self, image: Image.Image, threshold: Optional[float] = None):
-        # may not use ratings
-        # rating = dict(labels[:4])
+        return self.labels_to_tags(self.tagger_inst.apply(image), threshold)
+
+    def predict_batch(self, images: list[Image.Image], threshold: Optional[float] = None):
+        return [self.labels_to_tags(labels, threshold) for labels in self.tagger_inst.apply_multi(images)]
 
-        labels = self.tagger_inst.apply(image)
+    def labels_to_tags(self, labels, threshold: Optional[float] = None):
         if threshold is not None:
             tags = [get_replaced_tag(tag) for tag, value in labels if value > threshold]
         else:
@@ -189,5 +201,8 @@ class Z3D_E621(Tagger):
 
         return tags
 
+    def input_size(self):
+        return self.tagger_inst.input_size()
+
     def name(self):
         return "Z3D-E621-Convnext"
\ No newline at end of file
@@ -0,0 +1,73 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional
+
+from PIL import Image
+
+from scripts import logger
+from scripts.paths import paths
+
+
+def get_max_workers():
+    from modules import shared
+
+    max_workers = shared.opts.dataset_editor_num_cpu_workers
+    if max_workers < 0:
+        max_workers = os.cpu_count() + 1
+    return max_workers
+
+
+def is_image_path(path: Path):
+    return path.suffix.lower() in Image.registered_extensions()
+
+
+def gallery_image(path: str):
+    """
+    A placeholder image for the gallery that is shown from path.
+    The webui sends images with already_saved_as set to the browser as that file, without reading pixel data.
+    """
+    img = Image.new("RGB", (1, 1))
+    img.already_saved_as = path
+    return img
+
+
+class ThumbnailCache:
+    """
+    Persistent cache of downscaled images for the gallery.
+    Thumbnails are keyed by path, modification time and resolution, so they are regenerated when the image changes.
+    """
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = cache_dir
+
+    def path_for(self, img_path: str, max_res: int):
+        stat = os.stat(img_path)
+        key = hashlib.sha1(f"{img_path}:{stat.st_mtime_ns}:{stat.st_size}:{max_res}".encode("utf-8")).hexdigest()
+        return self.cache_dir / key[:2] / f"{key}.webp"
+
+    def get(self, img_path: str, max_res: int) -> Optional[str]:
+        try:
+            thumb_path = self.path_for(img_path, max_res)
+            if not thumb_path.is_file():
+                with Image.open(img_path) as img:
+                    if img.format == "JPEG":
+                        img.draft("RGB", (max_res, max_res))
+                    img.thumbnail((max_res, max_res))
+                    thumb_path.parent.mkdir(parents=True, exist_ok=True)
+                    tmp_path = thumb_path.with_suffix(f".{os.getpid()}.tmp")
+                    img.save(tmp_path, "webp")
+                tmp_path.replace(thumb_path)
+            return str(thumb_path)
+        except Exception as e:
+            logger.warn(f"Cannot create thumbnail of {img_path}: {e}")
+            return None
+
+    def get_all(self, img_paths: Iterable[str], max_res: int, max_workers: int):
+        img_paths = list(img_paths)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(img_paths, executor.map(lambda p: self.get(p, max_res), img_paths)))
+
+
+thumbnail_cache = ThumbnailCache(paths.thumbnail_path)
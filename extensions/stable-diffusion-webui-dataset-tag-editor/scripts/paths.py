@@ -14,5 +14,6 @@ class Paths(Singleton):
         self.script_path: Path = self.base_path / "scripts"
         self.userscript_path: Path = self.base_path / "userscripts"
         self.model_path = self.base_path / "models"
+        self.thumbnail_path = self.base_path / "thumbnails"
 
 paths = Paths()
\ No newline at end of file
@@ -33,6 +33,19 @@ class Tagger:
     def predict_pipe(self, data: list[Image.Image], threshold: Optional[float] = None) -> Generator[list[str], Any, None]:
         raise NotImplementedError()
 
+    # predict tags of a batch of images; used when interrogating a dataset
+    # images are resized to input_size() x input_size() beforehand if it is not None
+    def predict_batch(self, images: list[Image.Image], threshold: Optional[float] = None) -> list[list[str]]:
+        try:
+            return [self.predict(image, threshold) for image in images]
+        except NotImplementedError:
+            return list(self.predict_pipe(images, threshold))
+
+    # Side length of the square images the model takes, or None to get images in their original size
+    # Taggers with the same input size share preprocessed images
+    def input_size(self) -> Optional[int]:
+        return None
+
     # Visible name in UI
     def name(self):
         raise NotImplementedError()
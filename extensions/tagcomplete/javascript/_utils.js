@@ -256,6 +256,13 @@ async function getUseCounts(tagNames, types, negative = false) {
     // Results
     return mapUseCountArray(response["result"]);
 }
+// Search the tag file on the server, results have the same format as the rows of the tag csv
+async function searchTagsOnServer(query, limit, negative = false) {
+    const response = await fetchTacAPI(`tacapi/v1/tag-search?q=${encodeURIComponent(query)}&limit=${limit}&neg=${negative}`);
+    // Guard for errors
+    if (response == null) return [];
+    return response["result"];
+}
 async function getAllUseCounts() {
     const response = await fetchTacAPI(`tacapi/v1/get-all-use-counts`);
     // Guard for no db
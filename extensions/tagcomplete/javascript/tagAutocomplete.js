@@ -149,7 +149,7 @@ const autocompleteCSS = `
 
 async function loadTags(c) {
     // Load main tags and aliases
-    if (allTags.length === 0 && c.tagFile && c.tagFile !== "None") {
+    if (allTags.length === 0 && !c.serverSideSearch && c.tagFile && c.tagFile !== "None") {
         try {
             allTags = await loadCSV(`${tagBasePath}/${c.tagFile}`);
         } catch (e) {
@@ -212,6 +212,7 @@ async function syncOptions() {
         slidingPopup: opts["tac_slidingPopup"],
         maxResults: opts["tac_maxResults"],
         showAllResults: opts["tac_showAllResults"],
+        serverSideSearch: opts["tac_serverSideSearch"],
         resultStepLength: opts["tac_resultStepLength"],
         delayTime: opts["tac_delayTime"],
         useWildcards: opts["tac_useWildcards"],
@@ -281,7 +282,7 @@ async function syncOptions() {
         await loadExtraTags(newCFG);
     }
     // Reload tags if the tag file changed (after translations so extra tag translations get re-added)
-    if (!TAC_CFG || newCFG.tagFile !== TAC_CFG.tagFile || newCFG.extra.extraFile !== TAC_CFG.extra.extraFile) {
+    if (!TAC_CFG || newCFG.tagFile !== TAC_CFG.tagFile || newCFG.extra.extraFile !== TAC_CFG.extra.extraFile || newCFG.serverSideSearch !== TAC_CFG.serverSideSearch) {
         allTags = [];
         await loadTags(newCFG);
     }
@@ -1137,6 +1138,9 @@ async function autocomplete(textArea, prompt, fixedTag = null) {
         normalTags = true;
         resultCountBeforeNormalTags = results.length;
 
+        // The server handles the * placeholder itself
+        let serverQuery = tagword;
+
         // Create escaped search regex with support for * as a start placeholder
         let searchRegex;
         if (tagword.startsWith("*")) {
@@ -1162,8 +1166,17 @@ async function autocomplete(textArea, prompt, fixedTag = null) {
         else
             fil = (x) => baseFilter(x);
 
+        // Search on the server if enabled, the tag list isn't loaded in the browser then
+        let tagRows;
+        if (TAC_CFG.serverSideSearch) {
+            const limit = TAC_CFG.showAllResults ? 1000 : TAC_CFG.maxResults;
+            tagRows = await searchTagsOnServer(serverQuery, limit, getTextAreaIdentifier(textArea).includes("n"));
+        } else {
+            tagRows = allTags.filter(fil);
+        }
+
         // Add final results
-        allTags.filter(fil).forEach(t => {
+        tagRows.forEach(t => {
             let result = new AutocompleteResult(t[0].trim(), ResultType.tag)
             result.category = t[1];
             result.count = t[2];
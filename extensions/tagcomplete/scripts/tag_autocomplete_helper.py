@@ -42,6 +42,12 @@ except (ImportError, ValueError, sqlite3.Error) as e:
     print(f"Tag Autocomplete: Tag frequency database error - \"{e}\"")
     db = None
 
+try:
+    from scripts import tag_search_index as tsi
+except ModuleNotFoundError:
+    import tag_search_index as tsi
+importlib.reload(tsi)
+
 def get_embed_db(sd_model=None):
     """Returns the embedding database, if available."""
     try:
@@ -583,6 +589,8 @@ def on_ui_settings():
         "tac_slidingPopup": shared.OptionInfo(True, "Move completion popup together with text cursor"),
         "tac_maxResults": shared.OptionInfo(5, "Maximum results"),
         "tac_showAllResults": shared.OptionInfo(False, "Show all results"),
+        "tac_serverSideSearch": shared.OptionInfo(False, "Search the tag file on the server instead of loading it in the browser").info("Saves downloading the tag file on page load and is faster on slow devices. Translations are not searched in this mode"),
+        "tac_fuzzySearch": shared.OptionInfo(False, "Also suggest tags with small typos when using server side search"),
         "tac_resultStepLength": shared.OptionInfo(100, "How many results to load at once"),
         "tac_delayTime": shared.OptionInfo(100, "Time in ms to wait before triggering completion again").needs_restart(),
         "tac_useWildcards": shared.OptionInfo(True, "Search for wildcards"),
@@ -841,9 +849,46 @@ def api_tac(_: gr.Blocks, app: FastAPI):
         else:
             return JSONResponse({"error": "Database not initialized"}, status_code=500)
 
+    def get_tag_index():
+        tag_file = getattr(shared.opts, "tac_tagFile", None)
+        if not tag_file or tag_file == "None" or not TAGS_PATH.joinpath(tag_file).exists():
+            return None
+
+        index = tsi.get_index(TAGS_PATH.joinpath(tag_file))
+        if db is not None and not index.use_counts_loaded:
+            index.set_use_counts(db.get_all_tags())
+        return index
+
+    # Not async so that building the index on first use runs in the threadpool
+    @app.get("/tacapi/v1/tag-search")
+    def tag_search(q: str, limit: int = 20, neg: bool = False):
+        index = get_tag_index()
+        if index is None:
+            return JSONResponse({"result": []})
+
+        frequency_function = None
+        if getattr(shared.opts, "tac_frequencySort", True):
+            frequency_function = getattr(shared.opts, "tac_frequencyFunction", None)
+        results = index.search(
+            q,
+            limit=limit,
+            negative=neg,
+            fuzzy=getattr(shared.opts, "tac_fuzzySearch", False),
+            frequency_function=frequency_function,
+            min_count=getattr(shared.opts, "tac_frequencyMinCount", 3),
+        )
+        return JSONResponse({"result": results})
+
+    def update_index_use_count(update):
+        for _, index in tsi.index_cache.values():
+            if index.use_counts_loaded:
+                update(index)
+
     @app.post("/tacapi/v1/increase-use-count")
     async def increase_use_count(tagname: str, ttype: int, neg: bool):
         db_request(lambda: db.increase_tag_count(tagname, ttype, neg))
+        if ttype == 1:
+            update_index_use_count(lambda index: index.increase_use_count(tagname, neg))
 
     @app.get("/tacapi/v1/get-use-count")
     async def get_use_count(tagname: str, ttype: int, neg: bool):
@@ -879,6 +924,8 @@ def api_tac(_: gr.Blocks, app: FastAPI):
     @app.put("/tacapi/v1/reset-use-count")
     async def reset_use_count(tagname: str, ttype: int, pos: bool, neg: bool):
         db_request(lambda: db.reset_tag_count(tagname, ttype, pos, neg))
+        if ttype == 1:
+            update_index_use_count(lambda index: index.reset_use_count(tagname, pos, neg))
 
     @app.get("/tacapi/v1/get-all-use-counts")
     async def get_all_tag_counts():
@@ -0,0 +1,152 @@
+import csv
+import heapq
+import math
+import re
+from bisect import bisect_left
+from pathlib import Path
+
+word_start = re.compile(r"(?:^|(?<=[^a-zA-Z]))(?=.)")
+
+
+def word_suffixes(text: str):
+    """Yields the parts of text starting at a word boundary, matching the (^|[^a-zA-Z]) search of the frontend"""
+    for match in word_start.finditer(text):
+        yield text[match.start():]
+
+
+def levenshtein(a: str, b: str, max_dist: int):
+    """Edit distance between a and b, or max_dist + 1 if it is larger than max_dist"""
+    if abs(len(a) - len(b)) > max_dist:
+        return max_dist + 1
+
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > max_dist:
+            return max_dist + 1
+        previous = current
+
+    return previous[-1]
+
+
+class TagSearchIndex:
+    """Server side search over a tag csv file, returning the rows the frontend would have found itself.
+
+    Every word start of every tag name and alias is stored in one sorted list, so prefix searches are a binary
+    search. Matches are ranked by post count, biased by the local use counts from the tag frequency database.
+    """
+
+    def __init__(self, csv_path: Path):
+        self.csv_path = csv_path
+        self.rows = []
+        self.use_counts = {}
+        self.use_counts_loaded = False
+
+        keys = []
+        with open(csv_path, encoding="utf-8", errors="replace", newline="") as file:
+            for row in csv.reader(file):
+                if not row or not row[0]:
+                    continue
+                # name, category, post count, aliases
+                row = (row + ["", "", ""])[:4]
+                row[2] = int(row[2]) if row[2].isdigit() else 0
+                index = len(self.rows)
+                self.rows.append(row)
+
+                name = row[0].strip().lower()
+                keys.extend((key, index) for key in word_suffixes(name))
+                for alias in row[3].lower().split(","):
+                    if alias:
+                        keys.extend((key, index) for key in word_suffixes(alias))
+
+        keys.sort()
+        self.keys = [key for key, _ in keys]
+        self.key_rows = [index for _, index in keys]
+        self.names = [row[0].strip() for row in self.rows]
+        # fuzzy matching candidates grouped by first letter
+        self.fuzzy_candidates = {}
+        for index, name in enumerate(self.names):
+            if name:
+                self.fuzzy_candidates.setdefault(name[0].lower(), []).append((name.lower(), index))
+
+    def set_use_counts(self, tags):
+        """Sets use counts from TagFrequencyDb.get_all_tags rows, only the ones for normal tags are used"""
+        self.use_counts = {name: (pos, neg) for name, ttype, pos, neg, _ in tags if ttype == 1}
+        self.use_counts_loaded = True
+
+    def increase_use_count(self, name, negative=False):
+        pos, neg = self.use_counts.get(name, (0, 0))
+        self.use_counts[name] = (pos, neg + 1) if negative else (pos + 1, neg)
+
+    def reset_use_count(self, name, positive=True, negative=False):
+        pos, neg = self.use_counts.get(name, (0, 0))
+        self.use_counts[name] = (0 if positive else pos, 0 if negative else neg)
+
+    def prefix_matches(self, prefix: str):
+        matches = set()
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and self.keys[i].startswith(prefix):
+            matches.add(self.key_rows[i])
+            i += 1
+        return matches
+
+    def substring_matches(self, text: str):
+        return {index for index, row in enumerate(self.rows) if text in row[0].lower() or text in row[3].lower()}
+
+    def fuzzy_matches(self, text: str):
+        max_dist = 1 if len(text) < 6 else 2
+        candidates = self.fuzzy_candidates.get(text[0], [])
+        return {index for name, index in candidates if levenshtein(text, name[:len(text)], max_dist) <= max_dist}
+
+    def score(self, index, negative, frequency_function, min_count):
+        count = self.rows[index][2]
+        if not self.use_counts:
+            return count
+
+        uses = self.use_counts.get(self.names[index], (0, 0))[1 if negative else 0]
+        if uses < min_count:
+            uses = 0
+
+        # same as calculateUsageBias in the frontend
+        if frequency_function == "Logarithmic (weak)":
+            return math.log(1 + count) + math.log(1 + uses)
+        elif frequency_function == "Logarithmic (strong)":
+            return math.log(1 + count) + 2 * math.log(1 + uses)
+        elif frequency_function == "Usage first":
+            return uses
+        return count
+
+    def search(self, text: str, limit=20, negative=False, fuzzy=False, frequency_function=None, min_count=0):
+        """Returns up to limit rows matching text, best first. A leading * matches anywhere instead of at word starts"""
+        text = text.strip().lower()
+        if not text:
+            return []
+
+        if text.startswith("*"):
+            matches = self.substring_matches(text[1:])
+        else:
+            matches = self.prefix_matches(text)
+            if fuzzy and len(matches) < limit and len(text) >= 3:
+                matches |= self.fuzzy_matches(text)
+
+        def key(index):
+            return self.score(index, negative, frequency_function, min_count), self.rows[index][2]
+
+        return [self.rows[index] for index in heapq.nlargest(limit, matches, key=key)]
+
+
+index_cache = {}
+
+
+def get_index(csv_path: Path):
+    """Returns the index for csv_path, rebuilding it if the file changed"""
+    mtime = csv_path.stat().st_mtime
+    cached = index_cache.get(csv_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    index = TagSearchIndex(csv_path)
+    index_cache[csv_path] = (mtime, index)
+    return index
@@ -1,5 +1,8 @@
+import bisect
+import itertools
 import os
 import random
+import re
 import sys
 
 from modules import scripts, script_callbacks, shared
@@ -7,39 +10,126 @@ from modules import scripts, script_callbacks, shared
 warned_about_files = {}
 repo_dir = scripts.basedir()
 
+re_weighted_line = re.compile(r"^\s*(\d+(?:\.\d+)?)::(.*)$")
+weighted_file_marker = "#weighted"
+max_nesting_depth = 32
 
-class WildcardsScript(scripts.Script):
-    def title(self):
-        return "Simple wildcards"
 
-    def show(self, is_img2img):
-        return scripts.AlwaysVisible
+class WildcardFile:
+    """Lines of a wildcard file. In files whose first line is `#weighted`, lines written as `weight::text` are picked
+    proportionally to their weight; in other files such lines are used as they are."""
 
-    def replace_wildcard(self, text, gen):
-        if " " in text or len(text) == 0:
-            return text
+    def __init__(self, path, mtime):
+        self.mtime = mtime
 
-        wildcards_dir = shared.cmd_opts.wildcards_dir or os.path.join(repo_dir, "wildcards")
+        with open(path, encoding="utf8") as f:
+            lines = f.read().splitlines()
 
-        replacement_file = os.path.join(wildcards_dir, f"{text}.txt")
-        if os.path.exists(replacement_file):
-            with open(replacement_file, encoding="utf8") as f:
-                return gen.choice(f.read().splitlines())
+        weighted = None
+        if lines and lines[0].strip() == weighted_file_marker:
+            lines = lines[1:]
+            weighted = [re_weighted_line.match(line) for line in lines]
+
+        if weighted and any(weighted):
+            self.lines = [m.group(2) if m else line for m, line in zip(weighted, lines)]
+            self.cumulative_weights = list(itertools.accumulate(float(m.group(1)) if m else 1.0 for m in weighted))
         else:
+            self.lines = lines
+            self.cumulative_weights = None
+
+    def choice(self, gen):
+        if self.cumulative_weights is None:
+            return gen.choice(self.lines)
+
+        total = self.cumulative_weights[-1]
+        index = bisect.bisect_right(self.cumulative_weights, gen.random() * total)
+        return self.lines[min(index, len(self.lines) - 1)]
+
+
+class WildcardCache:
+    """Wildcard files by path, reloaded only when their modification time changes."""
+
+    def __init__(self):
+        self.files = {}
+
+    def get(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            self.files.pop(path, None)
+            return None
+
+        file = self.files.get(path)
+        if file is None or file.mtime != mtime:
+            file = WildcardFile(path, mtime)
+            self.files[path] = file
+        return file
+
+
+wildcard_cache = WildcardCache()
+
+
+class WildcardExpander:
+    """Expands the wildcards of a batch of prompts; each file is looked up at most once per batch."""
+
+    def __init__(self, wildcards_dir):
+        self.wildcards_dir = wildcards_dir
+        self.files = {}
+
+    def get_file(self, text):
+        if text not in self.files:
+            self.files[text] = wildcard_cache.get(os.path.join(self.wildcards_dir, f"{text}.txt"))
+        return self.files[text]
+
+    def replace_wildcard(self, text, gen, stack=()):
+        if " " in text or len(text) == 0:
+            return text
+
+        file = self.get_file(text)
+        if file is None:
+            replacement_file = os.path.join(self.wildcards_dir, f"{text}.txt")
             if replacement_file not in warned_about_files:
                 print(f"File {replacement_file} not found for the __{text}__ wildcard.", file=sys.stderr)
                 warned_about_files[replacement_file] = 1
+            return text
+
+        if text in stack or len(stack) >= max_nesting_depth:
+            chain = " -> ".join(stack + (text,))
+            if chain not in warned_about_files:
+                print(f"Wildcard __{text}__ refers to itself: {chain}", file=sys.stderr)
+                warned_about_files[chain] = 1
+            return text
+
+        line = file.choice(gen)
+        if "__" in line:
+            line = self.expand(line, gen, stack + (text,))
+        return line
 
-        return text
+    def expand(self, text, gen, stack=()):
+        return "".join(self.replace_wildcard(chunk, gen, stack) for chunk in text.split("__"))
+
+
+class WildcardsScript(scripts.Script):
+    def title(self):
+        return "Simple wildcards"
+
+    def show(self, is_img2img):
+        return scripts.AlwaysVisible
 
     def replace_prompts(self, prompts, seeds):
+        wildcards_dir = shared.cmd_opts.wildcards_dir or os.path.join(repo_dir, "wildcards")
+        expander = WildcardExpander(wildcards_dir)
+        expanded = {}
         res = []
 
         for i, text in enumerate(prompts):
-            gen = random.Random()
-            gen.seed(seeds[0 if shared.opts.wildcards_same_seed else i])
-
-            res.append("".join(self.replace_wildcard(chunk, gen) for chunk in text.split("__")))
+            seed = seeds[0 if shared.opts.wildcards_same_seed else i]
+            # the same prompt with the same seed always expands to the same text
+            if (text, seed) not in expanded:
+                gen = random.Random()
+                gen.seed(seed)
+                expanded[(text, seed)] = expander.expand(text, gen)
+            res.append(expanded[(text, seed)])
 
         return res
 
@@ -1,57 +1,282 @@
+import datetime
+import fnmatch
+import html
 import os
-import zipfile
+import struct
+import time
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
 import gradio as gr
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 import modules.scripts as scripts
 import modules.script_callbacks as script_callbacks
 
-def zip_with_progress(folder_path, zip_filename=None):
+# 圧縮済みのメディアはDeflateしても小さくならないので無圧縮(ZIP_STORED)で格納する
+STORED_EXTENSIONS = {
+    '.png', '.jpg', '.jpeg', '.webp', '.gif', '.avif', '.jxl', '.heic',
+    '.mp4', '.webm', '.mov', '.mkv', '.mp3', '.ogg', '.flac', '.m4a',
+    '.zip', '.7z', '.gz', '.xz', '.bz2', '.zst', '.rar', '.safetensors',
+}
+# これより大きいファイルはメモリで圧縮せずに無圧縮でストリームする
+MAX_DEFLATE_SIZE = 64 * 1024 * 1024
+# 圧縮待ち・書き出し待ちのファイルの合計サイズの上限。ダウンロード1つあたりのメモリ使用量を抑える
+MAX_PENDING_DEFLATE_BYTES = 256 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+# ダウンロードURLの有効期限(秒)
+JOB_TTL = 60 * 60
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+ZIP64_LIMIT = 0xFFFFFFFF
+
+jobs = {}
+
+
+def dos_datetime(mtime):
+    t = time.localtime(max(mtime, 315532800))  # Zipは1980年以降の日時のみ
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+class ZipEntry:
+    def __init__(self, name, mtime):
+        self.name = name.replace(os.sep, '/').encode('utf-8')
+        self.time, self.date = dos_datetime(mtime)
+        self.method = ZIP_STORED
+        self.flags = FLAG_UTF8
+        self.crc = 0
+        self.compressed_size = 0
+        self.size = 0
+        self.offset = 0
+        self.zip64 = False
+
+
+class ZipStreamWriter:
+    """
+    シーク不要のZip書き出し。local header、データ、central directoryを順にbytesとして返す
+    4GBを超えるファイルやアーカイブにはZip64拡張を使う
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.offset = 0
+
+    def emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def local_header(self, entry, extra=b''):
+        version = 45 if entry.zip64 else 20
+        crc, csize, size = (0, ZIP64_LIMIT, ZIP64_LIMIT) if entry.zip64 else (entry.crc, entry.compressed_size, entry.size)
+        header = struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, version, entry.flags, entry.method, entry.time, entry.date,
+            crc, csize, size, len(entry.name), len(extra),
+        )
+        return self.emit(header + entry.name + extra)
+
+    def add_compressed(self, entry, data):
+        """CRCとサイズが分かっている(メモリ上で圧縮済みの)エントリを書く"""
+        entry.offset = self.offset
+        self.entries.append(entry)
+        yield self.local_header(entry)
+        yield self.emit(data)
+
+    def add_stream(self, entry, chunks):
+        """サイズの分からないエントリを無圧縮で書き、CRCとサイズはdata descriptorで後から書く"""
+        entry.offset = self.offset
+        entry.flags |= FLAG_DATA_DESCRIPTOR
+        entry.zip64 = True
+        self.entries.append(entry)
+        yield self.local_header(entry, struct.pack('<HHQQ', 0x0001, 16, 0, 0))
+
+        crc = 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            entry.size += len(chunk)
+            yield self.emit(chunk)
+        entry.crc = crc
+        entry.compressed_size = entry.size
+        yield self.emit(struct.pack('<IIQQ', 0x08074b50, entry.crc, entry.compressed_size, entry.size))
+
+    def central_directory(self):
+        start = self.offset
+        for entry in self.entries:
+            zip64 = entry.zip64 or entry.size >= ZIP64_LIMIT or entry.offset >= ZIP64_LIMIT
+            if zip64:
+                extra = struct.pack('<HHQQQ', 0x0001, 24, entry.size, entry.compressed_size, entry.offset)
+                csize = size = offset = ZIP64_LIMIT
+            else:
+                extra = b''
+                csize, size, offset = entry.compressed_size, entry.size, entry.offset
+            version = 45 if zip64 else 20
+            header = struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, version | (3 << 8), version, entry.flags, entry.method,
+                entry.time, entry.date, entry.crc, csize, size, len(entry.name), len(extra), 0, 0, 0,
+                0o100644 << 16, offset,
+            )
+            yield self.emit(header + entry.name + extra)
+
+        size = self.offset - start
+        count = len(self.entries)
+        if count >= 0xFFFF or size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+            zip64_end = self.offset
+            yield self.emit(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45 | (3 << 8), 45, 0, 0, count, count, size, start))
+            yield self.emit(struct.pack('<IIQI', 0x07064b50, 0, zip64_end, 1))
+            count, size, start = min(count, 0xFFFF), min(size, ZIP64_LIMIT), min(start, ZIP64_LIMIT)
+        yield self.emit(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, size, start, 0))
+
+
+def parse_date(text, end=False):
+    if not text:
+        return None
+    try:
+        date = datetime.datetime.strptime(text.strip(), '%Y-%m-%d')
+    except ValueError:
+        raise gr.Error(f"日付はYYYY-MM-DDの形式で指定してください: {text}")
+    if end:
+        date += datetime.timedelta(days=1)
+    return date.timestamp()
+
+
+def list_files(folder_path, since=None, until=None, patterns=None):
     """
-    進捗バー付きでフォルダをZip化する関数
+    フォルダ内のファイルを (相対パス, フルパス, stat) で返す。更新日時とglobで絞り込む
+    ディレクトリへのシンボリックリンクはループしないように辿らない
     """
-    if not os.path.exists(folder_path):
+    stack = [folder_path]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for item in sorted(it, key=lambda e: e.name):
+                if item.is_dir(follow_symlinks=False):
+                    stack.append(item.path)
+                    continue
+                if not item.is_file():
+                    continue
+                stat = item.stat()
+                if since is not None and stat.st_mtime < since:
+                    continue
+                if until is not None and stat.st_mtime >= until:
+                    continue
+                archive_name = os.path.relpath(item.path, folder_path)
+                if patterns and not any(fnmatch.fnmatch(archive_name, p) or fnmatch.fnmatch(item.name, p) for p in patterns):
+                    continue
+                yield archive_name, item.path, stat
+
+
+def read_chunks(file_path):
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            yield chunk
+
+
+def deflate_file(file_path):
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    return zlib.crc32(data), len(data), compressed
+
+
+def stream_zip(files, max_workers=None):
+    """
+    Zipのバイト列を順に返すジェネレータ
+    圧縮するファイルはスレッドプールで先に圧縮しておき、メディアファイルは読みながらそのまま流す
+    """
+    max_workers = max_workers or min(8, os.cpu_count() or 1)
+    writer = ZipStreamWriter()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        pending_deflate_bytes = 0
+
+        def write_next():
+            nonlocal pending_deflate_bytes
+            archive_name, file_path, stat, future = pending.popleft()
+            entry = ZipEntry(archive_name, stat.st_mtime)
+            if future is None:
+                yield from writer.add_stream(entry, read_chunks(file_path))
+                return
+            pending_deflate_bytes -= stat.st_size
+            crc, size, compressed = future.result()
+            if len(compressed) >= size:
+                # 圧縮しても小さくならなかったので無圧縮で書く
+                yield from writer.add_stream(entry, read_chunks(file_path))
+                return
+            entry.method = ZIP_DEFLATED
+            entry.crc, entry.size, entry.compressed_size = crc, size, len(compressed)
+            yield from writer.add_compressed(entry, compressed)
+
+        for archive_name, file_path, stat in files:
+            ext = os.path.splitext(file_path)[1].lower()
+            if ext in STORED_EXTENSIONS or stat.st_size > MAX_DEFLATE_SIZE:
+                future = None
+            else:
+                # 圧縮結果はメモリに残るので、先行して圧縮するのは合計サイズが上限に収まる分だけ
+                while pending and pending_deflate_bytes + stat.st_size > MAX_PENDING_DEFLATE_BYTES:
+                    yield from write_next()
+                pending_deflate_bytes += stat.st_size
+                future = executor.submit(deflate_file, file_path)
+            pending.append((archive_name, file_path, stat, future))
+            if len(pending) >= max_workers * 2:
+                yield from write_next()
+
+        while pending:
+            yield from write_next()
+
+    yield from writer.central_directory()
+
+
+def create_download(folder_path, zip_filename=None, since=None, until=None, patterns=None):
+    """
+    Zipダウンロードのジョブを登録してダウンロード用のHTMLリンクを返す
+    Zipはディスクに保存せず、ダウンロード時にストリームで作る
+    """
+    if not folder_path or not os.path.isdir(folder_path):
         raise gr.Error(f"フォルダが見つかりません: {folder_path}")
 
     # Zipファイル名の決定
     if not zip_filename:
-        zip_filename = os.path.basename(folder_path)
-    
+        zip_filename = os.path.basename(os.path.normpath(folder_path))
+
     if not zip_filename.lower().endswith('.zip'):
         zip_filename += '.zip'
 
-    # Zipファイルの保存パス
-    extensions_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    download_dir = os.path.join(extensions_dir, 'folder-zipper', 'downloads')
-    os.makedirs(download_dir, exist_ok=True)
-    
-    output_path = os.path.join(download_dir, zip_filename)
-
-    # ファイルリストと総サイズを取得
-    files_to_zip = []
-    total_size = 0
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            file_path = os.path.join(root, file)
-            files_to_zip.append(file_path)
-            total_size += os.path.getsize(file_path)
+    job = {
+        'folder_path': os.path.abspath(folder_path),
+        'zip_filename': zip_filename,
+        'since': parse_date(since),
+        'until': parse_date(until, end=True),
+        'patterns': [p.strip() for p in (patterns or '').split(',') if p.strip()],
+        'created': time.time(),
+    }
+
+    now = time.time()
+    for job_id in [k for k, v in jobs.items() if now - v['created'] > JOB_TTL]:
+        del jobs[job_id]
+
+    job_id = uuid.uuid4().hex
+    jobs[job_id] = job
+    name = html.escape(zip_filename)
+    return f'<a href="./zip-dl/download/{job_id}" download="{name}">{name} をダウンロード</a>'
+
+
+def on_app_started(_: gr.Blocks, app: FastAPI):
+    @app.get('/zip-dl/download/{job_id}')
+    def download(job_id: str):
+        job = jobs.get(job_id)
+        if job is None or time.time() - job['created'] > JOB_TTL:
+            raise HTTPException(status_code=404, detail='download expired')
+
+        files = list_files(job['folder_path'], job['since'], job['until'], job['patterns'])
+        headers = {'Content-Disposition': f"attachment; filename*=UTF-8''{quote(job['zip_filename'], safe='')}"}
+        return StreamingResponse(stream_zip(files), media_type='application/zip', headers=headers)
 
-    try:
-        progress_value = 0
-        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            processed_size = 0
-            for file_path in files_to_zip:
-                # 相対パスを計算
-                archive_name = os.path.relpath(file_path, folder_path)
-                
-                # ファイルをZipに追加
-                zipf.write(file_path, archive_name)
-                
-                # 進捗計算
-                processed_size += os.path.getsize(file_path)
-                progress_value = min(100, int((processed_size / total_size) * 100))
-
-        return progress_value, output_path
-    except Exception as e:
-        raise gr.Error(f"Zipファイルの作成中にエラーが発生しました: {str(e)}")
 
 def on_ui_tabs():
     """
@@ -61,18 +286,22 @@ def on_ui_tabs():
         with gr.Row():
             folder_input = gr.Textbox(label="フォルダパス", placeholder="/content/output/txt2img")
             zip_name_input = gr.Textbox(label="Zipファイル名（オプション）", placeholder="未指定の場合はフォルダ名を使用")
-        
+        with gr.Row():
+            since_input = gr.Textbox(label="開始日（オプション）", placeholder="YYYY-MM-DD")
+            until_input = gr.Textbox(label="終了日（オプション）", placeholder="YYYY-MM-DD")
+            patterns_input = gr.Textbox(label="ファイル名パターン（オプション）", placeholder="*.png, 2024-*/*.txt")
+
         zip_button = gr.Button("フォルダをZip化")
-        progress_bar = gr.Number(visible=False)  # Number型に戻す
-        output_file = gr.File(label="作成されたZipファイル")
+        output_link = gr.HTML()
 
         zip_button.click(
-            fn=zip_with_progress, 
-            inputs=[folder_input, zip_name_input],
-            outputs=[progress_bar, output_file]
+            fn=create_download,
+            inputs=[folder_input, zip_name_input, since_input, until_input, patterns_input],
+            outputs=[output_link]
         )
 
     return [(folder_zipper_interface, "ZIPでまとめてDL", "folder_zipper_tab")]
 
 # 重要: スクリプトコールバックに追加
-script_callbacks.on_ui_tabs(on_ui_tabs)
\ No newline at end of file
+script_callbacks.on_ui_tabs(on_ui_tabs)
+script_callbacks.on_app_started(on_app_started)
@@ -362,6 +362,8 @@ def optimized_attention_for_device(device, mask=False, small_input=False):
             return attention_basic
 
     if device == torch.device("cpu"):
+        if model_management.cpu_mode() and model_management.pytorch_attention_enabled():
+            return attention_pytorch
         return attention_sub_quad
 
     if mask:
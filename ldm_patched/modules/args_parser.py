@@ -103,6 +103,11 @@ vram_group.add_argument("--always-low-vram", action="store_true")
 vram_group.add_argument("--always-no-vram", action="store_true")
 vram_group.add_argument("--always-cpu", action="store_true")
 
+parser.add_argument("--cpu-threads", type=int, default=None, metavar="NUM_THREADS")
+parser.add_argument("--cpu-interop-threads", type=int, default=None, metavar="NUM_THREADS")
+parser.add_argument("--cpu-numa-node", type=int, default=None, metavar="NODE_ID")
+parser.add_argument("--cpu-disable-bf16", action="store_true")
+parser.add_argument("--cpu-disable-channels-last", action="store_true")
 
 parser.add_argument("--always-offload-from-vram", action="store_true")
 parser.add_argument("--pytorch-deterministic", action="store_true")
@@ -2,6 +2,7 @@
 # 2nd edit by Forge Official
 
 
+import os
 import time
 import psutil
 from enum import Enum
@@ -65,6 +66,63 @@ except:
 if args.always_cpu:
     cpu_state = CPUState.CPU
 
+def get_numa_node_cpus(node):
+    try:
+        with open(f"/sys/devices/system/node/node{node}/cpulist") as f:
+            cpulist = f.read().strip()
+    except OSError:
+        return None
+
+    cpus = set()
+    for part in cpulist.split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.update(range(int(start), int(end) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+def cpu_supports_bf16():
+    #only report bf16 when the cpu has native bf16 instructions, emulated bf16 is slower than fp32
+    try:
+        with open("/proc/cpuinfo") as f:
+            cpuinfo = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in cpuinfo or "amx_bf16" in cpuinfo
+
+CPU_BF16 = False
+CPU_CHANNELS_LAST = False
+
+if cpu_state == CPUState.CPU:
+    cpu_ids = None
+    if args.cpu_numa_node is not None:
+        cpu_ids = get_numa_node_cpus(args.cpu_numa_node)
+        if cpu_ids and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpu_ids)
+            print(f"Pinned to NUMA node {args.cpu_numa_node} with {len(cpu_ids)} CPUs")
+        else:
+            print(f"Could not pin to NUMA node {args.cpu_numa_node}")
+            cpu_ids = None
+
+    cpu_threads = args.cpu_threads
+    if cpu_threads is None and cpu_ids:
+        cpu_threads = len(cpu_ids)
+    if cpu_threads is not None:
+        torch.set_num_threads(cpu_threads)
+
+    if args.cpu_interop_threads is not None:
+        try:
+            torch.set_num_interop_threads(args.cpu_interop_threads)
+        except RuntimeError:
+            print("Could not set CPU inter-op threads because parallel work has already started.")
+
+    print(f"CPU threads: {torch.get_num_threads()} intra-op, {torch.get_num_interop_threads()} inter-op")
+
+    CPU_BF16 = not args.cpu_disable_bf16 and cpu_supports_bf16()
+    CPU_CHANNELS_LAST = not args.cpu_disable_channels_last
+    print(f"CPU bf16: {CPU_BF16}, CPU channels_last: {CPU_CHANNELS_LAST}")
+
 def is_intel_xpu():
     global cpu_state
     global xpu_available
@@ -186,12 +244,19 @@ try:
     if is_intel_xpu():
         if args.attention_split == False and args.attention_quad == False:
             ENABLE_PYTORCH_ATTENTION = True
+    if cpu_state == CPUState.CPU:
+        torch_version = torch.version.__version__
+        if int(torch_version[0]) >= 2 and args.attention_split == False and args.attention_quad == False:
+            ENABLE_PYTORCH_ATTENTION = True
 except:
     pass
 
 if is_intel_xpu():
     VAE_DTYPE = torch.bfloat16
 
+if CPU_BF16:
+    VAE_DTYPE = torch.bfloat16
+
 if args.vae_in_cpu:
     VAE_DTYPE = torch.float32
 
@@ -360,6 +425,9 @@ class LoadedModel:
         if is_intel_xpu() and not args.disable_ipex_hijack:
             self.real_model = torch.xpu.optimize(self.real_model.eval(), inplace=True, auto_kernel_selection=True, graph_mode=True)
 
+        if CPU_CHANNELS_LAST and is_device_cpu(self.device):
+            self.real_model.to(memory_format=torch.channels_last)
+
         return self.real_model
 
     def model_unload(self, avoid_model_moving=False):
@@ -562,6 +630,8 @@ def unet_dtype(device=None, model_params=0):
         return torch.float8_e4m3fn
     if args.unet_in_fp8_e5m2:
         return torch.float8_e5m2
+    if cpu_bf16_enabled(device):
+        return torch.bfloat16
     if should_use_fp16(device=device, model_params=model_params, manual_cast=True):
         return torch.float16
     return torch.float32
@@ -571,6 +641,11 @@ def unet_manual_cast(weight_dtype, inference_device):
     if weight_dtype == torch.float32:
         return None
 
+    if cpu_bf16_enabled(inference_device):
+        if weight_dtype == torch.bfloat16:
+            return None
+        return torch.bfloat16
+
     fp16_supported = should_use_fp16(inference_device, prioritize_performance=False)
     if fp16_supported and weight_dtype == torch.float16:
         return None
@@ -610,6 +685,8 @@ def text_encoder_dtype(device=None):
         return torch.float32
 
     if is_device_cpu(device):
+        if CPU_BF16:
+            return torch.bfloat16
         return torch.float16
 
     return torch.float16
@@ -645,7 +722,7 @@ def supports_dtype(device, dtype): #TODO
     if dtype == torch.float32:
         return True
     if is_device_cpu(device):
-        return False
+        return dtype == torch.bfloat16 and CPU_BF16
     if dtype == torch.float16:
         return True
     if dtype == torch.bfloat16:
@@ -756,6 +833,13 @@ def is_device_cpu(device):
             return True
     return False
 
+def cpu_bf16_enabled(device=None):
+    if not CPU_BF16:
+        return False
+    if device is not None:
+        return is_device_cpu(device)
+    return cpu_mode()
+
 def is_device_mps(device):
     if hasattr(device, 'type'):
         if (device.type == 'mps'):
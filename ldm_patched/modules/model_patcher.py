@@ -11,6 +11,7 @@ import uuid
 import ldm_patched.modules.utils
 import ldm_patched.modules.model_management
 from ldm_patched.modules.types import UnetWrapperFunction
+from modules_forge.weight_store import restore_shared_weights
 
 extra_weight_calculators = {}
 
@@ -538,6 +539,8 @@ class ModelPatcher:
             self.backup.clear()
 
             if device_to is not None:
+                if ldm_patched.modules.model_management.is_device_cpu(device_to):
+                    restore_shared_weights(self.model)
                 self.model.to(device_to)
                 self.current_device = device_to
 
@@ -17,7 +17,7 @@ from fastapi.encoders import jsonable_encoder
 from secrets import compare_digest
 
 import modules.shared as shared
-from modules import sd_samplers, deepbooru, sd_hijack, images, scripts, ui, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers
+from modules import sd_samplers, deepbooru, sd_hijack, images, scripts, postprocessing, errors, restart, shared_items, script_callbacks, infotext_utils, sd_models, sd_schedulers, script_profiler
 from modules.api import models
 from modules.shared import opts
 from modules.processing import StableDiffusionProcessingTxt2Img, StableDiffusionProcessingImg2Img, process_images
@@ -197,7 +197,7 @@ def api_middleware(app: FastAPI):
 
 
 class Api:
-    def __init__(self, app: FastAPI, queue_lock: Lock):
+    def __init__(self, app: FastAPI, queue_lock: Lock, initialize_scripts=True):
         if shared.cmd_opts.api_auth:
             self.credentials = {}
             for auth in shared.cmd_opts.api_auth.split(","):
@@ -244,6 +244,11 @@ class Api:
         self.add_api_route("/sdapi/v1/scripts", self.get_scripts_list, methods=["GET"], response_model=models.ScriptsList)
         self.add_api_route("/sdapi/v1/script-info", self.get_script_info, methods=["GET"], response_model=list[models.ScriptInfo])
         self.add_api_route("/sdapi/v1/extensions", self.get_extensions_list, methods=["GET"], response_model=list[models.ExtensionItem])
+        self.add_api_route("/sdapi/v1/script-profile", self.get_script_profile, methods=["GET"], response_model=list[models.ScriptHookStats])
+        self.add_api_route("/sdapi/v1/script-profile", self.reset_script_profile, methods=["DELETE"])
+
+        # no authentication, so that load balancers and orchestrators can poll it
+        self.app.add_api_route("/sdapi/v1/health", self.get_health, methods=["GET"], response_model=models.HealthResponse)
 
         if shared.cmd_opts.api_server_stop:
             self.add_api_route("/sdapi/v1/server-kill", self.kill_wui, methods=["POST"])
@@ -253,10 +258,16 @@ class Api:
         self.default_script_arg_txt2img = []
         self.default_script_arg_img2img = []
 
+        if initialize_scripts:
+            self.initialize_scripts()
+
+    def initialize_scripts(self):
+        """Sets up the script runners and default script arguments, creating the UI if that has not been done yet."""
         txt2img_script_runner = scripts.scripts_txt2img
         img2img_script_runner = scripts.scripts_img2img
 
         if not txt2img_script_runner.scripts or not img2img_script_runner.scripts:
+            from modules import ui
             ui.create_ui()
 
         if not txt2img_script_runner.scripts:
@@ -283,6 +294,14 @@ class Api:
 
         raise HTTPException(status_code=401, detail="Incorrect username or password", headers={"WWW-Authenticate": "Basic"})
 
+    async def get_health(self):
+        # async so that it runs on the event loop and answers even when the threadpool is busy
+        from modules import initialize
+        if initialize.startup_error is not None:
+            return JSONResponse(status_code=503, content=jsonable_encoder(models.HealthResponse(status="error")))
+
+        return models.HealthResponse(status="ready" if initialize.startup_finished.is_set() else "starting")
+
     def get_selectable_script(self, script_name, script_runner):
         if script_name is None or script_name == "":
             return None, None
@@ -883,6 +902,18 @@ class Api:
             cuda = {'error': f'{err}'}
         return models.MemoryResponse(ram=ram, cuda=cuda)
 
+    def get_script_profile(self, format: str = "json"):
+        if format == "prometheus":
+            return Response(content=script_profiler.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+        if format != "json":
+            raise HTTPException(status_code=422, detail=f"Unknown format: {format}")
+
+        return [models.ScriptHookStats(**x) for x in script_profiler.dump()]
+
+    def reset_script_profile(self):
+        script_profiler.reset()
+
     def get_extensions_list(self):
         from modules import extensions
         extensions.list_extensions()
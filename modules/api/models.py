@@ -298,6 +298,24 @@ class MemoryResponse(BaseModel):
     ram: dict = Field(title="RAM", description="System memory stats")
     cuda: dict = Field(title="CUDA", description="nVidia CUDA memory stats")
 
+class HealthResponse(BaseModel):
+    status: str = Field(title="Status", description="'starting' while scripts and models are being loaded, 'ready' once all endpoints can be used, 'error' with status code 503 if startup failed")
+
+class ScriptHookHistogram(BaseModel):
+    count: int = Field(title="Count", description="Number of measured calls")
+    total: float = Field(title="Total", description="Total time of all calls, in seconds")
+    mean: float = Field(title="Mean", description="Average time of a call, in seconds")
+    max: float = Field(title="Max", description="Longest call, in seconds")
+    buckets: dict[str, int] = Field(title="Buckets", description="Cumulative number of calls that took at most the number of seconds in key")
+
+class ScriptHookStats(BaseModel):
+    script: str = Field(title="Script", description="Script class name")
+    file: str = Field(title="File", description="Script file, relative to webui directory")
+    hook: str = Field(title="Hook", description="Name of the hook, for example process or postprocess_image")
+    wall: ScriptHookHistogram = Field(title="Wall time", description="Wall time spent in the hook")
+    gpu: ScriptHookHistogram = Field(title="GPU time", description="GPU time spent in the hook; only recorded if enabled in settings")
+    over_budget: int = Field(title="Over budget", description="Number of calls that took longer than the time budget set in settings")
+
 
 class ScriptsList(BaseModel):
     txt2img: list = Field(default=None, title="Txt2img", description="Titles of scripts (txt2img)")
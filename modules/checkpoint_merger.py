@@ -0,0 +1,250 @@
+"""Streaming checkpoint merge used by extras.run_modelmerger when all inputs and the output are safetensors.
+
+Instead of loading two or three full state dicts, inputs are opened with safe_open and read one tensor at a time.
+Keys are merged on a thread pool and written to the output file in order as soon as they are ready, so peak memory
+is a few tensors per input rather than whole models. The merge rules are the same as the in-memory path in
+extras.run_modelmerger, and so is the result.
+"""
+
+import collections
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from safetensors import safe_open
+
+from modules import shared, sd_models
+
+safetensors_dtypes = {
+    torch.float64: "F64",
+    torch.float32: "F32",
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.int64: "I64",
+    torch.int32: "I32",
+    torch.int16: "I16",
+    torch.int8: "I8",
+    torch.uint8: "U8",
+    torch.bool: "BOOL",
+}
+
+if hasattr(torch, "float8_e4m3fn"):
+    safetensors_dtypes[torch.float8_e4m3fn] = "F8_E4M3"
+    safetensors_dtypes[torch.float8_e5m2] = "F8_E5M2"
+
+torch_dtypes = {v: k for k, v in safetensors_dtypes.items()}
+
+
+def can_stream(filename):
+    return os.path.splitext(filename)[1].lower() == ".safetensors"
+
+
+class LazyCheckpoint:
+    """Read-only view of a safetensors checkpoint with the same key names read_state_dict would produce."""
+
+    def __init__(self, filename):
+        self.file = safe_open(filename, framework="pt", device="cpu")
+
+        keys = list(self.file.keys())
+        is_sd2_turbo = 'conditioner.embedders.0.model.ln_final.weight' in keys and self.file.get_slice('conditioner.embedders.0.model.ln_final.weight').get_shape()[0] == 1024
+        replacements = sd_models.checkpoint_dict_replacements_sd2_turbo if is_sd2_turbo else sd_models.checkpoint_dict_replacements_sd1
+
+        self.keys = {sd_models.transform_checkpoint_dict_key(k, replacements): k for k in keys}
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, key):
+        return self.file.get_tensor(self.keys[key])
+
+    def shape(self, key):
+        return tuple(self.file.get_slice(self.keys[key]).get_shape())
+
+    def dtype(self, key):
+        return torch_dtypes[self.file.get_slice(self.keys[key]).get_dtype()]
+
+    def close(self):
+        """Unmaps the file; the checkpoint cannot be read after this."""
+        if self.file is not None:
+            self.file.__exit__(None, None, None)
+            self.file = None
+
+
+class SafetensorsWriter:
+    """Writes a safetensors file tensor by tensor; the shapes and dtypes of all tensors must be known up front.
+
+    Data goes to a temporary file next to filename that replaces it when the writer exits without an error, so the
+    output can have the same name as one of the inputs that are still being read.
+    """
+
+    def __init__(self, filename, layout, metadata=None):
+        self.filename = filename
+        self.tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        self.file = None
+
+        header = {}
+        offset = 0
+        for key, (shape, dtype) in layout.items():
+            size = torch.empty((), dtype=dtype).element_size() * torch.Size(shape).numel()
+            header[key] = {"dtype": safetensors_dtypes[dtype], "shape": list(shape), "data_offsets": [offset, offset + size]}
+            offset += size
+
+        if metadata:
+            header["__metadata__"] = metadata
+
+        header_bytes = json.dumps(header, separators=(",", ":")).encode("utf8")
+        header_bytes += b" " * (-len(header_bytes) % 8)
+
+        self.layout = header
+        self.header_bytes = header_bytes
+
+    def __enter__(self):
+        self.file = open(self.tmp_filename, "wb")
+        self.file.write(len(self.header_bytes).to_bytes(8, "little"))
+        self.file.write(self.header_bytes)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.file.close()
+        if exc_type is not None:
+            os.remove(self.tmp_filename)
+        else:
+            os.replace(self.tmp_filename, self.filename)
+
+    def write(self, key, tensor):
+        start, end = self.layout[key]["data_offsets"]
+        data = tensor.detach().contiguous().reshape(-1).view(torch.uint8).numpy()
+        assert data.nbytes == end - start, f"unexpected size for {key}: {data.nbytes} bytes instead of {end - start}"
+        self.file.write(memoryview(data))
+
+
+def scalar_result_dtype(dtype):
+    """dtype of tensor * python float."""
+    return dtype if dtype.is_floating_point else torch.get_default_dtype()
+
+
+class MergePlan:
+    def __init__(self, theta_0, theta_1, theta_2, theta_func1, theta_func2, multiplier, save_as_half, vae_dict, discard_weights, skip_keys):
+        self.theta_0 = theta_0
+        self.theta_1 = theta_1
+        self.theta_2 = theta_2
+        self.theta_func1 = theta_func1
+        self.theta_func2 = theta_func2
+        self.multiplier = multiplier
+        self.save_as_half = save_as_half
+        self.vae_dict = vae_dict
+        self.skip_keys = skip_keys
+
+        self.result_is_inpainting_model = False
+        self.result_is_instruct_pix2pix_model = False
+
+        regex = re.compile(discard_weights) if discard_weights else None
+        self.keys = [key for key in theta_0 if regex is None or not re.search(regex, key)]
+        self.layout = {key: self.plan_key(key) for key in self.keys}
+
+    def is_merged(self, key):
+        return self.theta_func2 is not None and 'model' in key and key in self.theta_1 and key not in self.skip_keys
+
+    def vae_key(self, key):
+        if self.vae_dict is None or not key.startswith('first_stage_model.'):
+            return None
+
+        vae_key = key[len('first_stage_model.'):]
+        return vae_key if vae_key in self.vae_dict else None
+
+    def half_dtype(self, dtype, enable):
+        return torch.float16 if enable and dtype == torch.float32 else dtype
+
+    def plan_key(self, key):
+        shape = self.theta_0.shape(key)
+        dtype = self.theta_0.dtype(key)
+
+        vae_key = self.vae_key(key)
+        if vae_key is not None:
+            vae_tensor = self.vae_dict[vae_key]
+            return tuple(vae_tensor.shape), self.half_dtype(vae_tensor.dtype, self.save_as_half)
+
+        if not self.is_merged(key):
+            return shape, self.half_dtype(dtype, self.save_as_half and self.theta_func2 is None)
+
+        b_shape = self.theta_1.shape(key)
+        b_dtype = self.theta_1.dtype(key)
+        if self.theta_func1 is not None and key in self.theta_2:
+            b_dtype = torch.promote_types(b_dtype, self.theta_2.dtype(key))
+
+        if shape != b_shape and shape[0:1] + shape[2:] == b_shape[0:1] + b_shape[2:]:
+            if shape[1] == 4 and b_shape[1] == 9:
+                raise RuntimeError("When merging inpainting model with a normal one, A must be the inpainting model.")
+            if shape[1] == 4 and b_shape[1] == 8:
+                raise RuntimeError("When merging instruct-pix2pix model with a normal one, A must be the instruct-pix2pix model.")
+
+            if shape[1] == 8 and b_shape[1] == 4:
+                self.result_is_instruct_pix2pix_model = True
+            else:
+                assert shape[1] == 9 and b_shape[1] == 4, f"Bad dimensions for merged layer {key}: A={shape}, B={b_shape}"
+                self.result_is_inpainting_model = True
+        else:
+            dtype = scalar_result_dtype(torch.promote_types(dtype, b_dtype))
+
+        return shape, self.half_dtype(dtype, self.save_as_half)
+
+    def merge_key(self, key):
+        vae_key = self.vae_key(key)
+        if vae_key is not None:
+            return self.vae_dict[vae_key]
+
+        a = self.theta_0.get(key)
+        if not self.is_merged(key):
+            return a
+
+        b = self.theta_1.get(key)
+        if self.theta_func1 is not None:
+            if key in self.theta_2:
+                b = self.theta_func1(b, self.theta_2.get(key))
+            else:
+                b = torch.zeros_like(b)
+
+        if a.shape != b.shape:
+            a = a.clone()
+            a[:, 0:4, :, :] = self.theta_func2(a[:, 0:4, :, :], b, self.multiplier)
+            return a
+
+        return self.theta_func2(a, b, self.multiplier)
+
+    def close(self):
+        for checkpoint in (self.theta_0, self.theta_1, self.theta_2):
+            if checkpoint is not None:
+                checkpoint.close()
+
+    def run(self, writer, threads=None):
+        threads = threads or min(8, os.cpu_count() or 1)
+        shared.state.sampling_steps = len(self.keys)
+        shared.state.sampling_step = 0
+
+        def process(key):
+            _, dtype = self.layout[key]
+            return self.merge_key(key).to(dtype)
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            pending = collections.deque()
+
+            def write_next():
+                key, future = pending.popleft()
+                writer.write(key, future.result())
+                shared.state.sampling_step += 1
+
+            for key in self.keys:
+                pending.append((key, executor.submit(process, key)))
+                if len(pending) >= threads * 2:
+                    write_next()
+
+            while pending:
+                write_next()
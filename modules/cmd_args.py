@@ -104,6 +104,7 @@ parser.add_argument("--api", action='store_true', help="use api=True to launch t
 parser.add_argument("--api-auth", type=str, help='Set authentication for API like "username:password"; or comma-delimit multiple like "u1:p1,u2:p2,u3:p3"', default=None)
 parser.add_argument("--api-log", action='store_true', help="use api-log=True to enable logging of all API requests")
 parser.add_argument("--nowebui", action='store_true', help="use api=True to launch the API instead of the webui")
+parser.add_argument("--api-fast-start", action='store_true', help="with --nowebui, start the API server before loading scripts, upscalers, samplers and the model; /sdapi/v1/health answers right away and other requests wait until startup is finished")
 parser.add_argument("--ui-debug-mode", action='store_true', help="Don't load model to quickly launch UI")
 parser.add_argument("--device-id", type=str, help="Select the default CUDA device to use (export CUDA_VISIBLE_DEVICES=0,1,etc might be needed before)", default=None)
 parser.add_argument("--administrator", action='store_true', help="Administrator rights", default=False)
@@ -128,6 +129,8 @@ parser.add_argument("--skip-load-model-at-start", action='store_true', help="if
 parser.add_argument("--unix-filenames-sanitization", action='store_true', help="allow any symbols except '/' in filenames. May conflict with your browser and file system")
 parser.add_argument("--filenames-max-length", type=int, default=128, help='maximal length of filenames of saved images. If you override it, it can conflict with your file system')
 parser.add_argument("--no-prompt-history", action='store_true', help="disable read prompt from last generation feature; settings this argument will not create '--data_path/params.txt' file")
+parser.add_argument("--workers", type=str, nargs='+', default=None, help="run as a supervisor that starts one API worker per listed device and dispatches requests to them; devices are GPU ids, 'cpu', or 'numa:N' for a CPU worker pinned to NUMA node N")
+parser.add_argument("--worker-base-port", type=int, default=7870, help="with --workers, port of the first worker; workers listen on consecutive ports on 127.0.0.1")
 
 # Arguments added by forge.
 parser.add_argument(
@@ -148,3 +151,17 @@ parser.add_argument(
     help="Path to directory with annotator model directories",
     default=None,
 )
+parser.add_argument(
+    "--shared-weight-store",
+    type=normalized_filepath,
+    nargs="?",
+    const="/dev/shm/sd-wui-weights",
+    help="Share checkpoint weights between webui processes on this host through a memory-mapped store in this directory (default: /dev/shm/sd-wui-weights)",
+    default=None,
+)
+parser.add_argument(
+    "--shared-weight-store-size",
+    type=float,
+    help="Maximum size of the shared weight store in GB; unused checkpoints are evicted when it is exceeded",
+    default=None,
+)
@@ -7,7 +7,7 @@ import json
 import torch
 import tqdm
 
-from modules import shared, images, sd_models, sd_vae, sd_models_config, errors
+from modules import shared, images, sd_models, sd_vae, sd_models_config, errors, checkpoint_merger
 from modules.ui_common import plaintext_to_html
 import gradio as gr
 import safetensors.torch
@@ -147,99 +147,124 @@ def run_modelmerger(id_task, primary_model_name, secondary_model_name, tertiary_
     result_is_inpainting_model = False
     result_is_instruct_pix2pix_model = False
 
-    if theta_func2:
-        shared.state.textinfo = "Loading B"
-        print(f"Loading {secondary_model_info.filename}...")
-        theta_1 = sd_models.read_state_dict(secondary_model_info.filename, map_location='cpu')
-    else:
-        theta_1 = None
-
-    if theta_func1:
-        shared.state.textinfo = "Loading C"
-        print(f"Loading {tertiary_model_info.filename}...")
-        theta_2 = sd_models.read_state_dict(tertiary_model_info.filename, map_location='cpu')
-
-        shared.state.textinfo = 'Merging B and C'
-        shared.state.sampling_steps = len(theta_1.keys())
-        for key in tqdm.tqdm(theta_1.keys()):
-            if key in checkpoint_dict_skip_on_merge:
-                continue
-
-            if 'model' in key:
-                if key in theta_2:
-                    t2 = theta_2.get(key, torch.zeros_like(theta_1[key]))
-                    theta_1[key] = theta_func1(theta_1[key], t2)
+    # merge safetensors inputs tensor by tensor instead of loading them whole
+    merge_plan = None
+    checkpoint_infos = [x for x in (primary_model_info, secondary_model_info, tertiary_model_info) if x is not None]
+    if checkpoint_format == "safetensors" and all(checkpoint_merger.can_stream(x.filename) for x in checkpoint_infos):
+        shared.state.textinfo = "Opening models"
+        bake_in_vae_filename = sd_vae.vae_dict.get(bake_in_vae, None)
+        vae_dict = sd_vae.load_vae_dict(bake_in_vae_filename, map_location='cpu') if bake_in_vae_filename is not None else None
+
+        merge_plan = checkpoint_merger.MergePlan(
+            theta_0=checkpoint_merger.LazyCheckpoint(primary_model_info.filename),
+            theta_1=checkpoint_merger.LazyCheckpoint(secondary_model_info.filename) if secondary_model_info else None,
+            theta_2=checkpoint_merger.LazyCheckpoint(tertiary_model_info.filename) if tertiary_model_info else None,
+            theta_func1=theta_func1,
+            theta_func2=theta_func2,
+            multiplier=multiplier,
+            save_as_half=save_as_half,
+            vae_dict=vae_dict,
+            discard_weights=discard_weights,
+            skip_keys=checkpoint_dict_skip_on_merge,
+        )
+        result_is_inpainting_model = merge_plan.result_is_inpainting_model
+        result_is_instruct_pix2pix_model = merge_plan.result_is_instruct_pix2pix_model
+        shared.state.job_count = 1
+
+    if merge_plan is None:
+        if theta_func2:
+            shared.state.textinfo = "Loading B"
+            print(f"Loading {secondary_model_info.filename}...")
+            theta_1 = sd_models.read_state_dict(secondary_model_info.filename, map_location='cpu')
+        else:
+            theta_1 = None
+
+        if theta_func1:
+            shared.state.textinfo = "Loading C"
+            print(f"Loading {tertiary_model_info.filename}...")
+            theta_2 = sd_models.read_state_dict(tertiary_model_info.filename, map_location='cpu')
+
+            shared.state.textinfo = 'Merging B and C'
+            shared.state.sampling_steps = len(theta_1.keys())
+            for key in tqdm.tqdm(theta_1.keys()):
+                if key in checkpoint_dict_skip_on_merge:
+                    continue
+
+                if 'model' in key:
+                    if key in theta_2:
+                        t2 = theta_2.get(key, torch.zeros_like(theta_1[key]))
+                        theta_1[key] = theta_func1(theta_1[key], t2)
+                    else:
+                        theta_1[key] = torch.zeros_like(theta_1[key])
+
+                shared.state.sampling_step += 1
+            del theta_2
+
+            shared.state.nextjob()
+
+        shared.state.textinfo = f"Loading {primary_model_info.filename}..."
+        print(f"Loading {primary_model_info.filename}...")
+        theta_0 = sd_models.read_state_dict(primary_model_info.filename, map_location='cpu')
+
+        print("Merging...")
+        shared.state.textinfo = 'Merging A and B'
+        shared.state.sampling_steps = len(theta_0.keys())
+        for key in tqdm.tqdm(theta_0.keys()):
+            if theta_1 and 'model' in key and key in theta_1:
+
+                if key in checkpoint_dict_skip_on_merge:
+                    continue
+
+                a = theta_0[key]
+                b = theta_1[key]
+
+                # this enables merging an inpainting model (A) with another one (B);
+                # where normal model would have 4 channels, for latenst space, inpainting model would
+                # have another 4 channels for unmasked picture's latent space, plus one channel for mask, for a total of 9
+                if a.shape != b.shape and a.shape[0:1] + a.shape[2:] == b.shape[0:1] + b.shape[2:]:
+                    if a.shape[1] == 4 and b.shape[1] == 9:
+                        raise RuntimeError("When merging inpainting model with a normal one, A must be the inpainting model.")
+                    if a.shape[1] == 4 and b.shape[1] == 8:
+                        raise RuntimeError("When merging instruct-pix2pix model with a normal one, A must be the instruct-pix2pix model.")
+
+                    if a.shape[1] == 8 and b.shape[1] == 4:#If we have an Instruct-Pix2Pix model...
+                        theta_0[key][:, 0:4, :, :] = theta_func2(a[:, 0:4, :, :], b, multiplier)#Merge only the vectors the models have in common.  Otherwise we get an error due to dimension mismatch.
+                        result_is_instruct_pix2pix_model = True
+                    else:
+                        assert a.shape[1] == 9 and b.shape[1] == 4, f"Bad dimensions for merged layer {key}: A={a.shape}, B={b.shape}"
+                        theta_0[key][:, 0:4, :, :] = theta_func2(a[:, 0:4, :, :], b, multiplier)
+                        result_is_inpainting_model = True
                 else:
-                    theta_1[key] = torch.zeros_like(theta_1[key])
+                    theta_0[key] = theta_func2(a, b, multiplier)
 
-            shared.state.sampling_step += 1
-        del theta_2
-
-        shared.state.nextjob()
-
-    shared.state.textinfo = f"Loading {primary_model_info.filename}..."
-    print(f"Loading {primary_model_info.filename}...")
-    theta_0 = sd_models.read_state_dict(primary_model_info.filename, map_location='cpu')
-
-    print("Merging...")
-    shared.state.textinfo = 'Merging A and B'
-    shared.state.sampling_steps = len(theta_0.keys())
-    for key in tqdm.tqdm(theta_0.keys()):
-        if theta_1 and 'model' in key and key in theta_1:
-
-            if key in checkpoint_dict_skip_on_merge:
-                continue
-
-            a = theta_0[key]
-            b = theta_1[key]
-
-            # this enables merging an inpainting model (A) with another one (B);
-            # where normal model would have 4 channels, for latenst space, inpainting model would
-            # have another 4 channels for unmasked picture's latent space, plus one channel for mask, for a total of 9
-            if a.shape != b.shape and a.shape[0:1] + a.shape[2:] == b.shape[0:1] + b.shape[2:]:
-                if a.shape[1] == 4 and b.shape[1] == 9:
-                    raise RuntimeError("When merging inpainting model with a normal one, A must be the inpainting model.")
-                if a.shape[1] == 4 and b.shape[1] == 8:
-                    raise RuntimeError("When merging instruct-pix2pix model with a normal one, A must be the instruct-pix2pix model.")
-
-                if a.shape[1] == 8 and b.shape[1] == 4:#If we have an Instruct-Pix2Pix model...
-                    theta_0[key][:, 0:4, :, :] = theta_func2(a[:, 0:4, :, :], b, multiplier)#Merge only the vectors the models have in common.  Otherwise we get an error due to dimension mismatch.
-                    result_is_instruct_pix2pix_model = True
-                else:
-                    assert a.shape[1] == 9 and b.shape[1] == 4, f"Bad dimensions for merged layer {key}: A={a.shape}, B={b.shape}"
-                    theta_0[key][:, 0:4, :, :] = theta_func2(a[:, 0:4, :, :], b, multiplier)
-                    result_is_inpainting_model = True
-            else:
-                theta_0[key] = theta_func2(a, b, multiplier)
+                theta_0[key] = to_half(theta_0[key], save_as_half)
 
-            theta_0[key] = to_half(theta_0[key], save_as_half)
-
-        shared.state.sampling_step += 1
+            shared.state.sampling_step += 1
 
-    del theta_1
+        del theta_1
 
-    bake_in_vae_filename = sd_vae.vae_dict.get(bake_in_vae, None)
-    if bake_in_vae_filename is not None:
-        print(f"Baking in VAE from {bake_in_vae_filename}")
-        shared.state.textinfo = 'Baking in VAE'
-        vae_dict = sd_vae.load_vae_dict(bake_in_vae_filename, map_location='cpu')
+        bake_in_vae_filename = sd_vae.vae_dict.get(bake_in_vae, None)
+        if bake_in_vae_filename is not None:
+            print(f"Baking in VAE from {bake_in_vae_filename}")
+            shared.state.textinfo = 'Baking in VAE'
+            vae_dict = sd_vae.load_vae_dict(bake_in_vae_filename, map_location='cpu')
 
-        for key in vae_dict.keys():
-            theta_0_key = 'first_stage_model.' + key
-            if theta_0_key in theta_0:
-                theta_0[theta_0_key] = to_half(vae_dict[key], save_as_half)
+            for key in vae_dict.keys():
+                theta_0_key = 'first_stage_model.' + key
+                if theta_0_key in theta_0:
+                    theta_0[theta_0_key] = to_half(vae_dict[key], save_as_half)
 
-        del vae_dict
+            del vae_dict
 
-    if save_as_half and not theta_func2:
-        for key in theta_0.keys():
-            theta_0[key] = to_half(theta_0[key], save_as_half)
+        if save_as_half and not theta_func2:
+            for key in theta_0.keys():
+                theta_0[key] = to_half(theta_0[key], save_as_half)
 
-    if discard_weights:
-        regex = re.compile(discard_weights)
-        for key in list(theta_0):
-            if re.search(regex, key):
-                theta_0.pop(key, None)
+        if discard_weights:
+            regex = re.compile(discard_weights)
+            for key in list(theta_0):
+                if re.search(regex, key):
+                    theta_0.pop(key, None)
 
     ckpt_dir = shared.cmd_opts.ckpt_dir or sd_models.model_path
 
@@ -311,7 +336,14 @@ def run_modelmerger(id_task, primary_model_name, secondary_model_name, tertiary_
         metadata["sd_merge_models"] = json.dumps(sd_merge_models)
 
     _, extension = os.path.splitext(output_modelname)
-    if extension.lower() == ".safetensors":
+    if merge_plan is not None:
+        shared.state.textinfo = "Merging and saving"
+        with checkpoint_merger.SafetensorsWriter(output_modelname, merge_plan.layout, metadata=metadata if len(metadata)>0 else None) as writer:
+            try:
+                merge_plan.run(writer)
+            finally:
+                merge_plan.close()  # inputs must be closed before the output can replace one of them on Windows
+    elif extension.lower() == ".safetensors":
         safetensors.torch.save_file(theta_0, output_modelname, metadata=metadata if len(metadata)>0 else None)
     else:
         torch.save(theta_0, output_modelname)
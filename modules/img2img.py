@@ -1,5 +1,10 @@
+import json
 import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
+from copy import copy
 from pathlib import Path
 
 import numpy as np
@@ -17,6 +22,101 @@ from modules.ui import plaintext_to_html
 import modules.scripts
 from modules_forge import main_thread
 
+class BatchItem:
+    def __init__(self, path):
+        self.path = path
+        self.image = None
+        self.mask_path = None
+        self.mask = None
+        self.parsed_parameters = None
+        self.skip_message = None
+
+
+class BatchManifest:
+    """List of input images already processed into an output directory, used to resume an interrupted batch."""
+
+    filename = "img2img-batch-manifest.jsonl"
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, self.filename)
+        self.lock = threading.Lock()
+        self.done = set()
+
+        if os.path.isfile(self.path):
+            with open(self.path, "r", encoding="utf8") as file:
+                for line in file:
+                    try:
+                        self.done.add(json.loads(line)["input"])
+                    except (ValueError, KeyError):
+                        pass
+
+    def mark(self, input_path):
+        with self.lock:
+            self.done.add(input_path)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf8") as file:
+                file.write(json.dumps({"input": input_path}) + "\n")
+
+
+def load_batch_item(image, inpaint_mask_dir, inpaint_masks, use_png_info, png_info_dir):
+    """Reads an input image with its mask and PNG info; runs on the prefetch thread pool."""
+    item = BatchItem(image)
+
+    try:
+        img = images.read(image)
+    except UnidentifiedImageError as e:
+        item.skip_message = str(e)
+        return item
+    # Use the EXIF orientation of photos taken by smartphones.
+    item.image = ImageOps.exif_transpose(img)
+
+    image_path = Path(image)
+    if inpaint_masks:
+        # try to find corresponding mask for an image using simple filename matching
+        if len(inpaint_masks) == 1:
+            mask_image_path = inpaint_masks[0]
+        else:
+            # try to find corresponding mask for an image using simple filename matching
+            mask_image_dir = Path(inpaint_mask_dir)
+            masks_found = list(mask_image_dir.glob(f"{image_path.stem}.*"))
+
+            if len(masks_found) == 0:
+                item.skip_message = f"Warning: mask is not found for {image_path} in {mask_image_dir}. Skipping it."
+                return item
+
+            # it should contain only 1 matching mask
+            # otherwise user has many masks with the same name but different extensions
+            mask_image_path = masks_found[0]
+
+        item.mask_path = str(mask_image_path)
+        item.mask = images.read(mask_image_path)
+
+    if use_png_info:
+        try:
+            info_img = item.image
+            if png_info_dir:
+                info_img_path = os.path.join(png_info_dir, os.path.basename(image))
+                info_img = images.read(info_img_path)
+            geninfo, _ = images.read_info_from_image(info_img)
+            item.parsed_parameters = parse_generation_parameters(geninfo)
+        except Exception:
+            item.parsed_parameters = {}
+
+    return item
+
+
+def prefetch(executor, fn, inputs, lookahead):
+    """Yields fn(x) for every input in order, keeping up to lookahead calls running on executor ahead of the consumer."""
+    pending = deque()
+    for x in inputs:
+        pending.append(executor.submit(fn, x))
+        if len(pending) > lookahead:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
 def process_batch(p, input, output_dir, inpaint_mask_dir, args, to_scale=False, scale_by=1.0, use_png_info=False, png_info_props=None, png_info_dir=None):
     output_dir = output_dir.strip()
     processing.fix_seed(p)
@@ -27,6 +127,7 @@ def process_batch(p, input, output_dir, inpaint_mask_dir, args, to_scale=False,
         batch_images = [os.path.abspath(x.name) for x in input]
 
     is_inpaint_batch = False
+    inpaint_masks = []
     if inpaint_mask_dir:
         inpaint_masks = shared.listfiles(inpaint_mask_dir)
         is_inpaint_batch = bool(inpaint_masks)
@@ -34,6 +135,15 @@ def process_batch(p, input, output_dir, inpaint_mask_dir, args, to_scale=False,
         if is_inpaint_batch:
             print(f"\nInpaint batch is enabled. {len(inpaint_masks)} masks found.")
 
+    manifest = None
+    if output_dir and shared.opts.img2img_batch_resume:
+        manifest = BatchManifest(output_dir)
+        skipped = len(batch_images)
+        batch_images = [x for x in batch_images if x not in manifest.done]
+        skipped -= len(batch_images)
+        if skipped:
+            print(f"Resuming batch: skipping {skipped} images already processed into {output_dir}.")
+
     print(f"Will process {len(batch_images)} images, creating {p.n_iter * p.batch_size} new images for each.")
 
     state.job_count = len(batch_images) * p.n_iter
@@ -47,92 +157,49 @@ def process_batch(p, input, output_dir, inpaint_mask_dir, args, to_scale=False,
     steps = p.steps
     override_settings = p.override_settings
     sd_model_checkpoint_override = get_closet_checkpoint_match(override_settings.get("sd_model_checkpoint", None))
-    batch_results = None
-    discard_further_results = False
-    for i, image in enumerate(batch_images):
-        state.job = f"{i+1} out of {len(batch_images)}"
-        if state.skipped:
-            state.skipped = False
 
-        if state.interrupted or state.stopping_generation:
-            break
-
-        try:
-            img = images.read(image)
-        except UnidentifiedImageError as e:
-            print(e)
-            continue
-        # Use the EXIF orientation of photos taken by smartphones.
-        img = ImageOps.exif_transpose(img)
+    def item_params(item):
+        """Parameters of p that are changed for the item."""
+        params = {}
 
         if to_scale:
-            p.width = int(img.width * scale_by)
-            p.height = int(img.height * scale_by)
-
-        p.init_images = [img] * p.batch_size
-
-        image_path = Path(image)
-        if is_inpaint_batch:
-            # try to find corresponding mask for an image using simple filename matching
-            if len(inpaint_masks) == 1:
-                mask_image_path = inpaint_masks[0]
-            else:
-                # try to find corresponding mask for an image using simple filename matching
-                mask_image_dir = Path(inpaint_mask_dir)
-                masks_found = list(mask_image_dir.glob(f"{image_path.stem}.*"))
-
-                if len(masks_found) == 0:
-                    print(f"Warning: mask is not found for {image_path} in {mask_image_dir}. Skipping it.")
-                    continue
-
-                # it should contain only 1 matching mask
-                # otherwise user has many masks with the same name but different extensions
-                mask_image_path = masks_found[0]
-
-            mask_image = images.read(mask_image_path)
-            p.image_mask = mask_image
+            params["width"] = int(item.image.width * scale_by)
+            params["height"] = int(item.image.height * scale_by)
 
         if use_png_info:
-            try:
-                info_img = img
-                if png_info_dir:
-                    info_img_path = os.path.join(png_info_dir, os.path.basename(image))
-                    info_img = images.read(info_img_path)
-                geninfo, _ = images.read_info_from_image(info_img)
-                parsed_parameters = parse_generation_parameters(geninfo)
-                parsed_parameters = {k: v for k, v in parsed_parameters.items() if k in (png_info_props or {})}
-            except Exception:
-                parsed_parameters = {}
-
-            p.prompt = prompt + (" " + parsed_parameters["Prompt"] if "Prompt" in parsed_parameters else "")
-            p.negative_prompt = negative_prompt + (" " + parsed_parameters["Negative prompt"] if "Negative prompt" in parsed_parameters else "")
-            p.seed = int(parsed_parameters.get("Seed", seed))
-            p.cfg_scale = float(parsed_parameters.get("CFG scale", cfg_scale))
-            p.sampler_name = parsed_parameters.get("Sampler", sampler_name)
-            p.steps = int(parsed_parameters.get("Steps", steps))
+            parsed_parameters = {k: v for k, v in item.parsed_parameters.items() if k in (png_info_props or {})}
+
+            params["prompt"] = prompt + (" " + parsed_parameters["Prompt"] if "Prompt" in parsed_parameters else "")
+            params["negative_prompt"] = negative_prompt + (" " + parsed_parameters["Negative prompt"] if "Negative prompt" in parsed_parameters else "")
+            params["seed"] = int(parsed_parameters.get("Seed", seed))
+            params["cfg_scale"] = float(parsed_parameters.get("CFG scale", cfg_scale))
+            params["sampler_name"] = parsed_parameters.get("Sampler", sampler_name)
+            params["steps"] = int(parsed_parameters.get("Steps", steps))
 
             model_info = get_closet_checkpoint_match(parsed_parameters.get("Model hash", None))
             if model_info is not None:
-                p.override_settings['sd_model_checkpoint'] = model_info.name
+                params["sd_model_checkpoint"] = model_info.name
             elif sd_model_checkpoint_override:
-                p.override_settings['sd_model_checkpoint'] = sd_model_checkpoint_override
+                params["sd_model_checkpoint"] = sd_model_checkpoint_override
             else:
-                p.override_settings.pop("sd_model_checkpoint", None)
-
-        if output_dir:
-            p.outpath_samples = output_dir
-            p.override_settings['save_to_dirs'] = False
-            p.override_settings['save_images_replace_action'] = "Add number suffix"
-            if p.n_iter > 1 or p.batch_size > 1:
-                p.override_settings['samples_filename_pattern'] = f'{image_path.stem}-[generation_number]'
+                params["sd_model_checkpoint"] = None
+
+        return params
+
+    def apply_params(target, params):
+        for key, value in params.items():
+            if key != "sd_model_checkpoint":
+                setattr(target, key, value)
+            elif value is not None:
+                target.override_settings['sd_model_checkpoint'] = value
             else:
-                p.override_settings['samples_filename_pattern'] = f'{image_path.stem}'
+                target.override_settings.pop("sd_model_checkpoint", None)
 
-        proc = modules.scripts.scripts_img2img.run(p, *args)
+    batch_results = None
+    discard_further_results = False
 
-        if proc is None:
-            p.override_settings.pop('save_images_replace_action', None)
-            proc = process_images(p)
+    def add_results(proc):
+        nonlocal batch_results, discard_further_results
 
         if not discard_further_results and proc:
             if batch_results:
@@ -146,6 +213,108 @@ def process_batch(p, input, output_dir, inpaint_mask_dir, args, to_scale=False,
                 batch_results.images = batch_results.images[:int(shared.opts.img2img_batch_show_results_limit)]
                 batch_results.infotexts = batch_results.infotexts[:int(shared.opts.img2img_batch_show_results_limit)]
 
+    # inputs that only differ in init image and seed can be sampled together; results are then saved here
+    # under the name of their input, on a separate thread, while the next batch is sampled
+    group_size = int(shared.opts.img2img_batch_group_size)
+    script_selected = args and args[0] not in (0, None)
+    use_groups = group_size > 1 and bool(output_dir) and p.n_iter == 1 and p.batch_size == 1 and not script_selected
+
+    saves = deque()
+
+    def save_group_results(pc, group, proc, completed):
+        for i, item in enumerate(group[:len(proc.images)]):
+            images.save_image(proc.images[i], output_dir, "", proc.all_seeds[i], proc.all_prompts[i], opts.samples_format, info=proc.infotexts[i], p=pc, forced_filename=Path(item.path).stem, save_to_dirs=False)
+            if manifest is not None and completed:
+                manifest.mark(item.path)
+
+    def run_group(saver, group):
+        items = [item for item, _ in group]
+
+        pc = copy(p)
+        pc.override_settings = dict(p.override_settings)
+        apply_params(pc, group[0][1])
+        pc.init_images = [item.image for item in items]
+        if is_inpaint_batch:
+            pc.image_mask = items[0].mask
+        pc.seed = [params.get("seed", p.seed) for _, params in group]
+        pc.subseed = [p.subseed] * len(group)
+        pc.batch_size = len(group)
+        pc.do_not_save_samples = True
+        pc.do_not_save_grid = True
+        pc.outpath_samples = output_dir
+
+        proc = process_images(pc)
+        completed = not (state.interrupted or state.stopping_generation)
+
+        while len(saves) > 2:
+            saves.popleft().result()
+        saves.append(saver.submit(save_group_results, pc, items, proc, completed))
+
+        add_results(proc)
+
+    group = []
+    group_key = None
+
+    with ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1)) as loader, ThreadPoolExecutor(max_workers=1) as saver:
+        def load(image):
+            return load_batch_item(image, inpaint_mask_dir, inpaint_masks if is_inpaint_batch else None, use_png_info, png_info_dir)
+
+        for i, item in enumerate(prefetch(loader, load, batch_images, max(4, group_size * 2))):
+            state.job = f"{i+1} out of {len(batch_images)}"
+            if state.skipped:
+                state.skipped = False
+
+            if state.interrupted or state.stopping_generation:
+                break
+
+            if item.skip_message:
+                print(item.skip_message)
+                continue
+
+            params = item_params(item)
+
+            if use_groups:
+                key = tuple((k, repr(v)) for k, v in params.items() if k != "seed") + (item.mask_path,)
+                if group and (key != group_key or len(group) >= group_size):
+                    run_group(saver, group)
+                    group = []
+
+                group_key = key
+                group.append((item, params))
+                continue
+
+            apply_params(p, params)
+            p.init_images = [item.image] * p.batch_size
+            if is_inpaint_batch:
+                p.image_mask = item.mask
+
+            image_path = Path(item.path)
+            if output_dir:
+                p.outpath_samples = output_dir
+                p.override_settings['save_to_dirs'] = False
+                p.override_settings['save_images_replace_action'] = "Add number suffix"
+                if p.n_iter > 1 or p.batch_size > 1:
+                    p.override_settings['samples_filename_pattern'] = f'{image_path.stem}-[generation_number]'
+                else:
+                    p.override_settings['samples_filename_pattern'] = f'{image_path.stem}'
+
+            proc = modules.scripts.scripts_img2img.run(p, *args)
+
+            if proc is None:
+                p.override_settings.pop('save_images_replace_action', None)
+                proc = process_images(p)
+
+            if manifest is not None and not (state.interrupted or state.stopping_generation):
+                manifest.mark(item.path)
+
+            add_results(proc)
+
+        if group and not (state.interrupted or state.stopping_generation):
+            run_group(saver, group)
+
+        for future in saves:
+            future.result()
+
     return batch_results
 
 
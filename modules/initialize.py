@@ -5,10 +5,22 @@ import sys
 import warnings
 import os
 
-from threading import Thread
+from threading import Event, Thread
 
 from modules.timer import startup_timer
 
+startup_finished = Event()
+"""Set when scripts, models lists and the API or UI are fully initialized."""
+
+startup_error = None
+"""The exception that stopped startup from finishing with --api-fast-start; startup_finished is set in that case too."""
+
+
+def is_api_fast_start():
+    from modules.shared_cmd_options import cmd_opts
+
+    return cmd_opts.nowebui and cmd_opts.api_fast_start
+
 
 class HiddenPrints:
     def __enter__(self):
@@ -50,7 +62,11 @@ def imports():
     shared_init.initialize()
     startup_timer.record("initialize shared")
 
-    from modules import processing, gradio_extensons, ui  # noqa: F401
+    if is_api_fast_start():
+        # the UI is only needed for default script arguments, and is created by initialize_deferred()
+        from modules import processing  # noqa: F401
+    else:
+        from modules import processing, gradio_extensons, ui  # noqa: F401
     startup_timer.record("other imports")
 
 
@@ -75,8 +91,22 @@ def initialize():
     sd_models.setup_model()
     startup_timer.record("setup SD model")
 
+    if is_api_fast_start():
+        return
+
+    initialize_deferred()
+
+
+def initialize_deferred():
+    """
+    Part of initialize() that loads face restoration, scripts and model lists.
+    With --api-fast-start, the API server is started first and this runs in a background thread.
+    """
     from modules.shared_cmd_options import cmd_opts
 
+    if is_api_fast_start():
+        from modules import gradio_extensons  # noqa: F401
+
     from modules import codeformer_model
     warnings.filterwarnings(action="ignore", category=UserWarning, module="torchvision.transforms.functional_tensor")
     codeformer_model.setup_model(cmd_opts.codeformer_models_path)
@@ -538,6 +538,12 @@ def configure_forge_reference_checkout(a1111_home: Path):
 
 
 def start():
+    if args.workers:
+        from modules import worker_pool
+        print(f"Launching worker supervisor for devices {', '.join(args.workers)} with arguments: {shlex.join(sys.argv[1:])}")
+        worker_pool.run_supervisor(args, sys.argv[1:])
+        return
+
     print(f"Launching {'API server' if '--nowebui' in sys.argv else 'Web UI'} with arguments: {shlex.join(sys.argv[1:])}")
     import wui
     if '--nowebui' in sys.argv:
@@ -1,4 +1,6 @@
+import collections
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from PIL import Image
 
@@ -6,6 +8,74 @@ from modules import shared, images, devices, scripts, scripts_postprocessing, ui
 from modules.shared import opts
 
 
+def load_postprocessing_image(image_placeholder):
+    """Reads and prepares an image for run_postprocessing; returns (None, None) if it can't be read."""
+
+    if isinstance(image_placeholder, str):
+        try:
+            image_data = images.read(image_placeholder)
+        except Exception:
+            return None, None
+    else:
+        image_data = image_placeholder
+
+    image_data = image_data if image_data.mode in ("RGBA", "RGB") else image_data.convert("RGB")
+
+    parameters, existing_pnginfo = images.read_info_from_image(image_data)
+    if parameters:
+        existing_pnginfo["parameters"] = parameters
+
+    return image_data, existing_pnginfo
+
+
+def prefetch_images(data, prefetch_count):
+    """Yields (image, pnginfo, name) for each (placeholder, name) in data, loading up to prefetch_count images ahead in background threads."""
+
+    if prefetch_count <= 0:
+        for image_placeholder, name in data:
+            yield *load_postprocessing_image(image_placeholder), name
+        return
+
+    with ThreadPoolExecutor(max_workers=prefetch_count) as executor:
+        pending = collections.deque()
+        for image_placeholder, name in data:
+            pending.append((executor.submit(load_postprocessing_image, image_placeholder), name))
+
+            if len(pending) > prefetch_count:
+                future, pending_name = pending.popleft()
+                yield *future.result(), pending_name
+
+        while pending:
+            future, pending_name = pending.popleft()
+            yield *future.result(), pending_name
+
+
+def save_postprocessed_image(image, caption, outpath, basename, infotext, existing_pnginfo, forced_filename, suffix):
+    fullfn, _ = images.save_image(image, path=outpath, basename=basename, extension=opts.samples_format, info=infotext, short_filename=True, no_prompt=True, grid=False, pnginfo_section_name="extras", existing_info=existing_pnginfo, forced_filename=forced_filename, suffix=suffix)
+
+    if caption:
+        caption_filename = os.path.splitext(fullfn)[0] + ".txt"
+        existing_caption = ""
+        try:
+            with open(caption_filename, encoding="utf8") as file:
+                existing_caption = file.read().strip()
+        except FileNotFoundError:
+            pass
+
+        action = shared.opts.postprocessing_existing_caption_action
+        if action == 'Prepend' and existing_caption:
+            caption = f"{existing_caption} {caption}"
+        elif action == 'Append' and existing_caption:
+            caption = f"{caption} {existing_caption}"
+        elif action == 'Keep' and existing_caption:
+            caption = existing_caption
+
+        caption = caption.strip()
+        if caption:
+            with open(caption_filename, "w", encoding="utf8") as file:
+                file.write(caption)
+
+
 def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir, show_extras_results, *args, save_output: bool = True):
     devices.torch_gc()
 
@@ -20,7 +90,7 @@ def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir,
                     image = images.fix_image(img)
                     fn = ''
                 else:
-                    image = images.read(os.path.abspath(img.name))
+                    image = os.path.abspath(img.name)
                     fn = os.path.splitext(img.orig_name)[0]
                 yield image, fn
         elif extras_mode == 2:
@@ -41,12 +111,17 @@ def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir,
 
     infotext = ''
 
-    data_to_process = list(get_images(extras_mode, image, image_folder, input_dir))
-    shared.state.job_count = len(data_to_process)
+    if extras_mode == 1:
+        shared.state.job_count = len(image_folder)
+    elif extras_mode == 2:
+        shared.state.job_count = len(shared.listfiles(input_dir)) if input_dir else 0
+    else:
+        shared.state.job_count = 1
 
-    for image_placeholder, name in data_to_process:
-        image_data: Image.Image
+    save_executor = ThreadPoolExecutor(max_workers=1) if save_output and opts.postprocessing_async_save else None
+    pending_saves = collections.deque()
 
+    for image_data, existing_pnginfo, name in prefetch_images(get_images(extras_mode, image, image_folder, input_dir), opts.postprocessing_batch_prefetch):
         shared.state.nextjob()
         shared.state.textinfo = name
         shared.state.skipped = False
@@ -54,19 +129,8 @@ def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir,
         if shared.state.interrupted or shared.state.stopping_generation:
             break
 
-        if isinstance(image_placeholder, str):
-            try:
-                image_data = images.read(image_placeholder)
-            except Exception:
-                continue
-        else:
-            image_data = image_placeholder
-
-        image_data = image_data if image_data.mode in ("RGBA", "RGB") else image_data.convert("RGB")
-
-        parameters, existing_pnginfo = images.read_info_from_image(image_data)
-        if parameters:
-            existing_pnginfo["parameters"] = parameters
+        if image_data is None:
+            continue
 
         initial_pp = scripts_postprocessing.PostprocessedImage(image_data)
 
@@ -88,42 +152,36 @@ def run_postprocessing(extras_mode, image, image_folder, input_dir, output_dir,
 
             infotext = ", ".join([k if k == v else f'{k}: {infotext_utils.quote(v)}' for k, v in pp.info.items() if v is not None])
 
+            # a copy per image, since saving may happen in background while the next image is being processed
+            image_pnginfo = dict(existing_pnginfo)
+
             if opts.enable_pnginfo:
-                pp.image.info = existing_pnginfo
-                pp.image.info["postprocessing"] = infotext
+                image_pnginfo["postprocessing"] = infotext
+                pp.image.info = image_pnginfo
 
             shared.state.assign_current_image(pp.image)
 
             if save_output:
-                fullfn, _ = images.save_image(pp.image, path=outpath, basename=basename, extension=opts.samples_format, info=infotext, short_filename=True, no_prompt=True, grid=False, pnginfo_section_name="extras", existing_info=existing_pnginfo, forced_filename=forced_filename, suffix=suffix)
-
-                if pp.caption:
-                    caption_filename = os.path.splitext(fullfn)[0] + ".txt"
-                    existing_caption = ""
-                    try:
-                        with open(caption_filename, encoding="utf8") as file:
-                            existing_caption = file.read().strip()
-                    except FileNotFoundError:
-                        pass
-
-                    action = shared.opts.postprocessing_existing_caption_action
-                    if action == 'Prepend' and existing_caption:
-                        caption = f"{existing_caption} {pp.caption}"
-                    elif action == 'Append' and existing_caption:
-                        caption = f"{pp.caption} {existing_caption}"
-                    elif action == 'Keep' and existing_caption:
-                        caption = existing_caption
-                    else:
-                        caption = pp.caption
-
-                    caption = caption.strip()
-                    if caption:
-                        with open(caption_filename, "w", encoding="utf8") as file:
-                            file.write(caption)
+                save_args = (pp.image, pp.caption, outpath, basename, infotext, image_pnginfo, forced_filename, suffix)
+                if save_executor is None:
+                    save_postprocessed_image(*save_args)
+                else:
+                    # keep the number of images waiting to be saved bounded
+                    while len(pending_saves) > max(1, opts.postprocessing_batch_prefetch):
+                        pending_saves.popleft().result()
+
+                    pending_saves.append(save_executor.submit(save_postprocessed_image, *save_args))
 
             if extras_mode != 2 or show_extras_results:
                 outputs.append(pp.image)
 
+    if save_executor is not None:
+        try:
+            while pending_saves:
+                pending_saves.popleft().result()
+        finally:
+            save_executor.shutdown()
+
     devices.torch_gc()
     shared.state.end()
     return outputs, ui_common.plaintext_to_html(infotext), ''
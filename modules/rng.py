@@ -115,11 +115,32 @@ class ImageRNG:
 
         self.is_first = True
 
+    def is_nv_batch(self):
+        return shared.opts.randn_source == "NV" and all(isinstance(generator, rng_philox.Generator) for generator in self.generators)
+
+    def randn_nv_batch(self):
+        """Noise for all images from the NV generators in one vectorized call; same values as calling randn per image."""
+
+        return torch.asarray(rng_philox.randn_generators(self.generators, self.shape), device=devices.device)
+
     def first(self):
         noise_shape = self.shape if self.seed_resize_from_h <= 0 or self.seed_resize_from_w <= 0 else (self.shape[0], int(self.seed_resize_from_h) // 8, int(self.seed_resize_from_w // 8))
 
         xs = []
 
+        no_subseeds = self.subseeds is None or self.subseed_strength == 0
+        if no_subseeds and noise_shape == self.shape and self.seeds and self.is_nv_batch():
+            noise = self.randn_nv_batch()
+
+            # randn(seed, shape, generator=generator) reseeds the global generator for every image; keep the last one
+            manual_seed((self.seeds[-1] + 100000) % 65536)
+
+            eta_noise_seed_delta = shared.opts.eta_noise_seed_delta or 0
+            if eta_noise_seed_delta:
+                self.generators = [create_generator(seed + eta_noise_seed_delta) for seed in self.seeds]
+
+            return noise.to(shared.device)
+
         for i, (seed, generator) in enumerate(zip(self.seeds, self.generators)):
             subnoise = None
             if self.subseeds is not None and self.subseed_strength != 0:
@@ -161,6 +182,9 @@ class ImageRNG:
             self.is_first = False
             return self.first()
 
+        if self.generators and self.is_nv_batch():
+            return self.randn_nv_batch().to(shared.device)
+
         xs = []
         for generator in self.generators:
             x = randn_without_seed(self.shape, generator=generator)
@@ -15,6 +15,10 @@ Expected output:
 ```
 """
 
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
 philox_m = [0xD2511F53, 0xCD9E8D57]
@@ -74,6 +78,71 @@ def box_muller(x, y):
     return r1.astype(np.float32)
 
 
+chunk_size = 1 << 18
+executor = None
+executor_lock = threading.Lock()
+
+
+def get_executor():
+    global executor
+
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix="rng_philox")
+
+    return executor
+
+
+def randn_multi(seeds, offsets, shape):
+    """Generates standard normal random variables for several (seed, offset) streams at once.
+
+    The result has shape (len(seeds), *shape) and is the same as calling Generator(seed).randn(shape) at each offset.
+    Numbers are generated in chunks on a thread pool; NumPy releases the GIL for the arithmetic, so chunks run in
+    parallel, and the temporary counter and key arrays only ever hold one chunk.
+    """
+
+    n = 1
+    for x in shape:
+        n *= x
+
+    seeds = np.array(seeds, dtype=np.uint64)
+    offsets = np.array(offsets, dtype=np.uint32)
+    total = len(seeds) * n
+    res = np.empty(total, dtype=np.float32)
+
+    def fill(start, stop):
+        index = np.arange(start, stop, dtype=np.int64)
+        stream = index // n
+
+        counter = np.zeros((4, stop - start), dtype=np.uint32)
+        counter[0] = offsets[stream]
+        counter[2] = index - stream * n  # up to 2^32 numbers can be generated - if you want more you'd need to spill into counter[3]
+
+        key = uint32(seeds[stream])
+
+        g = philox4_32(counter, key)
+        res[start:stop] = box_muller(g[0], g[1])  # discard g[2] and g[3]
+
+    chunks = [(start, min(start + chunk_size, total)) for start in range(0, total, chunk_size)]
+    if len(chunks) > 1:
+        for future in [get_executor().submit(fill, start, stop) for start, stop in chunks]:
+            future.result()
+    elif chunks:
+        fill(*chunks[0])
+
+    return res.reshape((len(seeds), *shape))
+
+
+def randn_generators(generators, shape):
+    """Generates the next randn(shape) of every generator in one pass; returns an array of shape (len(generators), *shape)."""
+
+    res = randn_multi([g.seed for g in generators], [g.offset for g in generators], shape)
+    for g in generators:
+        g.offset += 1
+
+    return res
+
+
 class Generator:
     """RNG that produces same outputs as torch.randn(..., device='cuda') on CPU"""
 
@@ -84,19 +153,4 @@ class Generator:
     def randn(self, shape):
         """Generate a sequence of n standard normal random variables using the Philox 4x32 random number generator and the Box-Muller transform."""
 
-        n = 1
-        for x in shape:
-            n *= x
-
-        counter = np.zeros((4, n), dtype=np.uint32)
-        counter[0] = self.offset
-        counter[2] = np.arange(n, dtype=np.uint32)  # up to 2^32 numbers can be generated - if you want more you'd need to spill into counter[3]
-        self.offset += 1
-
-        key = np.empty(n, dtype=np.uint64)
-        key.fill(self.seed)
-        key = uint32(key)
-
-        g = philox4_32(counter, key)
-
-        return box_muller(g[0], g[1]).reshape(shape)  # discard g[2] and g[3]
+        return randn_generators([self], shape)[0]
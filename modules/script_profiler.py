@@ -0,0 +1,205 @@
+"""Timing of ScriptRunner hooks (process, process_batch, postprocess_image, ...) per script.
+
+Every call of a script's hook is measured with a monotonic clock and added to a histogram; if enabled in settings,
+GPU time spent in the hook is measured with CUDA events as well. GPU events are not synchronized on - they are
+collected once the GPU has passed them, so measuring does not stall generation.
+"""
+
+import bisect
+import os
+import threading
+import time
+
+from modules import shared, paths
+
+buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+"""upper bounds of histogram buckets, in seconds"""
+
+max_pending_gpu_events = 1024
+
+lock = threading.Lock()
+stats = {}
+pending_gpu_events = []
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def cumulative_counts(self):
+        res = []
+        total = 0
+        for count in self.counts:
+            total += count
+            res.append(total)
+
+        return res
+
+    def dump(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'buckets': dict(zip([str(x) for x in buckets] + ['+Inf'], self.cumulative_counts())),
+        }
+
+
+class HookStats:
+    def __init__(self, script, file, hook):
+        self.script = script
+        self.file = file
+        self.hook = hook
+        self.wall = Histogram()
+        self.gpu = Histogram()
+        self.over_budget = 0
+
+    def dump(self):
+        return {
+            'script': self.script,
+            'file': self.file,
+            'hook': self.hook,
+            'wall': self.wall.dump(),
+            'gpu': self.gpu.dump(),
+            'over_budget': self.over_budget,
+        }
+
+
+def get_stats(script, hook):
+    key = (script.filename, script.__class__.__name__, hook)
+
+    res = stats.get(key)
+    if res is None:
+        with lock:
+            res = stats.get(key)
+            if res is None:
+                file = os.path.relpath(script.filename, paths.script_path) if script.filename else ''
+                res = HookStats(script.__class__.__name__, file, hook)
+                stats[key] = res
+
+    return res
+
+
+def gpu_timing_enabled():
+    if not shared.opts.script_profiler_gpu:
+        return False
+
+    import torch
+    return torch.cuda.is_available()
+
+
+def collect_gpu_events():
+    """moves GPU times of hooks that the GPU has finished into histograms; does not wait for unfinished ones"""
+
+    with lock:
+        remaining = []
+        for hook_stats, start, end in pending_gpu_events:
+            if end.query():
+                hook_stats.gpu.add(start.elapsed_time(end) / 1000)
+            else:
+                remaining.append((hook_stats, start, end))
+
+        pending_gpu_events[:] = remaining
+
+
+class measure:
+    """context manager that records time spent in a script's hook; usage:
+
+    with script_profiler.measure(script, 'process'):
+        script.process(p, *script_args)
+    """
+
+    def __init__(self, script, hook):
+        self.script = script
+        self.hook = hook
+        self.start = None
+        self.gpu_start = None
+
+    def __enter__(self):
+        if gpu_timing_enabled():
+            import torch
+            self.gpu_start = torch.cuda.Event(enable_timing=True)
+            self.gpu_start.record()
+
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = time.perf_counter() - self.start
+        hook_stats = get_stats(self.script, self.hook)
+        budget = shared.opts.script_profiler_budget_ms
+        over_budget = budget > 0 and elapsed * 1000 > budget
+
+        with lock:
+            hook_stats.wall.add(elapsed)
+            if over_budget:
+                hook_stats.over_budget += 1
+
+            if self.gpu_start is not None:
+                import torch
+                gpu_end = torch.cuda.Event(enable_timing=True)
+                gpu_end.record()
+
+                if len(pending_gpu_events) < max_pending_gpu_events:
+                    pending_gpu_events.append((hook_stats, self.gpu_start, gpu_end))
+
+        if over_budget and shared.opts.script_profiler_warn:
+            print(f"*** {hook_stats.script} ({hook_stats.file}): {self.hook} took {elapsed * 1000:.0f} ms, which is over the budget of {budget} ms")
+
+        if len(pending_gpu_events) >= max_pending_gpu_events // 2:
+            collect_gpu_events()
+
+
+def dump():
+    collect_gpu_events()
+
+    with lock:
+        return [x.dump() for x in stats.values()]
+
+
+def reset():
+    with lock:
+        stats.clear()
+        pending_gpu_events.clear()
+
+
+def prometheus_text():
+    """returns recorded stats in Prometheus text exposition format"""
+
+    def escape(text):
+        return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    all_stats = dump()
+    lines = []
+
+    for metric, description in [('wall', 'wall time'), ('gpu', 'GPU time')]:
+        name = f'sdwebui_script_hook_{metric}_seconds'
+        lines.append(f'# HELP {name} {description} spent in a script hook')
+        lines.append(f'# TYPE {name} histogram')
+
+        for hook_stats in all_stats:
+            histogram = hook_stats[metric]
+            labels = f'script="{escape(hook_stats["script"])}",file="{escape(hook_stats["file"])}",hook="{escape(hook_stats["hook"])}"'
+
+            for le, count in histogram['buckets'].items():
+                lines.append(f'{name}_bucket{{{labels},le="{le}"}} {count}')
+
+            lines.append(f'{name}_sum{{{labels}}} {histogram["total"]}')
+            lines.append(f'{name}_count{{{labels}}} {histogram["count"]}')
+
+    name = 'sdwebui_script_hook_over_budget_total'
+    lines.append(f'# HELP {name} number of script hook calls that took longer than the configured budget')
+    lines.append(f'# TYPE {name} counter')
+    for hook_stats in all_stats:
+        labels = f'script="{escape(hook_stats["script"])}",file="{escape(hook_stats["file"])}",hook="{escape(hook_stats["hook"])}"'
+        lines.append(f'{name}{{{labels}}} {hook_stats["over_budget"]}')
+
+    return '\n'.join(lines) + '\n'
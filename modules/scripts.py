@@ -1,3 +1,4 @@
+import hashlib
 import os
 import re
 import sys
@@ -7,7 +8,7 @@ from dataclasses import dataclass
 
 import gradio as gr
 
-from modules import shared, paths, script_callbacks, extensions, script_loading, scripts_postprocessing, errors, timer, util
+from modules import shared, paths, script_callbacks, extensions, script_loading, scripts_postprocessing, errors, timer, util, cache, script_profiler
 
 topological_sort = util.topological_sort
 
@@ -393,8 +394,56 @@ class ScriptWithDependencies:
     load_after: list
 
 
+def get_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def list_scripts_cache_key(scriptdirname, extension, include_extensions):
+    """returns a string identifying everything script discovery depends on: directory listings (via mtimes of the
+    directories scripts are listed from), metadata.ini files and the set of installed and active extensions"""
+
+    parts = [scriptdirname, extension, str(include_extensions), paths.script_path, str(get_mtime(os.path.join(paths.script_path, scriptdirname)))]
+
+    if include_extensions:
+        parts.append(",".join(sorted(extensions.loaded_extensions)))
+
+        for ext in extensions.active():
+            parts += [ext.canonical_name, ext.path, str(ext.is_builtin), ext.version, str(get_mtime(os.path.join(ext.path, scriptdirname))), str(get_mtime(os.path.join(ext.path, extensions.ExtensionMetadata.filename)))]
+
+    return hashlib.sha256("\n".join(parts).encode("utf8")).hexdigest()
+
+
 def list_scripts(scriptdirname, extension, *, include_extensions=True):
+    """returns an ordered list of ScriptFile for scripts in scriptdirname of webui and (optionally) of active extensions;
+    the result is cached on disk and reused on next startup if no directory or extension metadata has changed"""
+
+    if not shared.opts.startup_cache_scripts:
+        scripts_list, problems = discover_scripts(scriptdirname, extension, include_extensions=include_extensions)
+    else:
+        key = list_scripts_cache_key(scriptdirname, extension, include_extensions)
+        startup_cache = cache.cache("startup-scripts")
+        title = f"{scriptdirname}/{extension}/{include_extensions}"
+
+        entry = startup_cache.get(title)
+        if entry and entry.get("key") == key:
+            scripts_list = [ScriptFile(*x) for x in entry["scripts"]]
+            problems = entry["problems"]
+        else:
+            scripts_list, problems = discover_scripts(scriptdirname, extension, include_extensions=include_extensions)
+            startup_cache[title] = {"key": key, "scripts": [tuple(x) for x in scripts_list], "problems": problems}
+
+    for problem in problems:
+        errors.report(problem, exc_info=False)
+
+    return scripts_list
+
+
+def discover_scripts(scriptdirname, extension, *, include_extensions=True):
     scripts = {}
+    problems = []
 
     loaded_extensions = {ext.canonical_name: ext for ext in extensions.active()}
     loaded_extensions_scripts = {ext.canonical_name: [] for ext in extensions.active()}
@@ -461,14 +510,14 @@ def list_scripts(scriptdirname, extension, *, include_extensions=True):
     for script_canonical_name, script in scripts.items():
         for required_script in script.requires:
             if required_script not in scripts and required_script not in loaded_extensions:
-                errors.report(f'Script "{script_canonical_name}" requires "{required_script}" to be loaded, but it is not.', exc_info=False)
+                problems.append(f'Script "{script_canonical_name}" requires "{required_script}" to be loaded, but it is not.')
 
         dependencies[script_canonical_name] = script.load_after
 
     ordered_scripts = topological_sort(dependencies)
     scripts_list = [scripts[script_canonical_name].file for script_canonical_name in ordered_scripts]
 
-    return scripts_list
+    return scripts_list, problems
 
 
 def list_files_with_name(filename):
@@ -832,7 +881,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('before_process'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.before_process(p, *script_args)
+                with script_profiler.measure(script, 'before_process'):
+                    script.before_process(p, *script_args)
             except Exception:
                 errors.report(f"Error running before_process: {script.filename}", exc_info=True)
 
@@ -840,7 +890,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('process'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.process(p, *script_args)
+                with script_profiler.measure(script, 'process'):
+                    script.process(p, *script_args)
             except Exception:
                 errors.report(f"Error running process: {script.filename}", exc_info=True)
 
@@ -848,7 +899,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('process_before_every_sampling'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.process_before_every_sampling(p, *script_args, **kwargs)
+                with script_profiler.measure(script, 'process_before_every_sampling'):
+                    script.process_before_every_sampling(p, *script_args, **kwargs)
             except Exception:
                 errors.report(f"Error running process_before_every_sampling: {script.filename}", exc_info=True)
 
@@ -856,7 +908,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('before_process_batch'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.before_process_batch(p, *script_args, **kwargs)
+                with script_profiler.measure(script, 'before_process_batch'):
+                    script.before_process_batch(p, *script_args, **kwargs)
             except Exception:
                 errors.report(f"Error running before_process_batch: {script.filename}", exc_info=True)
 
@@ -864,7 +917,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('before_process_init_images'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.before_process_init_images(p, pp, *script_args, **kwargs)
+                with script_profiler.measure(script, 'before_process_init_images'):
+                    script.before_process_init_images(p, pp, *script_args, **kwargs)
             except Exception:
                 errors.report(f"Error running before_process_init_images: {script.filename}", exc_info=True)
 
@@ -872,7 +926,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('after_extra_networks_activate'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.after_extra_networks_activate(p, *script_args, **kwargs)
+                with script_profiler.measure(script, 'after_extra_networks_activate'):
+                    script.after_extra_networks_activate(p, *script_args, **kwargs)
             except Exception:
                 errors.report(f"Error running after_extra_networks_activate: {script.filename}", exc_info=True)
 
@@ -880,7 +935,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('process_batch'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.process_batch(p, *script_args, **kwargs)
+                with script_profiler.measure(script, 'process_batch'):
+                    script.process_batch(p, *script_args, **kwargs)
             except Exception:
                 errors.report(f"Error running process_batch: {script.filename}", exc_info=True)
 
@@ -888,7 +944,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('postprocess'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.postprocess(p, processed, *script_args)
+                with script_profiler.measure(script, 'postprocess'):
+                    script.postprocess(p, processed, *script_args)
             except Exception:
                 errors.report(f"Error running postprocess: {script.filename}", exc_info=True)
 
@@ -896,7 +953,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('postprocess_batch'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.postprocess_batch(p, *script_args, images=images, **kwargs)
+                with script_profiler.measure(script, 'postprocess_batch'):
+                    script.postprocess_batch(p, *script_args, images=images, **kwargs)
             except Exception:
                 errors.report(f"Error running postprocess_batch: {script.filename}", exc_info=True)
 
@@ -904,7 +962,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('postprocess_batch_list'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.postprocess_batch_list(p, pp, *script_args, **kwargs)
+                with script_profiler.measure(script, 'postprocess_batch_list'):
+                    script.postprocess_batch_list(p, pp, *script_args, **kwargs)
             except Exception:
                 errors.report(f"Error running postprocess_batch_list: {script.filename}", exc_info=True)
 
@@ -912,7 +971,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('post_sample'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.post_sample(p, ps, *script_args)
+                with script_profiler.measure(script, 'post_sample'):
+                    script.post_sample(p, ps, *script_args)
             except Exception:
                 errors.report(f"Error running post_sample: {script.filename}", exc_info=True)
 
@@ -920,7 +980,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('on_mask_blend'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.on_mask_blend(p, mba, *script_args)
+                with script_profiler.measure(script, 'on_mask_blend'):
+                    script.on_mask_blend(p, mba, *script_args)
             except Exception:
                 errors.report(f"Error running post_sample: {script.filename}", exc_info=True)
 
@@ -928,7 +989,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('postprocess_image'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.postprocess_image(p, pp, *script_args)
+                with script_profiler.measure(script, 'postprocess_image'):
+                    script.postprocess_image(p, pp, *script_args)
             except Exception:
                 errors.report(f"Error running postprocess_image: {script.filename}", exc_info=True)
 
@@ -936,7 +998,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('postprocess_maskoverlay'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.postprocess_maskoverlay(p, ppmo, *script_args)
+                with script_profiler.measure(script, 'postprocess_maskoverlay'):
+                    script.postprocess_maskoverlay(p, ppmo, *script_args)
             except Exception:
                 errors.report(f"Error running postprocess_image: {script.filename}", exc_info=True)
 
@@ -944,7 +1007,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('postprocess_image_after_composite'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.postprocess_image_after_composite(p, pp, *script_args)
+                with script_profiler.measure(script, 'postprocess_image_after_composite'):
+                    script.postprocess_image_after_composite(p, pp, *script_args)
             except Exception:
                 errors.report(f"Error running postprocess_image_after_composite: {script.filename}", exc_info=True)
 
@@ -999,7 +1063,8 @@ class ScriptRunner:
         for script in self.ordered_scripts('before_hr'):
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.before_hr(p, *script_args)
+                with script_profiler.measure(script, 'before_hr'):
+                    script.before_hr(p, *script_args)
             except Exception:
                 errors.report(f"Error running before_hr: {script.filename}", exc_info=True)
 
@@ -1010,7 +1075,8 @@ class ScriptRunner:
 
             try:
                 script_args = p.script_args[script.args_from:script.args_to]
-                script.setup(p, *script_args)
+                with script_profiler.measure(script, 'setup'):
+                    script.setup(p, *script_args)
             except Exception:
                 errors.report(f"Error running setup: {script.filename}", exc_info=True)
 
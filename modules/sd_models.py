@@ -16,7 +16,7 @@ import gc
 from modules import paths, shared, modelloader, devices, script_callbacks, sd_vae, sd_disable_initialization, errors, hashes, sd_models_config, sd_unet, sd_models_xl, cache, extra_networks, processing, lowvram, sd_hijack, patches
 from modules.timer import Timer
 import numpy as np
-from modules_forge import forge_loader
+from modules_forge import forge_loader, weight_store
 import modules_forge.ops as forge_ops
 from ldm_patched.modules.ops import manual_cast
 from ldm_patched.modules import model_management as model_management
@@ -344,6 +344,12 @@ def get_checkpoint_state_dict(checkpoint_info: CheckpointInfo, timer):
         checkpoints_loaded.move_to_end(checkpoint_info)
         return checkpoints_loaded[checkpoint_info]
 
+    store = weight_store.get_store()
+    if store is not None:
+        res = store.load(checkpoint_info.sha256, lambda: read_state_dict(checkpoint_info.filename, map_location="cpu"))
+        timer.record("load weights from shared store")
+        return res
+
     print(f"Loading weights [{sd_model_hash}] from {checkpoint_info.filename}")
     res = read_state_dict(checkpoint_info.filename)
     timer.record("load weights from disk")
@@ -637,10 +643,18 @@ def get_obj_from_str(string, reload=False):
         importlib.reload(module_imp)
     return getattr(importlib.import_module(module, package=None), cls)
 
+def release_shared_weights(checkpoint_info):
+    """Gives back the lease on the checkpoint's weights in the shared weight store taken when they were loaded."""
+    if weight_store.store is not None and checkpoint_info is not None:
+        weight_store.store.release(checkpoint_info.sha256)
+
+
 def unload_all_models_when_pinned():
     global model_data
     print(" ------------ Unloading all models (pinned shared memory)... -------------")
     for model in model_data.loaded_sd_models:
+        release_shared_weights(model.sd_checkpoint_info)
+
         if hasattr(model, 'model_unload'):
             model.model_unload()
         elif hasattr(model, 'to'):
@@ -695,7 +709,12 @@ def load_model(checkpoint_info=None, already_loaded_state_dict=None):
     else:
         state_dict = get_checkpoint_state_dict(checkpoint_info, timer)
 
-    sd_model = forge_loader.load_model_for_a1111(timer=timer, checkpoint_info=checkpoint_info, state_dict=state_dict)
+    try:
+        sd_model = forge_loader.load_model_for_a1111(timer=timer, checkpoint_info=checkpoint_info, state_dict=state_dict)
+    except Exception:
+        if already_loaded_state_dict is None:
+            release_shared_weights(checkpoint_info)
+        raise
     sd_model.filename = checkpoint_info.filename
 
     model_data.loaded_sd_models.insert(0, sd_model)  # Add new model to the front
@@ -732,6 +751,8 @@ def unload_first_loaded_model():
 
     first_loaded_model = model_data.loaded_sd_models.pop(-1)  # Remove the last item (first loaded)
     print(f"Unloading first loaded model: {first_loaded_model.sd_checkpoint_info.title}...")
+
+    release_shared_weights(first_loaded_model.sd_checkpoint_info)
     
     if hasattr(first_loaded_model, 'model_unload'):
         first_loaded_model.model_unload()
@@ -753,6 +774,30 @@ def reload_model_weights(sd_model=None, info=None, forced_reload=False):
 
 
 def unload_model_weights(sd_model=None, info=None):
+    """Unloads the current model (or sd_model) and its shared weights; the next generation loads a model again."""
+    global model_data
+
+    sd_model = sd_model or model_data.sd_model
+    if sd_model is None:
+        return None
+
+    if sd_model in model_data.loaded_sd_models:
+        model_data.loaded_sd_models.remove(sd_model)
+        release_shared_weights(sd_model.sd_checkpoint_info)
+
+    if hasattr(sd_model, 'model_unload'):
+        sd_model.model_unload()
+    elif hasattr(sd_model, 'to'):
+        sd_model.to('cpu')
+
+    if model_data.sd_model is sd_model:
+        model_data.sd_model = None
+        model_data.was_loaded_at_least_once = False
+
+    model_management.soft_empty_cache()
+    gc.collect()
+    print(f"Unloaded {sd_model.sd_checkpoint_info.title}.")
+
     return sd_model
 
 
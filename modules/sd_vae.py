@@ -238,6 +238,9 @@ def load_vae(model, vae_file=None, vae_source="from unknown source"):
 def _load_vae_dict(model, vae_dict_1):
     model.first_stage_model.load_state_dict(vae_dict_1)
 
+    # the weights no longer match the checkpoint's, so don't point them back at the shared weight store on offload
+    model.first_stage_model.shared_weights = None
+
 
 def clear_loaded_vae():
     global loaded_vae_file
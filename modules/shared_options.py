@@ -115,6 +115,7 @@ options_templates.update(options_section(('upscaling', "Upscaling", "postprocess
     "SPAN_tile_overlap": OptionInfo(32, "Tile overlap for SPAN upscalers.", gr.Slider, {"minimum": 0, "maximum": 2048, "step": 32}).info("Low values = visible seam"),
     "COMPACT_tile": OptionInfo(0, "Tile size for COMPACT upscalers.", gr.Slider, {"minimum": 0, "maximum": 4096, "step": 16}).info("0 = no tiling"),
     "COMPACT_tile_overlap": OptionInfo(32, "Tile overlap for COMPACT upscalers.", gr.Slider, {"minimum": 0, "maximum": 2048, "step": 16}).info("Low values = visible seam"),
+    "upscaler_tile_batch_size": OptionInfo(1, "Number of tiles upscaled at once by tiled upscalers.", gr.Slider, {"minimum": 1, "maximum": 32, "step": 1}).info("higher = faster, uses more VRAM"),
     "realesrgan_enabled_models": OptionInfo(["R-ESRGAN 4x+", "R-ESRGAN 4x+ Anime6B"], "Select which Real-ESRGAN models to show in the web UI.", gr.CheckboxGroup, lambda: {"choices": shared_items.realesrgan_models_names()}),
     "dat_enabled_models": OptionInfo(["DAT x2", "DAT x3", "DAT x4"], "Select which DAT models to show in the web UI.", gr.CheckboxGroup, lambda: {"choices": shared_items.dat_models_names()}),
     "DAT_tile": OptionInfo(192, "Tile size for DAT upscalers.", gr.Slider, {"minimum": 0, "maximum": 512, "step": 16}).info("0 = no tiling"),
@@ -143,6 +144,7 @@ options_templates.update(options_section(('system', "System", "system"), {
     "disable_mmap_load_safetensors": OptionInfo(False, "Disable memmapping for loading .safetensors files.").info("fixes very slow loading speed in some cases"),
     "hide_ldm_prints": OptionInfo(True, "Prevent Stability-AI's ldm/sgm modules from printing noise to console."),
     "dump_stacks_on_signal": OptionInfo(False, "Print stack traces before exiting the program with ctrl+c."),
+    "startup_cache_scripts": OptionInfo(True, "Cache the list of scripts found in webui and extensions between launches").info("the cache is invalidated when a scripts directory or metadata.ini of an extension changes, or extensions are installed, removed, enabled or disabled"),
 }))
 
 options_templates.update(options_section(('profiler', "Profiler", "system"), {
@@ -159,6 +161,13 @@ Warning: writing profile can take a lot of time, up to 30 seconds, and the file
     "profiling_profile_memory": OptionInfo(True, "Profile memory"),
     "profiling_with_stack": OptionInfo(True, "Include python stack"),
     "profiling_filename": OptionInfo("trace.json", "Profile filename"),
+    "script_profiler_explanation": OptionHTML("""
+Time spent in hooks of scripts and extensions (process, process_batch, postprocess_image, ...) is always recorded.
+Statistics per script and hook can be read from the <code>/sdapi/v1/script-profile</code> API endpoint, add <code>?format=prometheus</code> for Prometheus text format.
+"""),
+    "script_profiler_gpu": OptionInfo(False, "Also measure GPU time of script hooks").info("uses CUDA events; does not wait for the GPU"),
+    "script_profiler_budget_ms": OptionInfo(0, "Time budget for a single call of a script hook (ms)", gr.Number).info("calls taking longer are counted in statistics; 0 = disable"),
+    "script_profiler_warn": OptionInfo(True, "Print a warning to console when a script hook exceeds the time budget"),
 }))
 
 options_templates.update(options_section(('API', "API", "system"), {
@@ -170,6 +179,9 @@ options_templates.update(options_section(('API', "API", "system"), {
 options_templates.update(options_section(('training', "Training", "training"), {
     "unload_models_when_training": OptionInfo(False, "Move VAE and CLIP to RAM when training if possible. Saves VRAM."),
     "pin_memory": OptionInfo(False, "Turn on pin_memory for DataLoader. Makes training slightly faster but can increase memory usage."),
+    "training_dataloader_workers": OptionInfo(0, "Number of DataLoader worker processes for training", gr.Slider, {"minimum": 0, "maximum": 16, "step": 1}).info("0 = load batches in the main process; not used with random latent sampling"),
+    "training_encode_batch_size": OptionInfo(8, "Batch size for encoding the training dataset with VAE", gr.Slider, {"minimum": 1, "maximum": 64, "step": 1}),
+    "training_cache_latents": OptionInfo(False, "Cache latents and conds of the training dataset on disk").info("a restarted training run only encodes images that have changed; uses disk space for a copy of the dataset per VAE, model and resolution, files in cache/training-latents are not removed automatically"),
     "save_optimizer_state": OptionInfo(False, "Saves Optimizer state as separate *.optim file. Training of embedding or HN can be resumed with the matching optim file."),
     "save_training_settings_to_txt": OptionInfo(True, "Save textual inversion and hypernet settings to a text file whenever training starts."),
     "dataset_filename_word_regex": OptionInfo("", "Filename word regex"),
@@ -272,6 +284,8 @@ options_templates.update(options_section(('img2img', "img2img", "sd"), {
     "return_mask": OptionInfo(False, "For inpainting, include the greyscale mask in results for web"),
     "return_mask_composite": OptionInfo(False, "For inpainting, include masked composite in results for web"),
     "img2img_batch_show_results_limit": OptionInfo(32, "Show the first N batch img2img results in UI", gr.Slider, {"minimum": -1, "maximum": 1000, "step": 1}).info('0: disable, -1: show all images. Too many images can cause lag'),
+    "img2img_batch_group_size": OptionInfo(1, "Batch img2img: maximum input images per sampling batch", gr.Slider, {"minimum": 1, "maximum": 32, "step": 1}).info("consecutive images with the same size, mask and parameters are generated together when an output directory is set and no script is selected; results are named after the input files; 1 = disable"),
+    "img2img_batch_resume": OptionInfo(False, "Batch img2img: skip input images already processed into the output directory").info("progress is recorded in a manifest file in the output directory, so an interrupted batch can be resumed"),
     "overlay_inpaint": OptionInfo(True, "Overlay original for inpaint").info("when inpainting, overlay the original image over the areas that weren't inpainted."),
 }))
 
@@ -288,6 +302,7 @@ options_templates.update(options_section(('optimizations', "Optimizations", "sd"
     "batch_cond_uncond": OptionInfo(True, "Batch cond/uncond").info("do both conditional and unconditional denoising in one batch; uses a bit more VRAM during sampling, but improves speed; previously this was controlled by --always-batch-cond-uncond commandline argument"),
     "fp8_storage": OptionInfo("Disable", "FP8 weight", gr.Radio, {"choices": ["Disable", "Enable for SDXL", "Enable"]}).info("Use FP8 to store Linear/Conv layers' weight. Require pytorch>=2.1.0."),
     "cache_fp16_weight": OptionInfo(False, "Cache FP16 weight for LoRA").info("Cache fp16 weight when enabling FP8, will increase the quality of LoRA. Use more system ram."),
+    "xyz_grid_cell_batch_size": OptionInfo(1, "X/Y/Z plot: maximum cells per batch", gr.Slider, {"minimum": 1, "maximum": 32, "step": 1}).info("cells that only differ in seed, variation seed or prompt S/R/order are generated as one batch; 1=disable; higher=faster, uses more VRAM; may slightly change images"),
 }))
 
 options_templates.update(options_section(('compatibility', "Compatibility", "sd"), {
@@ -548,6 +563,8 @@ options_templates.update(options_section(('postprocessing', "Postprocessing", "p
     'postprocessing_operation_order': OptionInfo([], "Postprocessing operation order", ui_components.DropdownMulti, lambda: {"choices": [x.name for x in shared_items.postprocessing_scripts(filter_out_main_ui_only=True)]}),
     'upscaling_max_images_in_cache': OptionInfo(5, "Maximum number of images in upscaling cache", gr.Slider, {"minimum": 0, "maximum": 10, "step": 1}),
     'postprocessing_existing_caption_action': OptionInfo("Ignore", "Action for existing captions", gr.Radio, {"choices": ["Ignore", "Keep", "Prepend", "Append"]}).info("when generating captions using postprocessing; Ignore = use generated; Keep = use original; Prepend/Append = combine both"),
+    'postprocessing_batch_prefetch': OptionInfo(4, "Number of images loaded ahead in background threads when processing a batch in extras", gr.Slider, {"minimum": 0, "maximum": 32, "step": 1}).info("0 = load images one by one"),
+    'postprocessing_async_save': OptionInfo(True, "Save images processed in extras in a background thread"),
 }))
 
 options_templates.update(options_section((None, "Hidden options"), {
@@ -1,6 +1,10 @@
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import PIL
+import safetensors.torch
 import torch
 from torch.utils.data import Dataset, DataLoader, Sampler
 from torchvision import transforms
@@ -9,7 +13,7 @@ from random import shuffle, choices
 
 import random
 import tqdm
-from modules import devices, shared, images
+from modules import cache, devices, shared, images, sd_hijack, sd_vae
 import re
 
 from ldm.modules.distributions.distributions import DiagonalGaussianDistribution
@@ -29,9 +33,73 @@ class DatasetEntry:
         self.pixel_values = pixel_values
 
 
+class TrainingCache:
+    """
+    Cache of VAE latents and text conds of training images on disk, one safetensors file per entry.
+
+    Entries are keyed by image content, VAE and resolution (latents) or by text, model and text encoder settings
+    (conds), so a restarted training run only encodes images that changed. Entries are loaded into memory whole.
+
+    Entries are never removed; stale ones stay on disk until the directory is deleted by hand.
+    """
+
+    def __init__(self, subsection):
+        self.path = os.path.join(cache.cache_dir, subsection)
+
+    @staticmethod
+    def make_key(*parts):
+        return hashlib.sha256("\n".join(str(x) for x in parts).encode("utf8")).hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.path, key[:2], f"{key}.safetensors")
+
+    def get(self, key):
+        filename = self.filename(key)
+        if not os.path.isfile(filename):
+            return None
+
+        try:
+            return safetensors.torch.load_file(filename)
+        except Exception as e:
+            print(f"Cannot read cached training data {filename}: {e}")
+            return None
+
+    def put(self, key, tensors):
+        filename = self.filename(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        safetensors.torch.save_file({k: v.detach().to(devices.cpu).contiguous() for k, v in tensors.items()}, tmp_filename)
+        os.replace(tmp_filename, filename)
+
+
+training_cache = TrainingCache("training-latents")
+
+cond_options = ("CLIP_stop_at_last_layers", "sdxl_clip_l_skip", "emphasis", "use_old_emphasis_implementation", "comma_padding_backtrack")
+"""settings that change the cond of a text and so are part of its cache key"""
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+class LoadedImage:
+    def __init__(self, path, image, alpha_channel, sha256):
+        self.path = path
+        self.image = image
+        self.alpha_channel = alpha_channel
+        self.sha256 = sha256
+        self.latent = None
+        self.cache_key = None
+
+
 class PersonalizedBase(Dataset):
     def __init__(self, data_root, width, height, repeats, flip_p=0.5, placeholder_token="*", model=None, cond_model=None, device=None, template_file=None, include_cond=False, batch_size=1, gradient_step=1, shuffle_tags=False, tag_drop_out=0, latent_sampling_method='once', varsize=False, use_weight=False):
-        re_word = re.compile(shared.opts.dataset_filename_word_regex) if shared.opts.dataset_filename_word_regex else None
+        self.re_word = re.compile(shared.opts.dataset_filename_word_regex) if shared.opts.dataset_filename_word_regex else None
 
         self.placeholder_token = placeholder_token
 
@@ -54,87 +122,56 @@ class PersonalizedBase(Dataset):
         self.tag_drop_out = tag_drop_out
         groups = defaultdict(list)
 
+        use_cache = shared.opts.training_cache_latents
+        encode_batch_size = max(1, int(shared.opts.training_encode_batch_size))
+        model_id = getattr(model, 'sd_model_hash', None) or model.sd_checkpoint_info.filename
+        vae_id = sd_vae.get_loaded_vae_hash() or model_id
+
+        def load(path):
+            return self.load_image(path, width, height, varsize, use_weight, use_cache)
+
         print("Preparing dataset...")
-        for path in tqdm.tqdm(self.image_paths):
-            alpha_channel = None
-            if shared.state.interrupted:
-                raise Exception("interrupted")
-            try:
-                image = images.read(path)
-                #Currently does not work for single color transparency
-                #We would need to read image.info['transparency'] for that
-                if use_weight and 'A' in image.getbands():
-                    alpha_channel = image.getchannel('A')
-                image = image.convert('RGB')
-                if not varsize:
-                    image = image.resize((width, height), PIL.Image.BICUBIC)
-            except Exception:
-                continue
-
-            text_filename = f"{os.path.splitext(path)[0]}.txt"
-            filename = os.path.basename(path)
-
-            if os.path.exists(text_filename):
-                with open(text_filename, "r", encoding="utf8") as file:
-                    filename_text = file.read()
-            else:
-                filename_text = os.path.splitext(filename)[0]
-                filename_text = re.sub(re_numbers_at_start, '', filename_text)
-                if re_word:
-                    tokens = re_word.findall(filename_text)
-                    filename_text = (shared.opts.dataset_filename_join_string or "").join(tokens)
-
-            npimage = np.array(image).astype(np.uint8)
-            npimage = (npimage / 127.5 - 1.0).astype(np.float32)
-
-            torchdata = torch.from_numpy(npimage).permute(2, 0, 1).to(device=device, dtype=torch.float32)
-            latent_sample = None
+        with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor, tqdm.tqdm(total=len(self.image_paths)) as progress:
+            # images are read on the thread pool a few encoding batches at a time, so that they don't all sit in RAM
+            for start in range(0, len(self.image_paths), encode_batch_size * 4):
+                if shared.state.interrupted:
+                    raise Exception("interrupted")
 
-            with devices.autocast():
-                latent_dist = model.encode_first_stage(torchdata.unsqueeze(dim=0))
-
-            #Perform latent sampling, even for random sampling.
-            #We need the sample dimensions for the weights
-            if latent_sampling_method == "deterministic":
-                if isinstance(latent_dist, DiagonalGaussianDistribution):
-                    # Works only for DiagonalGaussianDistribution
-                    latent_dist.std = 0
-                else:
-                    latent_sampling_method = "once"
-            latent_sample = model.get_first_stage_encoding(latent_dist).squeeze().to(devices.cpu)
-
-            if use_weight and alpha_channel is not None:
-                channels, *latent_size = latent_sample.shape
-                weight_img = alpha_channel.resize(latent_size)
-                npweight = np.array(weight_img).astype(np.float32)
-                #Repeat for every channel in the latent sample
-                weight = torch.tensor([npweight] * channels).reshape([channels] + latent_size)
-                #Normalize the weight to a minimum of 0 and a mean of 1, that way the loss will be comparable to default.
-                weight -= weight.min()
-                weight /= weight.mean()
-            elif use_weight:
-                #If an image does not have a alpha channel, add a ones weight map anyway so we can stack it later
-                weight = torch.ones(latent_sample.shape)
-            else:
-                weight = None
-
-            if latent_sampling_method == "random":
-                entry = DatasetEntry(filename=path, filename_text=filename_text, latent_dist=latent_dist, weight=weight)
-            else:
-                entry = DatasetEntry(filename=path, filename_text=filename_text, latent_sample=latent_sample, weight=weight)
-
-            if not (self.tag_drop_out != 0 or self.shuffle_tags):
-                entry.cond_text = self.create_text(filename_text)
-
-            if include_cond and not (self.tag_drop_out != 0 or self.shuffle_tags):
-                with devices.autocast():
-                    entry.cond = cond_model([entry.cond_text]).to(devices.cpu).squeeze(0)
-            groups[image.size].append(len(self.dataset))
-            self.dataset.append(entry)
-            del torchdata
-            del latent_dist
-            del latent_sample
-            del weight
+                paths = self.image_paths[start:start + encode_batch_size * 4]
+                loaded = [x for x in executor.map(load, paths) if x is not None]
+
+                self.encode_latents(loaded, model, device, vae_id, encode_batch_size, use_cache)
+
+                for item in loaded:
+                    latent_dist = item.latent
+
+                    #Perform latent sampling, even for random sampling.
+                    #We need the sample dimensions for the weights
+                    if latent_sampling_method == "deterministic":
+                        if isinstance(latent_dist, DiagonalGaussianDistribution):
+                            # Works only for DiagonalGaussianDistribution
+                            latent_dist.std = 0
+                        else:
+                            latent_sampling_method = "once"
+                    latent_sample = model.get_first_stage_encoding(latent_dist).squeeze().to(devices.cpu)
+
+                    weight = self.create_weight(item.alpha_channel, latent_sample, use_weight)
+                    filename_text = self.read_filename_text(item.path)
+
+                    if latent_sampling_method == "random":
+                        entry = DatasetEntry(filename=item.path, filename_text=filename_text, latent_dist=latent_dist, weight=weight)
+                    else:
+                        entry = DatasetEntry(filename=item.path, filename_text=filename_text, latent_sample=latent_sample, weight=weight)
+
+                    if not (self.tag_drop_out != 0 or self.shuffle_tags):
+                        entry.cond_text = self.create_text(filename_text)
+
+                    if include_cond and not (self.tag_drop_out != 0 or self.shuffle_tags):
+                        entry.cond = self.encode_cond(cond_model, entry.cond_text, model_id, use_cache)
+                    groups[item.image.size].append(len(self.dataset))
+                    self.dataset.append(entry)
+
+                progress.update(len(paths))
 
         self.length = len(self.dataset)
         self.groups = list(groups.values())
@@ -149,6 +186,113 @@ class PersonalizedBase(Dataset):
                 print(f"  {w}x{h}: {len(ids)}")
             print()
 
+    def load_image(self, path, width, height, varsize, use_weight, hash_file):
+        try:
+            image = images.read(path)
+            #Currently does not work for single color transparency
+            #We would need to read image.info['transparency'] for that
+            alpha_channel = image.getchannel('A') if use_weight and 'A' in image.getbands() else None
+            image = image.convert('RGB')
+            if not varsize:
+                image = image.resize((width, height), PIL.Image.BICUBIC)
+            sha256 = file_sha256(path) if hash_file else None
+        except Exception:
+            return None
+
+        return LoadedImage(path, image, alpha_channel, sha256)
+
+    def encode_latents(self, loaded, model, device, vae_id, encode_batch_size, use_cache):
+        """Sets item.latent for all loaded images, from the cache or by encoding images of the same size in batches on the GPU."""
+
+        pending = defaultdict(list)
+        for item in loaded:
+            if use_cache:
+                item.cache_key = TrainingCache.make_key("latent", item.sha256, vae_id, *item.image.size)
+                cached = training_cache.get(item.cache_key)
+                if cached is not None:
+                    item.latent = DiagonalGaussianDistribution(cached["parameters"]) if "parameters" in cached else cached["latent"]
+                    continue
+
+            pending[item.image.size].append(item)
+
+        for items in pending.values():
+            for i in range(0, len(items), encode_batch_size):
+                batch = items[i:i + encode_batch_size]
+                npimages = np.stack([np.array(item.image).astype(np.uint8) for item in batch])
+                npimages = (npimages / 127.5 - 1.0).astype(np.float32)
+                torchdata = torch.from_numpy(npimages).permute(0, 3, 1, 2).to(device=device, dtype=torch.float32)
+
+                with devices.autocast():
+                    latent_dist = model.encode_first_stage(torchdata)
+
+                for j, item in enumerate(batch):
+                    if isinstance(latent_dist, DiagonalGaussianDistribution):
+                        item.latent = DiagonalGaussianDistribution(latent_dist.parameters[j:j + 1])
+                        tensors = {"parameters": item.latent.parameters}
+                    else:
+                        item.latent = latent_dist[j:j + 1]
+                        tensors = {"latent": item.latent}
+
+                    if use_cache:
+                        training_cache.put(item.cache_key, tensors)
+
+                del torchdata
+                del latent_dist
+
+    @staticmethod
+    def create_weight(alpha_channel, latent_sample, use_weight):
+        if not use_weight:
+            return None
+
+        if alpha_channel is None:
+            #If an image does not have a alpha channel, add a ones weight map anyway so we can stack it later
+            return torch.ones(latent_sample.shape)
+
+        channels, *latent_size = latent_sample.shape
+        weight_img = alpha_channel.resize(latent_size)
+        npweight = np.array(weight_img).astype(np.float32)
+        #Repeat for every channel in the latent sample
+        weight = torch.tensor([npweight] * channels).reshape([channels] + latent_size)
+        #Normalize the weight to a minimum of 0 and a mean of 1, that way the loss will be comparable to default.
+        weight -= weight.min()
+        weight /= weight.mean()
+        return weight
+
+    def read_filename_text(self, path):
+        text_filename = f"{os.path.splitext(path)[0]}.txt"
+        filename = os.path.basename(path)
+
+        if os.path.exists(text_filename):
+            with open(text_filename, "r", encoding="utf8") as file:
+                return file.read()
+
+        filename_text = os.path.splitext(filename)[0]
+        filename_text = re.sub(re_numbers_at_start, '', filename_text)
+        if self.re_word:
+            tokens = self.re_word.findall(filename_text)
+            filename_text = (shared.opts.dataset_filename_join_string or "").join(tokens)
+
+        return filename_text
+
+    @staticmethod
+    def encode_cond(cond_model, text, model_id, use_cache):
+        if not use_cache:
+            with devices.autocast():
+                return cond_model([text]).to(devices.cpu).squeeze(0)
+
+        # textual inversion embeddings used in the text change its cond
+        embeddings = sorted((name, embedding.checksum()) for name, embedding in sd_hijack.model_hijack.embedding_db.word_embeddings.items() if name in text)
+        options = [(name, getattr(shared.opts, name, None)) for name in cond_options]
+        key = TrainingCache.make_key("cond", text, model_id, embeddings, options)
+        cached = training_cache.get(key)
+        if cached is not None:
+            return cached["cond"]
+
+        with devices.autocast():
+            cond = cond_model([text]).to(devices.cpu).squeeze(0)
+        training_cache.put(key, {"cond": cond})
+        return cond
+
     def create_text(self, filename_text):
         text = random.choice(self.lines)
         tags = filename_text.split(',')
@@ -207,8 +351,13 @@ class GroupedBatchSampler(Sampler):
 
 
 class PersonalizedDataLoader(DataLoader):
-    def __init__(self, dataset, latent_sampling_method="once", batch_size=1, pin_memory=False):
-        super(PersonalizedDataLoader, self).__init__(dataset, batch_sampler=GroupedBatchSampler(dataset, batch_size), pin_memory=pin_memory)
+    def __init__(self, dataset, latent_sampling_method="once", batch_size=1, pin_memory=False, num_workers=None):
+        if num_workers is None:
+            num_workers = max(0, int(shared.opts.training_dataloader_workers))
+        if latent_sampling_method == "random":
+            num_workers = 0  # random sampling needs the model, which only exists in the main process
+
+        super(PersonalizedDataLoader, self).__init__(dataset, batch_sampler=GroupedBatchSampler(dataset, batch_size), pin_memory=pin_memory, num_workers=num_workers, persistent_workers=num_workers > 0)
         if latent_sampling_method == "random":
             self.collate_fn = collate_wrapper_random
         else:
@@ -229,6 +378,8 @@ class BatchLoader:
 
     def pin_memory(self):
         self.latent_sample = self.latent_sample.pin_memory()
+        if self.weight is not None:
+            self.weight = self.weight.pin_memory()
         return self
 
 def collate_wrapper(batch):
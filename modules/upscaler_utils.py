@@ -48,6 +48,21 @@ def upscale_pil_patch(model, img: Image.Image) -> Image.Image:
             return torch_bgr_to_pil_image(model(tensor))
 
 
+def upscale_pil_patches(model, imgs: list[Image.Image]) -> list[Image.Image]:
+    """
+    Upscale a list of same-sized PIL images using the given model in a single batch.
+    """
+    param = torch_utils.get_param(model)
+
+    with torch.inference_mode():
+        tensor = torch.stack([pil_image_to_torch_bgr(img) for img in imgs])
+        tensor = tensor.to(device=param.device, dtype=param.dtype)
+        with devices.without_autocast():
+            output = model(tensor)
+
+        return [torch_bgr_to_pil_image(x) for x in output]
+
+
 def upscale_with_model(
     model: Callable[[torch.Tensor], torch.Tensor],
     img: Image.Image,
@@ -63,19 +78,27 @@ def upscale_with_model(
         return output
 
     grid = images.split_grid(img, tile_size, tile_size, tile_overlap)
-    newtiles = []
+    batch_size = max(1, shared.opts.upscaler_tile_batch_size)
+
+    # tiles from split_grid all have the same size, so they can be stacked into batches
+    tiles = [tile for _, _, row in grid.tiles for _, _, tile in row]
+    outputs = []
 
     with tqdm.tqdm(total=grid.tile_count, desc=desc, disable=not shared.opts.enable_upscale_progressbar) as p:
-        for y, h, row in grid.tiles:
-            newrow = []
-            for x, w, tile in row:
-                if shared.state.interrupted:
-                    return img
-                output = upscale_pil_patch(model, tile)
-                scale_factor = output.width // tile.width
-                newrow.append([x * scale_factor, w * scale_factor, output])
-                p.update(1)
-            newtiles.append([y * scale_factor, h * scale_factor, newrow])
+        for i in range(0, len(tiles), batch_size):
+            if shared.state.interrupted:
+                return img
+
+            batch = tiles[i:i + batch_size]
+            outputs += upscale_pil_patches(model, batch) if len(batch) > 1 else [upscale_pil_patch(model, batch[0])]
+            p.update(len(batch))
+
+    scale_factor = outputs[0].width // tiles[0].width
+    outputs = iter(outputs)
+    newtiles = []
+    for y, h, row in grid.tiles:
+        newrow = [[x * scale_factor, w * scale_factor, next(outputs)] for x, w, _ in row]
+        newtiles.append([y * scale_factor, h * scale_factor, newrow])
 
     newgrid = images.Grid(
         newtiles,
@@ -0,0 +1,432 @@
+"""Supervisor mode: run several API-only workers on one host behind a single front server.
+
+The front process started by launch.py with --workers never imports torch or loads models. It starts one
+`launch.py --nowebui` worker per device, each bound to a GPU (`--gpu-device-id`) or a CPU NUMA node
+(`--always-cpu --cpu-numa-node`), and owns the public HTTP API. Generation requests are handed to whichever
+worker becomes idle first, so all workers share one queue; progress, interrupt and skip requests go to the worker running
+the caller's job, and settings changes are broadcast to every worker.
+"""
+
+import collections
+import itertools
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from modules.paths_internal import script_path
+
+job_paths = {
+    "/sdapi/v1/txt2img",
+    "/sdapi/v1/img2img",
+    "/sdapi/v1/extra-single-image",
+    "/sdapi/v1/extra-batch-images",
+    "/sdapi/v1/interrogate",
+}
+
+# requests about the caller's job; sent to the worker that runs (or last ran) it
+job_scoped_paths = {
+    "/sdapi/v1/progress",
+    "/internal/progress",
+    "/sdapi/v1/interrupt",
+    "/sdapi/v1/skip",
+}
+
+interrupt_paths = {
+    "/sdapi/v1/interrupt",
+    "/sdapi/v1/skip",
+}
+
+broadcast_paths = {
+    "/sdapi/v1/options",
+    "/sdapi/v1/refresh-checkpoints",
+    "/sdapi/v1/refresh-vae",
+    "/sdapi/v1/refresh-embeddings",
+    "/sdapi/v1/unload-checkpoint",
+    "/sdapi/v1/reload-checkpoint",
+}
+
+# arguments that belong to the supervisor and must not be passed on to workers; the value is True if the
+# argument takes values
+supervisor_args = {
+    "--workers": True,
+    "--worker-base-port": True,
+    "--port": True,
+    "--listen": False,
+    "--server-name": True,
+    "--nowebui": False,
+    "--share": False,
+    "--ngrok": True,
+}
+
+restart_delay = 5
+max_restart_delay = 300
+max_job_keys = 1000
+acquire_timeout = 600
+"""seconds a job request waits for an idle worker before it is answered with 503"""
+
+hop_by_hop_headers = {"host", "content-length", "content-encoding", "transfer-encoding", "connection", "keep-alive"}
+
+
+def worker_base_args(argv):
+    """Returns argv with supervisor-only arguments removed."""
+
+    res = []
+    skipping_values = False
+    for arg in argv:
+        name = arg.split("=", 1)[0]
+        if name in supervisor_args:
+            skipping_values = supervisor_args[name] and "=" not in arg
+            continue
+
+        if skipping_values and not arg.startswith("--"):
+            continue
+
+        skipping_values = False
+        res.append(arg)
+
+    return res
+
+
+class Worker:
+    def __init__(self, index, device, port):
+        self.index = index
+        self.device = device
+        self.port = port
+        self.process = None
+        self.ready = False
+        self.busy = False
+        self.generation = 0
+        self.job_generation = None
+        self.failures = 0
+        self.restart_after = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def device_args(self):
+        if self.device == "cpu":
+            return ["--always-cpu"]
+
+        if self.device.startswith("numa:"):
+            return ["--always-cpu", "--cpu-numa-node", self.device[len("numa:"):]]
+
+        return ["--gpu-device-id", self.device]
+
+    def start(self, base_args):
+        command = [sys.executable, os.path.join(script_path, "launch.py"), *base_args, "--nowebui", "--skip-prepare-environment", *self.device_args(), "--port", str(self.port)]
+        print(f"Starting worker {self.index} on {self.device}, port {self.port}")
+        self.process = subprocess.Popen(command, cwd=script_path)
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def wait_until_ready(self, timeout=600):
+        deadline = time.time() + timeout
+        while time.time() < deadline and self.is_alive():
+            try:
+                requests.get(f"{self.url}/sdapi/v1/progress", timeout=5)
+                return True
+            except requests.RequestException:
+                time.sleep(1)
+
+        return False
+
+    def stop(self):
+        if self.is_alive():
+            self.process.terminate()
+
+
+class WorkerPool:
+    def __init__(self, workers, base_args):
+        self.workers = workers
+        self.base_args = base_args
+        self.idle = queue.Queue()
+        self.round_robin = itertools.cycle(workers)
+        self.lock = threading.Lock()
+        self.job_workers = collections.OrderedDict()
+
+    def start(self):
+        for worker in self.workers:
+            self.start_worker(worker)
+
+        threading.Thread(target=self.monitor, daemon=True).start()
+
+    def start_worker(self, worker):
+        with self.lock:
+            worker.generation += 1
+            generation = worker.generation
+            worker.busy = False
+            worker.ready = False
+
+        worker.start(self.base_args)
+
+        def wait():
+            if worker.wait_until_ready():
+                print(f"Worker {worker.index} on {worker.device} is ready")
+                worker.failures = 0
+                worker.ready = True
+                self.idle.put((worker, generation))
+            elif generation == worker.generation and worker.is_alive():
+                # stuck during startup; once it exits, monitor restarts it like a crashed worker
+                print(f"Worker {worker.index} on {worker.device} did not become ready, stopping it")
+                worker.stop()
+            else:
+                print(f"Worker {worker.index} on {worker.device} failed to start")
+
+        threading.Thread(target=wait, daemon=True).start()
+
+    def monitor(self):
+        while True:
+            time.sleep(5)
+            for worker in self.workers:
+                if worker.process is None or worker.is_alive():
+                    continue
+
+                if not worker.restart_after:
+                    delay = min(restart_delay * 2 ** worker.failures, max_restart_delay)
+                    worker.failures += 1
+                    worker.restart_after = time.time() + delay
+                    print(f"Worker {worker.index} on {worker.device} exited with code {worker.process.returncode}, restarting in {delay}s")
+
+                if time.time() >= worker.restart_after:
+                    worker.restart_after = 0
+                    self.start_worker(worker)
+
+    def acquire(self, timeout=None):
+        """Blocks until a worker is idle and returns it. Queue entries left over from before a worker was restarted
+        are dropped, so that a worker is never handed out twice.
+
+        Returns None after timeout seconds (acquire_timeout by default), or as soon as no worker process is running."""
+
+        deadline = time.time() + (acquire_timeout if timeout is None else timeout)
+        while True:
+            try:
+                worker, generation = self.idle.get(timeout=1)
+            except queue.Empty:
+                if time.time() >= deadline or not any(x.is_alive() for x in self.workers):
+                    return None
+                continue
+
+            with self.lock:
+                if generation != worker.generation or worker.busy or not worker.is_alive():
+                    continue
+
+                worker.busy = True
+                worker.job_generation = generation
+                return worker
+
+    def release(self, worker):
+        with self.lock:
+            worker.busy = False
+            if worker.job_generation != worker.generation:
+                return  # restarted while running the job; start_worker queues it once it is ready
+
+            generation = worker.generation
+
+        if worker.is_alive():
+            self.idle.put((worker, generation))
+
+    def assign_job(self, keys, worker):
+        """Remembers that jobs identified by keys (task id, client) run on worker."""
+
+        with self.lock:
+            for key in keys:
+                self.job_workers[key] = worker
+                self.job_workers.move_to_end(key)
+
+            while len(self.job_workers) > max_job_keys:
+                self.job_workers.popitem(last=False)
+
+    def job_worker(self, keys):
+        """Returns the worker that runs or last ran the job identified by keys."""
+
+        with self.lock:
+            for key in keys:
+                worker = self.job_workers.get(key)
+                if worker is not None and worker.is_alive():
+                    return worker
+
+        return None
+
+    def any_worker(self):
+        with self.lock:
+            for _ in range(len(self.workers)):
+                worker = next(self.round_robin)
+                if worker.is_alive():
+                    return worker
+
+        return None
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+
+def forward(worker, method, path, headers, body, params):
+    return requests.request(method, worker.url + path, headers=headers, data=body, params=params, timeout=None)
+
+
+class BroadcastError(Exception):
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__("; ".join(f"worker {worker.index} on {worker.device}: {reason}" for worker, reason in failures))
+
+
+def broadcast(pool, method, path, headers, body, params):
+    """Sends the request to every running worker. Returns the last response, or raises BroadcastError naming the
+    workers that could not be reached or answered with a server error."""
+
+    response = None
+    failures = []
+    for worker in pool.workers:
+        if not worker.is_alive():
+            continue
+
+        try:
+            res = forward(worker, method, path, headers, body, params)
+        except requests.RequestException as e:
+            failures.append((worker, str(e)))
+            continue
+
+        if res.status_code >= 500:
+            failures.append((worker, f"HTTP {res.status_code}"))
+        else:
+            response = res
+
+    if failures:
+        raise BroadcastError(failures)
+
+    return response
+
+
+def job_keys(client, body):
+    """Returns keys identifying the caller's job: task id from the request body (force_task_id for jobs, id_task for
+    /internal/progress) if there is one, and the client."""
+
+    keys = []
+
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+
+    if isinstance(data, dict):
+        task_id = data.get("force_task_id") or data.get("id_task")
+        if task_id:
+            keys.append(("task", task_id))
+
+    if client:
+        keys.append(("client", client))
+
+    return keys
+
+
+def dispatch(pool, method, path, headers, body, params, client=None):
+    if method == "POST" and path in job_paths:
+        worker = pool.acquire()
+        if worker is None:
+            return None
+
+        pool.assign_job(job_keys(client, body), worker)
+        try:
+            return forward(worker, method, path, headers, body, params)
+        finally:
+            pool.release(worker)
+
+    if path in job_scoped_paths:
+        worker = pool.job_worker(job_keys(client, body))
+        if worker is not None:
+            return forward(worker, method, path, headers, body, params)
+
+        if method == "POST" and path in interrupt_paths:
+            # the caller's job is not known, so stop whatever is running everywhere, as a single webui instance would
+            return broadcast(pool, method, path, headers, body, params)
+
+    if method == "POST" and path in broadcast_paths:
+        return broadcast(pool, method, path, headers, body, params)
+
+    worker = pool.any_worker()
+    if worker is None:
+        return None
+
+    return forward(worker, method, path, headers, body, params)
+
+
+def create_app(pool, api_auth=None):
+    from secrets import compare_digest
+
+    from fastapi import Depends, FastAPI, Request, Response
+    from fastapi.exceptions import HTTPException
+    from fastapi.security import HTTPBasic, HTTPBasicCredentials
+    from starlette.concurrency import run_in_threadpool
+    from starlette.middleware.gzip import GZipMiddleware
+
+    app = FastAPI()
+    app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+    # other routes are checked by the workers, which get the same --api-auth
+    api_credentials = {}
+    if api_auth:
+        for auth in api_auth.split(","):
+            user, password = auth.split(":")
+            api_credentials[user] = password
+
+    def check_auth(credentials: HTTPBasicCredentials = Depends(HTTPBasic())):
+        if credentials.username in api_credentials and compare_digest(credentials.password, api_credentials[credentials.username]):
+            return True
+
+        raise HTTPException(status_code=401, detail="Incorrect username or password", headers={"WWW-Authenticate": "Basic"})
+
+    @app.get("/sdapi/v1/workers", dependencies=[Depends(check_auth)] if api_credentials else [])
+    def workers():
+        return [{"index": worker.index, "device": worker.device, "port": worker.port, "alive": worker.is_alive(), "ready": worker.ready and worker.is_alive(), "busy": worker.busy} for worker in pool.workers]
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
+    async def proxy(path: str, request: Request):
+        body = await request.body()
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in hop_by_hop_headers}
+
+        try:
+            client = request.headers.get("x-client-id") or (request.client.host if request.client else None)
+            response = await run_in_threadpool(dispatch, pool, request.method, "/" + path, headers, body, str(request.query_params), client)
+        except BroadcastError as e:
+            return Response(content=f"Request failed on some workers: {e}", status_code=502)
+        except requests.RequestException as e:
+            return Response(content=f"Worker request failed: {e}", status_code=502)
+
+        if response is None:
+            return Response(content="No worker available", status_code=503)
+
+        response_headers = {k: v for k, v in response.headers.items() if k.lower() not in hop_by_hop_headers}
+        return Response(content=response.content, status_code=response.status_code, headers=response_headers)
+
+    return app
+
+
+def run_supervisor(args, argv):
+    import uvicorn
+
+    base_port = args.worker_base_port
+    workers = [Worker(i, device, base_port + i) for i, device in enumerate(args.workers)]
+    pool = WorkerPool(workers, worker_base_args(argv))
+    pool.start()
+
+    app = create_app(pool, args.api_auth)
+    try:
+        uvicorn.run(
+            app,
+            host=args.server_name or ("0.0.0.0" if args.listen else "127.0.0.1"),
+            port=args.port if args.port else 7861,
+            timeout_keep_alive=args.timeout_keep_alive,
+            ssl_keyfile=args.tls_keyfile,
+            ssl_certfile=args.tls_certfile,
+        )
+    finally:
+        pool.stop()
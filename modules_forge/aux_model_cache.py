@@ -0,0 +1,169 @@
+import threading
+from collections import OrderedDict
+
+import torch
+
+from ldm_patched.modules import model_management
+
+
+def estimate_model_size(obj, depth=3, seen=None):
+    """Bytes of the tensors held by obj: modules, tensors, and the attributes, dicts and lists of other objects."""
+    if seen is None:
+        seen = set()
+    if obj is None or id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, torch.nn.Module):
+        return model_management.module_size(obj)
+    if isinstance(obj, torch.Tensor):
+        return obj.nelement() * obj.element_size()
+    if depth == 0:
+        return 0
+
+    if isinstance(obj, dict):
+        values = obj.values()
+    elif isinstance(obj, (list, tuple)):
+        values = obj
+    elif hasattr(obj, '__dict__'):
+        values = vars(obj).values()
+    else:
+        return 0
+
+    return sum(estimate_model_size(v, depth - 1, seen) for v in values)
+
+
+class CacheEntry:
+    def __init__(self, value, size, category, on_evict):
+        self.value = value
+        self.size = size
+        self.category = category
+        self.on_evict = on_evict
+
+
+class AuxModelCache:
+    """
+    Least recently used cache of the auxiliary models kept in RAM between generations: ControlNets, IP-Adapters,
+    CLIP vision and preprocessor networks.
+
+    The cache is limited by the total size of the cached weights, and optionally by the number of entries of each
+    category. Limits are read on every insertion, so they can be changed at runtime; call evict() to apply a lower
+    limit immediately. Evicted models are dropped from model_management once nothing else references them.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        self.max_bytes = 8 * 1024 * 1024 * 1024
+        self.max_entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def total_bytes(self):
+        return sum(entry.size for entry in self.entries.values())
+
+    def set_limits(self, max_bytes=None, **max_entries):
+        """max_bytes for the whole cache, keyword arguments limit the number of entries of a category."""
+        with self.lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self.max_entries.update(max_entries)
+            self.evict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry.value
+
+    def touch(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+
+    def put(self, key, value, category='default', size=None, on_evict=None):
+        if size is None:
+            size = estimate_model_size(value)
+
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = CacheEntry(value, size, category, on_evict)
+            self.evict(keep=key)
+        return value
+
+    def get_or_load(self, key, loader, category='default', **kwargs):
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.put(key, value, category=category, **kwargs)
+        return value
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+        if entry is not None and entry.on_evict is not None:
+            entry.on_evict()
+
+    def evict(self, keep=None):
+        evicted = []
+        with self.lock:
+            counts = {}
+            for entry in self.entries.values():
+                counts[entry.category] = counts.get(entry.category, 0) + 1
+            total = self.total_bytes
+
+            for key in list(self.entries.keys()):
+                entry = self.entries[key]
+                limit = self.max_entries.get(entry.category)
+                over_count = limit is not None and counts[entry.category] > limit
+                if key == keep or not (total > self.max_bytes or over_count):
+                    continue
+                del self.entries[key]
+                counts[entry.category] -= 1
+                total -= entry.size
+                evicted.append((key, entry))
+
+            self.evictions += len(evicted)
+
+        for key, entry in evicted:
+            print(f'[Aux Model Cache] Evicted {entry.category} {key} ({entry.size / (1024 * 1024):.1f} MB)')
+            if entry.on_evict is not None:
+                entry.on_evict()
+
+        if evicted:
+            model_management.cleanup_models()
+            model_management.soft_empty_cache()
+
+    def clear(self):
+        with self.lock:
+            keys = list(self.entries.keys())
+        for key in keys:
+            self.remove(key)
+
+    def stats(self):
+        with self.lock:
+            categories = {}
+            for entry in self.entries.values():
+                category = categories.setdefault(entry.category, {'entries': 0, 'bytes': 0})
+                category['entries'] += 1
+                category['bytes'] += entry.size
+
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'categories': categories,
+            }
+
+
+aux_model_cache = AuxModelCache()
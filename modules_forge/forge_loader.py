@@ -15,7 +15,7 @@ from modules.shared import cmd_opts
 from modules import sd_hijack
 from modules.sd_models_xl import extend_sdxl
 from ldm.util import instantiate_from_config
-from modules_forge import forge_clip
+from modules_forge import forge_clip, weight_store
 from modules_forge.unet_patcher import UnetPatcher
 from ldm_patched.modules.model_base import model_sampling, ModelType
 
@@ -72,6 +72,8 @@ def no_clip():
 
 
 def load_checkpoint_guess_config(sd, output_vae=True, output_clip=True, output_clipvision=False, embedding_directory=None, output_model=True):
+    # the loaders below pop keys from sd, keep references to the tensors for sharing them with the weight store
+    shared_sd = dict(sd) if weight_store.store is not None else None
     sd_keys = sd.keys()
     clip = None
     clipvision = None
@@ -122,6 +124,14 @@ def load_checkpoint_guess_config(sd, output_vae=True, output_clip=True, output_c
     if len(left_over) > 0:
         print("left over keys:", left_over)
 
+    if shared_sd is not None:
+        shared_count = 0
+        if model is not None:
+            shared_count += weight_store.share_module_weights(model, shared_sd, prefix="model.")
+        if vae is not None:
+            shared_count += weight_store.share_module_weights(vae.first_stage_model, shared_sd, prefix="first_stage_model.")
+        print(f"Tensors mapped from shared weight store: {shared_count}")
+
     if output_model:
         model_patcher = UnetPatcher(model, load_device=load_device, offload_device=model_management.unet_offload_device(), current_device=inital_load_device)
         if inital_load_device != torch.device("cpu"):
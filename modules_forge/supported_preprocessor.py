@@ -8,6 +8,7 @@ from modules_forge.forge_util import resize_image_with_pad
 import ldm_patched.modules.clip_vision
 from modules.modelloader import load_file_from_url
 from modules_forge.forge_util import numpy_to_pytorch
+from modules_forge.aux_model_cache import aux_model_cache
 
 
 class PreprocessorParameter:
@@ -34,6 +35,8 @@ class Preprocessor:
         self.fill_mask_with_one_when_resize_and_fill = False
         self.use_soft_projection_in_hr_fix = False
         self.expand_mask_when_resize_and_fill = False
+        self.output_depends_on_seed = False  # results are only reused by ControlNet for the same seed
+        self.max_batch_size = 8  # images per forward pass in process_batch
 
     def setup_model_patcher(self, model, load_device=None, offload_device=None, dtype=torch.float32, **kwargs):
         if load_device is None:
@@ -50,9 +53,14 @@ class Preprocessor:
 
         self.model_patcher = ModelPatcher(model=model, load_device=load_device, offload_device=offload_device, **kwargs)
         self.model_patcher.dtype = dtype
+
+        # the model is loaded again by the preprocessor if it is evicted from the cache
+        aux_model_cache.put(('preprocessor', self.name, id(self)), self.model_patcher, category='preprocessor',
+                            on_evict=lambda: setattr(self, 'model_patcher', None))
         return self.model_patcher
 
     def move_all_model_patchers_to_gpu(self):
+        aux_model_cache.touch(('preprocessor', self.name, id(self)))
         model_management.load_models_gpu([self.model_patcher])
         return
 
@@ -71,6 +79,31 @@ class Preprocessor:
     def __call__(self, input_image, resolution, slider_1=None, slider_2=None, slider_3=None, input_mask=None, **kwargs):
         return input_image
 
+    def process_batch(self, input_images, resolution, slider_1=None, slider_2=None, slider_3=None, input_masks=None, **kwargs):
+        # Preprocessors with a model can override this to run one forward pass per batch of images.
+        # Returns one result per input image, the same as calling the preprocessor on each image.
+        if input_masks is None:
+            input_masks = [None] * len(input_images)
+
+        return [
+            self(input_image=input_image, resolution=resolution, slider_1=slider_1, slider_2=slider_2,
+                 slider_3=slider_3, input_mask=input_mask, **kwargs)
+            for input_image, input_mask in zip(input_images, input_masks)
+        ]
+
+    def supports_batch(self):
+        return type(self).process_batch is not Preprocessor.process_batch
+
+    def group_by_shape(self, images):
+        # Indices of images with the same shape, in chunks of at most max_batch_size.
+        groups = {}
+        for i, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(i)
+
+        for indices in groups.values():
+            for start in range(0, len(indices), self.max_batch_size):
+                yield indices[start:start + self.max_batch_size]
+
 
 class PreprocessorNone(Preprocessor):
     def __init__(self):
@@ -101,8 +134,6 @@ add_supported_preprocessor(PreprocessorCanny())
 
 
 class PreprocessorClipVision(Preprocessor):
-    global_cache = {}
-
     def __init__(self, name, url, filename):
         super().__init__()
         self.name = name
@@ -112,25 +143,20 @@ class PreprocessorClipVision(Preprocessor):
         self.corp_image_with_a1111_mask_when_in_img2img_inpaint_tab = False
         self.show_control_mode = False
         self.sorting_priority = 1
-        self.clipvision = None
 
     def load_clipvision(self):
-        if self.clipvision is not None:
-            return self.clipvision
-
         ckpt_path = load_file_from_url(
             url=self.url,
             model_dir=preprocessor_dir,
             file_name=self.filename
         )
 
-        if ckpt_path in PreprocessorClipVision.global_cache:
-            self.clipvision = PreprocessorClipVision.global_cache[ckpt_path]
-        else:
-            self.clipvision = ldm_patched.modules.clip_vision.load(ckpt_path)
-            PreprocessorClipVision.global_cache[ckpt_path] = self.clipvision
-
-        return self.clipvision
+        # shared by all preprocessors using the same checkpoint
+        return aux_model_cache.get_or_load(
+            ('clip_vision', ckpt_path),
+            lambda: ldm_patched.modules.clip_vision.load(ckpt_path),
+            category='clip_vision',
+        )
 
     @torch.no_grad()
     def __call__(self, input_image, resolution, slider_1=None, slider_2=None, slider_3=None, **kwargs):
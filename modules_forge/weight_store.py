@@ -0,0 +1,229 @@
+import atexit
+import collections
+import os
+import shutil
+import contextlib
+
+import torch
+import safetensors.torch
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class WeightStore:
+    """Content-addressed store of checkpoint state dicts shared between webui processes on one host.
+
+    Each checkpoint is written once, keyed by its sha256, as a safetensors file into a directory that should live on
+    tmpfs (/dev/shm by default). Every process then memory-maps the same file, so the pages are held in RAM once no
+    matter how many workers use the checkpoint. Each process that uses an entry holds a lease file named after its
+    pid; entries without live leases are evicted least recently used first when the store runs over its budget.
+
+    A process takes one lease per load of an entry and gives it back with release(); the lease file is removed when
+    the last one is released, so two loaded models with the same weights keep the entry until both are unloaded.
+    """
+
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.leases = collections.Counter()
+
+        os.makedirs(self.path, exist_ok=True)
+        atexit.register(self.release_all)
+
+    def entry_path(self, sha256):
+        return os.path.join(self.path, f"{sha256}.safetensors")
+
+    def lease_path(self, sha256, pid=None):
+        return os.path.join(self.path, f"{sha256}.{pid or os.getpid()}.lease")
+
+    @contextlib.contextmanager
+    def lock(self):
+        with open(os.path.join(self.path, ".lock"), "a") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def references(self, sha256):
+        count = 0
+        prefix = f"{sha256}."
+        for filename in os.listdir(self.path):
+            if not filename.startswith(prefix) or not filename.endswith(".lease"):
+                continue
+
+            pid = int(filename[len(prefix):-len(".lease")])
+            if pid_is_alive(pid):
+                count += 1
+            else:
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(self.path, filename))
+
+        return count
+
+    def entries(self):
+        res = []
+        for filename in os.listdir(self.path):
+            if filename.endswith(".safetensors"):
+                fullpath = os.path.join(self.path, filename)
+                stat = os.stat(fullpath)
+                res.append((stat.st_mtime, stat.st_size, filename[:-len(".safetensors")]))
+
+        return sorted(res)
+
+    def evict(self, required_bytes):
+        """Removes unreferenced entries, oldest first, until required_bytes more fit into the store."""
+
+        entries = self.entries()
+        used = sum(size for _, size, _ in entries)
+
+        def fits():
+            if self.max_bytes is not None and used + required_bytes > self.max_bytes:
+                return False
+            return shutil.disk_usage(self.path).free > required_bytes
+
+        for _, size, sha256 in entries:
+            if fits():
+                break
+
+            if self.references(sha256) > 0:
+                continue
+
+            print(f"Evicting {sha256[:10]} from shared weight store")
+            os.remove(self.entry_path(sha256))
+            used -= size
+
+        return fits()
+
+    def add(self, sha256, state_dict):
+        tensors = {k: v.contiguous() for k, v in state_dict.items() if isinstance(v, torch.Tensor)}
+        size = sum(v.nelement() * v.element_size() for v in tensors.values())
+
+        if not self.evict(size):
+            print(f"Not enough space in shared weight store for {sha256[:10]} ({size / 1024 ** 3:.2f} GB)")
+            return False
+
+        tmp_path = f"{self.entry_path(sha256)}.{os.getpid()}.tmp"
+        try:
+            safetensors.torch.save_file(tensors, tmp_path)
+            os.replace(tmp_path, self.entry_path(sha256))
+        except Exception as e:
+            # state dicts with tied tensors can't be saved as safetensors; those are loaded privately
+            print(f"Could not add {sha256[:10]} to shared weight store: {e}")
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            return False
+
+        return True
+
+    def load(self, sha256, read_state_dict):
+        """Returns the state dict for sha256 mapped from the store, adding it with read_state_dict() if missing."""
+
+        with self.lock():
+            path = self.entry_path(sha256)
+
+            if not os.path.exists(path):
+                state_dict = read_state_dict()
+                if not self.add(sha256, state_dict):
+                    return state_dict
+                del state_dict
+
+            os.utime(path)
+            with open(self.lease_path(sha256), "w"):
+                pass
+            self.leases[sha256] += 1
+
+        print(f"Loading weights [{sha256[:10]}] from shared weight store")
+        return safetensors.torch.load_file(path, device="cpu")
+
+    def release(self, sha256):
+        if self.leases[sha256] <= 0:
+            return
+
+        self.leases[sha256] -= 1
+        if self.leases[sha256] > 0:
+            return
+
+        del self.leases[sha256]
+        with contextlib.suppress(OSError):
+            os.remove(self.lease_path(sha256))
+
+    def release_all(self):
+        for sha256 in list(self.leases):
+            self.leases[sha256] = 1
+            self.release(sha256)
+
+
+def pid_is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+def share_module_weights(module, state_dict, prefix=""):
+    """Points the parameters and buffers of module at the matching tensors in state_dict.
+
+    Tensors that are already on CPU are re-pointed right away, releasing the copies made by load_state_dict. The
+    mapping is remembered on the module so that restore_shared_weights can re-point the rest when the module is
+    offloaded back to CPU.
+    """
+
+    shared = {}
+    for name, tensor in list(module.named_parameters()) + list(module.named_buffers()):
+        source = state_dict.get(prefix + name)
+        if source is None or source.dtype != tensor.dtype or source.shape != tensor.shape:
+            continue
+
+        shared[name] = source
+
+    module.shared_weights = shared
+    restore_shared_weights(module, only_cpu=True)
+    return len(shared)
+
+
+def restore_shared_weights(module, only_cpu=False):
+    shared = getattr(module, "shared_weights", None)
+    if not shared:
+        return
+
+    for name, tensor in list(module.named_parameters()) + list(module.named_buffers()):
+        source = shared.get(name)
+        if source is None or source.shape != tensor.shape or source.dtype != tensor.dtype:
+            continue
+
+        if only_cpu and tensor.device.type != "cpu":
+            continue
+
+        tensor.data = source
+
+
+store = None
+
+
+def get_store():
+    global store
+
+    if store is not None:
+        return store
+
+    from modules.shared import cmd_opts
+
+    if not cmd_opts.shared_weight_store:
+        return None
+
+    if fcntl is None:
+        print("Shared weight store requires a POSIX system and is disabled.")
+        cmd_opts.shared_weight_store = None
+        return None
+
+    max_bytes = int(cmd_opts.shared_weight_store_size * 1024 ** 3) if cmd_opts.shared_weight_store_size else None
+    store = WeightStore(cmd_opts.shared_weight_store, max_bytes)
+    return store
@@ -1,6 +1,6 @@
 from collections import namedtuple
 from copy import copy
-from itertools import permutations, chain
+from itertools import permutations, chain, product
 import random
 import csv
 import os.path
@@ -12,7 +12,7 @@ import gc
 import modules.scripts as scripts
 import gradio as gr
 
-from modules import images, sd_samplers, processing, sd_models, sd_vae, sd_schedulers, errors
+from modules import images, sd_samplers, processing, sd_models, sd_vae, sd_schedulers, errors, extra_networks
 from modules.processing import process_images, Processed, StableDiffusionProcessingTxt2Img
 from modules.shared import opts, state
 import modules.shared as shared
@@ -213,7 +213,7 @@ def csv_string_to_list_strip(data_str):
 
 
 class AxisOption:
-    def __init__(self, label, type, apply, format_value=format_value_add_label, confirm=None, cost=0.0, choices=None, prepare=None):
+    def __init__(self, label, type, apply, format_value=format_value_add_label, confirm=None, cost=0.0, choices=None, prepare=None, batchable=False):
         self.label = label
         self.type = type
         self.apply = apply
@@ -222,6 +222,7 @@ class AxisOption:
         self.cost = cost
         self.prepare = prepare
         self.choices = choices
+        self.batchable = batchable  # only changes per-image parameters (prompt, seed), so cells can share one batch
 
 
 class AxisOptionImg2Img(AxisOption):
@@ -237,16 +238,16 @@ class AxisOptionTxt2Img(AxisOption):
 
 
 axis_options = [
-    AxisOption("Nothing", str, do_nothing, format_value=format_nothing),
-    AxisOption("Seed", int, apply_field("seed")),
-    AxisOption("Var. seed", int, apply_field("subseed")),
+    AxisOption("Nothing", str, do_nothing, format_value=format_nothing, batchable=True),
+    AxisOption("Seed", int, apply_field("seed"), batchable=True),
+    AxisOption("Var. seed", int, apply_field("subseed"), batchable=True),
     AxisOption("Var. strength", float, apply_field("subseed_strength")),
     AxisOption("Steps", int, apply_field("steps")),
     AxisOptionTxt2Img("Hires steps", int, apply_field("hr_second_pass_steps")),
     AxisOption("CFG Scale", float, apply_field("cfg_scale")),
     AxisOptionImg2Img("Image CFG Scale", float, apply_field("image_cfg_scale")),
-    AxisOption("Prompt S/R", str, apply_prompt, format_value=format_value),
-    AxisOption("Prompt order", str_permutations, apply_order, format_value=format_value_join_list),
+    AxisOption("Prompt S/R", str, apply_prompt, format_value=format_value, batchable=True),
+    AxisOption("Prompt order", str_permutations, apply_order, format_value=format_value_join_list, batchable=True),
     AxisOptionTxt2Img("Sampler", str, apply_field("sampler_name"), format_value=format_value, confirm=confirm_samplers, choices=lambda: [x.name for x in sd_samplers.samplers if x.name not in opts.hide_samplers]),
     AxisOptionTxt2Img("Hires sampler", str, apply_field("hr_sampler_name"), confirm=confirm_samplers, choices=lambda: [x.name for x in sd_samplers.samplers_for_img2img if x.name not in opts.hide_samplers]),
     AxisOptionImg2Img("Sampler", str, apply_field("sampler_name"), format_value=format_value, confirm=confirm_samplers, choices=lambda: [x.name for x in sd_samplers.samplers_for_img2img if x.name not in opts.hide_samplers]),
@@ -286,7 +287,35 @@ axis_options = [
 ]
 
 
-def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend, draw_individual_labels, include_lone_images, include_sub_grids, first_axes_processed, second_axes_processed, margin_size):
+def iterate_cells(xs, ys, zs, first_axes_processed, second_axes_processed):
+    """Yields (x, y, z, ix, iy, iz) for every cell of the grid; first_axes_processed changes slowest."""
+    axes = {'x': xs, 'y': ys, 'z': zs}
+    order = [first_axes_processed, second_axes_processed]
+    order += [axis for axis in 'xyz' if axis not in order]
+
+    for indices in product(*(range(len(axes[axis])) for axis in order)):
+        i = dict(zip(order, indices))
+        yield xs[i['x']], ys[i['y']], zs[i['z']], i['x'], i['y'], i['z']
+
+
+def split_processed(processed, count):
+    """Splits the result of a batch of cells into one Processed per cell, in the same order as the batch."""
+    results = []
+    for i in range(count):
+        res = copy(processed)
+        if i < len(processed.images):
+            res.images = [processed.images[i]]
+            res.infotexts = [processed.infotexts[i] if i < len(processed.infotexts) else processed.info]
+            res.prompt = processed.all_prompts[i]
+            res.seed = processed.all_seeds[i]
+        else:
+            res.images = []
+        results.append(res)
+
+    return results
+
+
+def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend, draw_individual_labels, include_lone_images, include_sub_grids, first_axes_processed, second_axes_processed, margin_size, plan_cells=None, cell_batch=None):
     hor_texts = [[images.GridAnnotation(x)] for x in x_labels]
     ver_texts = [[images.GridAnnotation(y)] for y in y_labels]
     title_texts = [[images.GridAnnotation(z)] for z in z_labels]
@@ -295,7 +324,13 @@ def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend
 
     processed_result = None
 
-    state.job_count = list_size * p.n_iter
+    cells = list(iterate_cells(xs, ys, zs, first_axes_processed, second_axes_processed))
+    batches = plan_cells(cells) if plan_cells is not None else [[c] for c in cells]
+
+    state.job_count = len(batches) * p.n_iter
+
+    def index(ix, iy, iz):
+        return ix + iy * len(xs) + iz * len(xs) * len(ys)
 
     def draw_label_on_image(image, text):
         from PIL import ImageDraw, ImageFont
@@ -334,16 +369,9 @@ def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend
             draw.text((margin, current_height), line, fill='white', font=font)
             current_height += height
 
-    def process_cell(x, y, z, ix, iy, iz):
+    def process_cell(x, y, z, ix, iy, iz, processed: Processed):
         nonlocal processed_result
 
-        def index(ix, iy, iz):
-            return ix + iy * len(xs) + iz * len(xs) * len(ys)
-
-        state.job = f"{index(ix, iy, iz) + 1} out of {list_size}"
-
-        processed: Processed = cell(x, y, z, ix, iy, iz)
-
         if processed_result is None:
             # Use our first processed result object as a template container to hold our full results
             processed_result = copy(processed)
@@ -377,36 +405,15 @@ def draw_xyz_grid(p, xs, ys, zs, x_labels, y_labels, z_labels, cell, draw_legend
                 cell_size = processed_result.images[0].size
             processed_result.images[idx] = Image.new(cell_mode, cell_size)
 
-    if first_axes_processed == 'x':
-        for ix, x in enumerate(xs):
-            if second_axes_processed == 'y':
-                for iy, y in enumerate(ys):
-                    for iz, z in enumerate(zs):
-                        process_cell(x, y, z, ix, iy, iz)
-            else:
-                for iz, z in enumerate(zs):
-                    for iy, y in enumerate(ys):
-                        process_cell(x, y, z, ix, iy, iz)
-    elif first_axes_processed == 'y':
-        for iy, y in enumerate(ys):
-            if second_axes_processed == 'x':
-                for ix, x in enumerate(xs):
-                    for iz, z in enumerate(zs):
-                        process_cell(x, y, z, ix, iy, iz)
-            else:
-                for iz, z in enumerate(zs):
-                    for ix, x in enumerate(xs):
-                        process_cell(x, y, z, ix, iy, iz)
-    elif first_axes_processed == 'z':
-        for iz, z in enumerate(zs):
-            if second_axes_processed == 'x':
-                for ix, x in enumerate(xs):
-                    for iy, y in enumerate(ys):
-                        process_cell(x, y, z, ix, iy, iz)
-            else:
-                for iy, y in enumerate(ys):
-                    for ix, x in enumerate(xs):
-                        process_cell(x, y, z, ix, iy, iz)
+    for n, batch in enumerate(batches):
+        state.job = f"{n + 1} out of {len(batches)}"
+        if len(batch) == 1:
+            results = [cell(*batch[0])]
+        else:
+            results = cell_batch(batch)
+
+        for args, processed in zip(batch, results):
+            process_cell(*args, processed)
 
     if not processed_result:
         print("Unexpected error: Processing could not begin, you may need to refresh the tab or restart the service.")
@@ -764,10 +771,7 @@ class Script(scripts.Script):
 
         grid_infotext = [None] * (1 + len(zs))
 
-        def cell(x, y, z, ix, iy, iz):
-            if shared.state.interrupted or state.stopping_generation:
-                return Processed(p, [], p.seed, "")
-
+        def prepare_cell(x, y, z, ix, iy, iz):
             pc = copy(p)
             pc.styles = pc.styles[:]
             x_opt.apply(pc, x, xs)
@@ -784,6 +788,14 @@ class Script(scripts.Script):
             if vary_seeds_z:
                 pc.seed += iz * xdim * ydim
 
+            return pc
+
+        def cell(x, y, z, ix, iy, iz):
+            if shared.state.interrupted or state.stopping_generation:
+                return Processed(p, [], p.seed, "")
+
+            pc = prepare_cell(x, y, z, ix, iy, iz)
+
             try:
                 res = process_images(pc)
             except Exception as e:
@@ -791,6 +803,58 @@ class Script(scripts.Script):
 
                 res = Processed(p, [], p.seed, "")
 
+            set_grid_infotexts(pc, ix, iy, iz)
+
+            return res
+
+        def cell_batch(batch):
+            """Generates cells that only differ in per-image parameters as a single batch; returns a Processed for each cell."""
+            if shared.state.interrupted or state.stopping_generation:
+                return [Processed(p, [], p.seed, "") for _ in batch]
+
+            cell_ps = [prepare_cell(*c) for c in batch]
+            pc = cell_ps[0]
+            pc.prompt = [c.prompt for c in cell_ps]
+            pc.negative_prompt = [c.negative_prompt for c in cell_ps]
+            pc.seed = [processing.get_fixed_seed(c.seed) for c in cell_ps]
+            pc.subseed = [processing.get_fixed_seed(c.subseed) for c in cell_ps]
+            pc.batch_size = len(batch)
+            pc.do_not_save_grid = True
+
+            try:
+                res = process_images(pc)
+            except Exception as e:
+                errors.display(e, "generating images for xyz plot")
+
+                res = Processed(p, [], p.seed, "")
+
+            for i, (_, _, _, ix, iy, iz) in enumerate(batch):
+                set_grid_infotexts(pc, ix, iy, iz, position_in_batch=i)
+
+            return split_processed(res, len(batch))
+
+        def cell_state_key(c):
+            """Everything a cell changes besides per-image parameters; cells with equal keys can be generated together."""
+            x, y, z, ix, iy, iz = c
+            key = tuple(None if opt.batchable else i for opt, i in ((x_opt, ix), (y_opt, iy), (z_opt, iz)))
+
+            # extra networks such as LoRA are activated for the whole batch, so they are part of the model state
+            pc = prepare_cell(*c)
+            return key, tuple(sorted(extra_networks.re_extra_net.findall(pc.prompt)))
+
+        def plan_cells(cells):
+            """Groups cells into batches. Cells arrive with the most expensive axis changing slowest, and batches keep that order."""
+            max_batch_size = int(opts.xyz_grid_cell_batch_size)
+            if max_batch_size <= 1 or p.n_iter != 1 or p.batch_size != 1:
+                return [[c] for c in cells]
+
+            groups = {}
+            for c in cells:
+                groups.setdefault(cell_state_key(c), []).append(c)
+
+            return [group[i:i + max_batch_size] for group in groups.values() for i in range(0, len(group), max_batch_size)]
+
+        def set_grid_infotexts(pc, ix, iy, iz, position_in_batch=0):
             # Sets subgrid infotexts
             subgrid_index = 1 + iz
             if grid_infotext[subgrid_index] is None and ix == 0 and iy == 0:
@@ -809,7 +873,7 @@ class Script(scripts.Script):
                     if y_opt.label in ["Seed", "Var. seed"] and not no_fixed_seeds:
                         pc.extra_generation_params["Fixed Y Values"] = ", ".join([str(y) for y in ys])
 
-                grid_infotext[subgrid_index] = processing.create_infotext(pc, pc.all_prompts, pc.all_seeds, pc.all_subseeds)
+                grid_infotext[subgrid_index] = processing.create_infotext(pc, pc.all_prompts, pc.all_seeds, pc.all_subseeds, position_in_batch=position_in_batch)
 
             # Sets main grid infotext
             if grid_infotext[0] is None and ix == 0 and iy == 0 and iz == 0:
@@ -821,9 +885,19 @@ class Script(scripts.Script):
                     if z_opt.label in ["Seed", "Var. seed"] and not no_fixed_seeds:
                         pc.extra_generation_params["Fixed Z Values"] = ", ".join([str(z) for z in zs])
 
-                grid_infotext[0] = processing.create_infotext(pc, pc.all_prompts, pc.all_seeds, pc.all_subseeds)
+                grid_infotext[0] = processing.create_infotext(pc, pc.all_prompts, pc.all_seeds, pc.all_subseeds, position_in_batch=position_in_batch)
 
-            return res
+        def cell_steps(pc):
+            steps = pc.steps
+            if isinstance(pc, StableDiffusionProcessingTxt2Img) and pc.enable_hr:
+                steps += pc.hr_second_pass_steps or pc.steps
+            return steps
+
+        if int(opts.xyz_grid_cell_batch_size) > 1:
+            batches = plan_cells(list(iterate_cells(xs, ys, zs, first_axes_processed, second_axes_processed)))
+            if len(batches) < len(xs) * len(ys) * len(zs):
+                print(f"X/Y/Z plot will generate the cells in {len(batches)} batches")
+                shared.total_tqdm.updateTotal(sum(cell_steps(prepare_cell(*batch[0])) for batch in batches))
 
         with SharedSettingsStackHelper():
             if items_per_grid > 0:
@@ -862,7 +936,9 @@ class Script(scripts.Script):
                             'include_sub_grids': include_sub_grids,
                             'first_axes_processed': first_axes_processed,
                             'second_axes_processed': second_axes_processed,
-                            'margin_size': margin_size
+                            'margin_size': margin_size,
+                            'plan_cells': plan_cells,
+                            'cell_batch': cell_batch,
                         }
                         
                         chunk_processed = draw_xyz_grid(**grid_args)
@@ -942,7 +1018,9 @@ class Script(scripts.Script):
                 include_sub_grids=include_sub_grids,
                 first_axes_processed=first_axes_processed,
                 second_axes_processed=second_axes_processed,
-                margin_size=margin_size
+                margin_size=margin_size,
+                plan_cells=plan_cells,
+                cell_batch=cell_batch,
             )
 
         if not processed.images:
@@ -0,0 +1,77 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from ldm_patched.modules import model_management  # noqa: E402
+from modules_forge import aux_model_cache  # noqa: E402
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(model_management, "cleanup_models", lambda: None)
+    monkeypatch.setattr(model_management, "soft_empty_cache", lambda force=False: None)
+    return aux_model_cache.AuxModelCache()
+
+
+def test_estimate_model_size():
+    linear = torch.nn.Linear(4, 4)  # 16 weights and 4 biases
+    tensor = torch.zeros(8, dtype=torch.float16)
+    holder = type("Holder", (), {})()
+    holder.model = linear
+    holder.extra = {"tensor": tensor, "same": tensor, "name": "ignored"}
+
+    assert aux_model_cache.estimate_model_size(holder) == 20 * 4 + 8 * 2
+    assert aux_model_cache.estimate_model_size([[[[tensor]]]], depth=3) == 0
+
+
+def test_evicts_least_recently_used_by_size(cache):
+    evicted = []
+    cache.set_limits(max_bytes=100)
+
+    for key in "abc":
+        cache.put(key, key, size=40, on_evict=lambda key=key: evicted.append(key))
+        if key == "b":
+            cache.get("a")
+
+    assert evicted == ["b"]
+    assert list(cache.entries) == ["a", "c"]
+
+    cache.put("huge", "huge", size=1000)  # the entry just added is kept even if it alone is over the limit
+    assert list(cache.entries) == ["huge"]
+    assert evicted == ["b", "a", "c"]
+
+
+def test_category_limits(cache):
+    for i in range(3):
+        cache.put(("controlnet", i), i, category="controlnet", size=1)
+        cache.put(("preprocessor", i), i, category="preprocessor", size=1)
+
+    cache.set_limits(preprocessor=1)
+    assert list(cache.entries) == [("controlnet", i) for i in range(3)] + [("preprocessor", 2)]
+
+    cache.touch(("controlnet", 0))
+    cache.set_limits(controlnet=2)
+    assert list(cache.entries) == [("controlnet", 2), ("preprocessor", 2), ("controlnet", 0)]
+
+
+def test_get_or_load_and_stats(cache):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return "model"
+
+    assert cache.get_or_load("key", loader, category="ipadapter", size=10) == "model"
+    assert cache.get_or_load("key", loader, category="ipadapter", size=10) == "model"
+    assert cache.get_or_load("none", lambda: None) is None
+    assert len(calls) == 1
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["bytes"]) == (1, 2, 1, 10)
+    assert stats["categories"] == {"ipadapter": {"entries": 1, "bytes": 10}}
+
+    removed = []
+    cache.put("other", "other", size=5, on_evict=lambda: removed.append("other"))
+    cache.clear()
+    assert removed == ["other"]
+    assert cache.stats()["entries"] == 0
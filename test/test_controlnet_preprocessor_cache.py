@@ -0,0 +1,102 @@
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+controlnet_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "extensions-builtin", "sd_forge_controlnet")
+
+
+@pytest.fixture
+def cache_module(monkeypatch):
+    pytest.importorskip("torch")
+    if controlnet_path not in sys.path:
+        sys.path.append(controlnet_path)
+
+    from modules import shared
+    from lib_controlnet import preprocessor_cache
+
+    opts = types.SimpleNamespace(data={"control_net_preprocessor_cache_size": 1, "control_net_preprocessor_cache_to_disk": False})
+    monkeypatch.setattr(shared, "opts", opts)
+    return preprocessor_cache, opts
+
+
+def array_of_size(nbytes, fill=0):
+    return np.full(nbytes, fill, dtype=np.uint8)
+
+
+class DiskCache(dict):
+    def set(self, key, value):
+        self[key] = value
+
+
+def test_hash_ndarray_depends_on_content_shape_and_dtype(cache_module):
+    preprocessor_cache, _ = cache_module
+    a = np.arange(24, dtype=np.uint8).reshape(4, 6)
+
+    assert preprocessor_cache.hash_ndarray(None) is None
+    assert preprocessor_cache.hash_ndarray(a) == preprocessor_cache.hash_ndarray(a.copy())
+    assert preprocessor_cache.hash_ndarray(a.T) == preprocessor_cache.hash_ndarray(np.ascontiguousarray(a.T))
+    assert preprocessor_cache.hash_ndarray(a) != preprocessor_cache.hash_ndarray(a.reshape(6, 4))
+    assert preprocessor_cache.hash_ndarray(a) != preprocessor_cache.hash_ndarray(a.astype(np.int8))
+
+    b = a.copy()
+    b[3, 5] += 1
+    assert preprocessor_cache.hash_ndarray(a) != preprocessor_cache.hash_ndarray(b)
+
+
+def test_evicts_least_recently_used_by_size(cache_module):
+    preprocessor_cache, _ = cache_module
+    cache = preprocessor_cache.PreprocessorCache()
+    chunk = 400 * 1024
+
+    cache.put("a", array_of_size(chunk))
+    cache.put("b", array_of_size(chunk))
+    assert cache.get("a") is not None  # b is now the least recently used
+    cache.put("c", array_of_size(chunk))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.total_bytes == 2 * chunk
+
+    cache.put("a", array_of_size(chunk // 2, fill=1))
+    assert cache.total_bytes == chunk + chunk // 2
+    assert cache.get("a")[0] == 1
+
+
+def test_only_stores_arrays_that_fit(cache_module):
+    preprocessor_cache, opts = cache_module
+    torch = pytest.importorskip("torch")
+    cache = preprocessor_cache.PreprocessorCache()
+
+    cache.put("list", [array_of_size(10)])
+    cache.put("large", array_of_size(2 * 1024 * 1024))
+    cache.put("pair", (array_of_size(10), torch.zeros(4, dtype=torch.float32)))
+
+    assert cache.get("list") is None
+    assert cache.get("large") is None
+    assert cache.get("pair") is not None
+    assert cache.total_bytes == 10 + 16
+
+    opts.data["control_net_preprocessor_cache_size"] = 0
+    cache.put("disabled", array_of_size(10))
+    assert cache.get("disabled") is None
+
+
+def test_persistent_entries_go_through_the_disk_cache(cache_module):
+    preprocessor_cache, opts = cache_module
+    opts.data["control_net_preprocessor_cache_to_disk"] = True
+    cache = preprocessor_cache.PreprocessorCache()
+    cache.disk_cache = DiskCache()
+    key = ("canny", "abc", None, 512, 100, 200, None)
+
+    cache.put(key, array_of_size(10), persistent=True)
+    cache.put(("resized", key), array_of_size(10))
+    assert list(cache.disk_cache) == [repr(key)]
+
+    cache.clear()
+    assert cache.get(key) is None
+    assert cache.get(key, persistent=True) is not None
+    assert cache.get(key) is not None  # loaded back into memory
@@ -0,0 +1,148 @@
+import os
+import random
+import sys
+
+import pytest
+
+iib_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "extensions", "infinite-image-browsing")
+if iib_path not in sys.path:
+    sys.path.append(iib_path)
+
+from scripts.iib.db import tag_index  # noqa: E402
+
+
+def test_bitmap_matches_set():
+    rng = random.Random(0)
+    bitmap = tag_index.Bitmap()
+    expected = set()
+
+    # dense first chunk, sparse later chunks
+    for _ in range(20000):
+        pos = rng.randrange(0, 1 << 16) if rng.random() < 0.7 else rng.randrange(0, 5 << 16)
+        if rng.random() < 0.8:
+            bitmap.add(pos)
+            expected.add(pos)
+        else:
+            bitmap.discard(pos)
+            expected.discard(pos)
+
+    assert isinstance(bitmap.chunks[0], bytearray)
+    assert all(not isinstance(chunk, bytearray) for key, chunk in bitmap.chunks.items() if key > 0)
+
+    for key in range(6):
+        bits = bitmap.chunk_int(key)
+        assert {(key << 16) + low for low in range(1 << 16) if bits >> low & 1} == {pos for pos in expected if pos >> 16 == key}
+
+    assert all(pos in bitmap for pos in expected)
+    assert tag_index.Bitmap.from_positions(expected).chunks.keys() == {key for key, chunk in bitmap.chunks.items() if len(chunk)}
+
+
+def test_fold_path_case_matches_sqlite_like():
+    assert tag_index.fold_path_case("C:\\Outputs\\Ä") == "c:\\outputs\\Ä"
+
+
+@pytest.fixture
+def iib_db(tmp_path, monkeypatch):
+    pytest.importorskip("piexif")
+    pytest.importorskip("PIL")
+
+    from scripts.iib.db import datamodel
+
+    monkeypatch.setattr(datamodel.DataBase, "path", str(tmp_path / "iib.db"))
+    monkeypatch.setattr(datamodel, "tag_bitmap_index", tag_index.TagBitmapIndex())
+    conn = datamodel.DataBase.init()
+    yield datamodel, conn
+    conn.close()
+
+
+def add_images(datamodel, conn, tmp_path, rng, count, start):
+    folders = ["Outputs/txt2img", "outputs/img2img", "other_dir/sub", "other%dir"]
+    tags = [datamodel.Tag.get_or_create(conn, f"tag{i}", "pos") for i in range(8)]
+
+    for i in range(start, start + count):
+        folder = tmp_path / rng.choice(folders)
+        folder.mkdir(parents=True, exist_ok=True)
+        path = folder / f"{i:05}.png"
+        path.write_bytes(b"")
+
+        img = datamodel.Image(str(path), size=0, date=f"2024-01-01 00:{i // 60 % 60:02}:{i % 60:02}.{i:05}")
+        img.save(conn)
+        for tag in rng.sample(tags, rng.randrange(0, 4)):
+            datamodel.ImageTag(img.id, tag.id).save(conn)
+
+    conn.commit()
+    return tags
+
+
+def query_both(datamodel, conn, tag_dict, limit, cursor="", folder_paths=None):
+    ids_from_index, has_next = datamodel.tag_bitmap_index.query(conn, tag_dict, limit, cursor, folder_paths)
+
+    datamodel.tag_bitmap_index.enabled = False
+    try:
+        images, api_cur = datamodel.ImageTag.get_images_by_tags(conn, tag_dict, limit, cursor, folder_paths)
+    finally:
+        datamodel.tag_bitmap_index.enabled = True
+
+    return (ids_from_index, has_next), ([img.id for img in images], api_cur.has_next)
+
+
+def queries(tmp_path, tags):
+    t = [tag.id for tag in tags]
+    cursor = "2024-01-01 00:02:00"
+
+    for limit in (5, 1000):
+        yield {"and": [], "or": [], "not": []}, limit, "", None
+        yield {"and": [t[0]], "or": [], "not": []}, limit, "", None
+        yield {"and": [t[0], t[1]], "or": [], "not": []}, limit, "", None
+        yield {"and": [], "or": [t[2], t[3]], "not": []}, limit, "", None
+        yield {"and": [t[1]], "or": [t[2], t[3]], "not": [t[4]]}, limit, "", None
+        yield {"and": [], "or": [], "not": [t[0], t[5]]}, limit, cursor, None
+        yield {"and": [t[6]], "or": [], "not": []}, limit, cursor, [str(tmp_path / "outputs")]
+        yield {"and": [], "or": [t[7]], "not": []}, limit, "", [str(tmp_path / "OTHER_DIR"), str(tmp_path / "other%dir")]
+        yield {"and": [], "or": [], "not": []}, limit, "", [str(tmp_path / "other%dir")]
+
+
+def test_index_matches_sql(iib_db, tmp_path):
+    datamodel, conn = iib_db
+    rng = random.Random(1)
+    tags = add_images(datamodel, conn, tmp_path, rng, 300, 0)
+
+    for tag_dict, limit, cursor, folder_paths in queries(tmp_path, tags):
+        from_index, from_sql = query_both(datamodel, conn, tag_dict, limit, cursor, folder_paths)
+        assert from_index == from_sql, (tag_dict, limit, cursor, folder_paths)
+
+
+def test_index_matches_sql_after_incremental_updates(iib_db, tmp_path):
+    datamodel, conn = iib_db
+    rng = random.Random(2)
+    tags = add_images(datamodel, conn, tmp_path, rng, 200, 0)
+
+    # build the index, then change the database through the datamodel write methods
+    datamodel.tag_bitmap_index.query(conn, {"and": [], "or": [], "not": []}, 1)
+    assert datamodel.tag_bitmap_index.valid
+
+    add_images(datamodel, conn, tmp_path, rng, 100, 200)
+    with conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM image ORDER BY id LIMIT 20")
+        removed = [row[0] for row in cur.fetchall()]
+    datamodel.Image.safe_batch_remove(conn, removed)
+
+    # remove tags so that some images lose their last one
+    with conn:
+        cur = conn.cursor()
+        cur.execute("SELECT image_id, MIN(tag_id) FROM image_tag GROUP BY image_id HAVING COUNT(*) = 1 LIMIT 10")
+        single_tags = cur.fetchall()
+        cur.execute("SELECT image_id FROM image_tag GROUP BY image_id HAVING COUNT(*) > 1 LIMIT 10")
+        multi_tag_images = [row[0] for row in cur.fetchall()]
+    assert single_tags and multi_tag_images
+    for image_id, tag_id in single_tags:
+        datamodel.ImageTag.remove(conn, image_id=image_id, tag_id=tag_id)
+    for image_id in multi_tag_images:
+        datamodel.ImageTag.remove(conn, image_id=image_id)
+    datamodel.ImageTag.remove(conn, tag_id=tags[3].id)
+    assert datamodel.tag_bitmap_index.valid
+
+    for tag_dict, limit, cursor, folder_paths in queries(tmp_path, tags):
+        from_index, from_sql = query_both(datamodel, conn, tag_dict, limit, cursor, folder_paths)
+        assert from_index == from_sql, (tag_dict, limit, cursor, folder_paths)
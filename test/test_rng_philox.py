@@ -0,0 +1,106 @@
+import types
+
+import numpy as np
+import pytest
+
+from modules import rng_philox
+
+
+def baseline_randn(seed, offset, shape):
+    """Generator.randn as it was before generation for several seeds was batched."""
+
+    n = int(np.prod(shape))
+
+    counter = np.zeros((4, n), dtype=np.uint32)
+    counter[0] = offset
+    counter[2] = np.arange(n, dtype=np.uint32)
+
+    key = np.empty(n, dtype=np.uint64)
+    key.fill(seed)
+    key = rng_philox.uint32(key)
+
+    g = rng_philox.philox4_32(counter, key)
+
+    return rng_philox.box_muller(g[0], g[1]).reshape(shape)
+
+
+seeds = [0, 1, 12345, 2**32 - 1, 2**33 + 7]
+
+
+def test_matches_torch_cuda_reference():
+    expected = np.array([
+        [-0.92466259, -0.42534415, -2.6438457, 0.14518388],
+        [-0.12086647, -0.57972564, -0.62285122, -0.32838709],
+        [-1.07454231, -0.36314407, -1.67105067, 2.26550497],
+    ], dtype=np.float32)
+
+    assert np.allclose(rng_philox.Generator(seed=0).randn(shape=(3, 4)), expected)
+
+
+@pytest.mark.parametrize("chunk_size", [rng_philox.chunk_size, 1000, 997])
+def test_randn_generators_matches_per_seed_randn(monkeypatch, chunk_size):
+    monkeypatch.setattr(rng_philox, "chunk_size", chunk_size)
+    shape = (4, 17, 19)
+
+    generators = [rng_philox.Generator(seed) for seed in seeds]
+    for i, g in enumerate(generators):
+        g.offset = i * 3
+
+    offsets = [g.offset for g in generators]
+    for step in range(3):
+        res = rng_philox.randn_generators(generators, shape)
+
+        assert res.shape == (len(seeds), *shape)
+        assert res.dtype == np.float32
+        for i, seed in enumerate(seeds):
+            assert np.array_equal(res[i], baseline_randn(seed, offsets[i] + step, shape))
+
+    assert [g.offset for g in generators] == [offset + 3 for offset in offsets]
+
+
+def test_randn_spanning_several_chunks():
+    shape = (4, 128, 640)
+    assert np.prod(shape) > rng_philox.chunk_size  # one stream is split between chunks
+
+    generators = [rng_philox.Generator(seed) for seed in seeds[:2]]
+    res = rng_philox.randn_generators(generators, shape)
+
+    for i, seed in enumerate(seeds[:2]):
+        assert np.array_equal(res[i], baseline_randn(seed, 0, shape))
+
+
+def test_generator_randn_advances_offset():
+    g = rng_philox.Generator(seed=42)
+    first = g.randn((2, 3))
+    second = g.randn((2, 3))
+
+    assert g.offset == 2
+    assert np.array_equal(first, baseline_randn(42, 0, (2, 3)))
+    assert np.array_equal(second, baseline_randn(42, 1, (2, 3)))
+
+
+@pytest.mark.parametrize("eta_noise_seed_delta", [0, 31337])
+def test_image_rng_nv_batch_matches_per_image(monkeypatch, eta_noise_seed_delta):
+    torch = pytest.importorskip("torch")
+    from modules import rng, shared
+
+    monkeypatch.setattr(shared, "opts", types.SimpleNamespace(randn_source="NV", eta_noise_seed_delta=eta_noise_seed_delta))
+    monkeypatch.setattr(shared, "device", torch.device("cpu"), raising=False)
+
+    def generate(batched):
+        with monkeypatch.context() as m:
+            if not batched:
+                m.setattr(rng.ImageRNG, "is_nv_batch", lambda self: False)
+
+            rng.manual_seed(0)
+            image_rng = rng.ImageRNG((4, 8, 8), [1, 2, 2**32 + 3])
+            noise = [image_rng.next().cpu() for _ in range(3)]
+
+            return noise, (rng.nv_rng.seed, rng.nv_rng.offset), [(g.seed, g.offset) for g in image_rng.generators]
+
+    batched_noise, batched_global_state, batched_generators = generate(batched=True)
+    noise, global_state, generators = generate(batched=False)
+
+    assert all(torch.equal(a, b) for a, b in zip(batched_noise, noise))
+    assert batched_global_state == global_state
+    assert batched_generators == generators
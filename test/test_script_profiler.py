@@ -0,0 +1,103 @@
+import os
+import types
+
+import pytest
+
+from modules import paths, script_profiler, shared
+
+
+class Script:
+    def __init__(self, name):
+        self.filename = os.path.join(paths.script_path, "scripts", f"{name}.py")
+
+
+class QuotedScript(Script):
+    pass
+
+
+QuotedScript.__name__ = 'My "Script"'
+
+
+@pytest.fixture
+def profiler(monkeypatch):
+    monkeypatch.setattr(shared, "opts", types.SimpleNamespace(script_profiler_gpu=False, script_profiler_budget_ms=50, script_profiler_warn=True))
+    script_profiler.reset()
+    yield script_profiler
+    script_profiler.reset()
+
+
+def run_hook(monkeypatch, script, hook, seconds):
+    clock = iter([100.0, 100.0 + seconds])
+    monkeypatch.setattr(script_profiler, "time", types.SimpleNamespace(perf_counter=lambda: next(clock)))
+
+    with script_profiler.measure(script, hook):
+        pass
+
+
+def test_histogram_buckets():
+    histogram = script_profiler.Histogram()
+    for value in [0.0005, 0.001, 0.003, 0.2, 20.0]:
+        histogram.add(value)
+
+    dump = histogram.dump()
+    assert dump["count"] == 5
+    assert dump["max"] == 20.0
+    assert dump["mean"] == pytest.approx(sum([0.0005, 0.001, 0.003, 0.2, 20.0]) / 5)
+
+    # buckets are cumulative and include their upper bound, as in Prometheus
+    assert dump["buckets"]["0.001"] == 2
+    assert dump["buckets"]["0.0025"] == 2
+    assert dump["buckets"]["0.005"] == 3
+    assert dump["buckets"]["0.25"] == 4
+    assert dump["buckets"]["10.0"] == 4
+    assert dump["buckets"]["+Inf"] == 5
+    assert list(dump["buckets"].values()) == sorted(dump["buckets"].values())
+
+    assert script_profiler.Histogram().dump()["mean"] == 0.0
+
+
+def test_measure_records_per_script_and_hook(profiler, monkeypatch, capsys):
+    script = Script("example")
+
+    run_hook(monkeypatch, script, "process", 0.01)
+    run_hook(monkeypatch, script, "process", 0.1)
+    run_hook(monkeypatch, script, "postprocess", 0.002)
+
+    stats = {x["hook"]: x for x in profiler.dump()}
+    assert stats.keys() == {"process", "postprocess"}
+    assert stats["process"]["script"] == "Script"
+    assert stats["process"]["file"] == os.path.join("scripts", "example.py")
+    assert stats["process"]["wall"]["count"] == 2
+    assert stats["process"]["wall"]["total"] == pytest.approx(0.11)
+    assert stats["process"]["gpu"]["count"] == 0
+    assert stats["process"]["over_budget"] == 1
+    assert stats["postprocess"]["over_budget"] == 0
+
+    assert "process took 100 ms, which is over the budget of 50 ms" in capsys.readouterr().out
+
+    shared.opts.script_profiler_budget_ms = 0
+    run_hook(monkeypatch, script, "process", 10.0)
+    assert {x["hook"]: x for x in profiler.dump()}["process"]["over_budget"] == 1
+
+    profiler.reset()
+    assert profiler.dump() == []
+
+
+def test_prometheus_text(profiler, monkeypatch):
+    run_hook(monkeypatch, Script("example"), "process", 0.2)
+    run_hook(monkeypatch, QuotedScript("quoted"), "process_batch", 0.003)
+
+    lines = profiler.prometheus_text().splitlines()
+
+    example = f'script="Script",file="{os.path.join("scripts", "example.py")}",hook="process"'.replace("\\", "\\\\")
+    assert f'sdwebui_script_hook_wall_seconds_bucket{{{example},le="0.1"}} 0' in lines
+    assert f'sdwebui_script_hook_wall_seconds_bucket{{{example},le="0.25"}} 1' in lines
+    assert f'sdwebui_script_hook_wall_seconds_bucket{{{example},le="+Inf"}} 1' in lines
+    assert f'sdwebui_script_hook_wall_seconds_count{{{example}}} 1' in lines
+    assert f'sdwebui_script_hook_gpu_seconds_count{{{example}}} 0' in lines
+    assert f'sdwebui_script_hook_over_budget_total{{{example}}} 1' in lines
+
+    assert any(line.startswith('sdwebui_script_hook_wall_seconds_count{script="My \\"Script\\"",') and line.endswith(" 1") for line in lines)
+
+    assert lines.count("# TYPE sdwebui_script_hook_wall_seconds histogram") == 1
+    assert lines.count("# TYPE sdwebui_script_hook_over_budget_total counter") == 1
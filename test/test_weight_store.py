@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from modules_forge import weight_store  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path):
+    if weight_store.fcntl is None:
+        pytest.skip("shared weight store requires a POSIX system")
+
+    return weight_store.WeightStore(str(tmp_path / "store"))
+
+
+def test_leases_are_counted_per_load(store):
+    sha256 = "a" * 64
+    reads = []
+
+    def read_state_dict():
+        reads.append(1)
+        return {"weight": torch.arange(4, dtype=torch.float32)}
+
+    for _ in range(2):
+        state_dict = store.load(sha256, read_state_dict)
+        assert torch.equal(state_dict["weight"], torch.arange(4, dtype=torch.float32))
+
+    assert len(reads) == 1
+    assert os.path.exists(store.lease_path(sha256))
+    assert store.references(sha256) == 1
+
+    store.release(sha256)
+    assert os.path.exists(store.lease_path(sha256))
+
+    store.release(sha256)
+    assert not os.path.exists(store.lease_path(sha256))
+    assert store.references(sha256) == 0
+
+    store.release(sha256)  # releasing more than was loaded does nothing
+    assert store.leases[sha256] == 0
+
+
+def test_release_all_and_eviction(store):
+    for sha256 in ("b" * 64, "c" * 64):
+        store.load(sha256, lambda: {"weight": torch.zeros(1024)})
+    store.load("b" * 64, lambda: None)
+
+    store.release_all()
+    assert not any(name.endswith(".lease") for name in os.listdir(store.path))
+
+    store.max_bytes = 0
+    assert store.evict(0)
+    assert not any(name.endswith(".safetensors") for name in os.listdir(store.path))
@@ -0,0 +1,146 @@
+import concurrent.futures
+import importlib.util
+import io
+import os
+import zipfile
+
+import pytest
+
+zip_extension_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "extensions", "zip-dl", "scripts", "zip-extension.py")
+
+
+@pytest.fixture(scope="module")
+def zip_dl():
+    pytest.importorskip("gradio")
+    pytest.importorskip("fastapi")
+
+    spec = importlib.util.spec_from_file_location("zip_extension", zip_extension_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def folder(tmp_path):
+    files = {
+        "prompt.txt": b"a photo of a cat, " * 1000,
+        "image.png": os.urandom(3000),
+        "random.bin": os.urandom(5000),
+        "empty.txt": b"",
+        "sub/日本語.txt": "テキスト".encode("utf-8") * 100,
+        "sub/deeper/large.txt": b"0123456789" * 2000,
+    }
+
+    for name, data in files.items():
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    return tmp_path, files
+
+
+def make_zip(zip_dl, folder_path, **kwargs):
+    return b"".join(zip_dl.stream_zip(zip_dl.list_files(str(folder_path), **kwargs), max_workers=2))
+
+
+def test_stream_zip_is_readable_by_zipfile(zip_dl, folder, monkeypatch):
+    folder_path, files = folder
+    # large.txt goes through the unknown-size stored path, prompt.txt is deflated in memory
+    monkeypatch.setattr(zip_dl, "MAX_DEFLATE_SIZE", 19000)
+
+    with zipfile.ZipFile(io.BytesIO(make_zip(zip_dl, folder_path))) as archive:
+        assert archive.testzip() is None
+        assert sorted(archive.namelist()) == sorted(files)
+        for name, data in files.items():
+            assert archive.read(name) == data
+
+        assert archive.getinfo("prompt.txt").compress_type == zipfile.ZIP_DEFLATED
+        assert archive.getinfo("image.png").compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo("random.bin").compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo("sub/deeper/large.txt").compress_type == zipfile.ZIP_STORED
+
+
+def test_zip64_end_record_for_many_entries(zip_dl):
+    writer = zip_dl.ZipStreamWriter()
+    count = 0xFFFF + 10
+
+    def chunks():
+        for i in range(count):
+            yield from writer.add_compressed(zip_dl.ZipEntry(f"{i}.txt", 0), b"")
+        yield from writer.central_directory()
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks()))) as archive:
+        infos = archive.infolist()
+        assert len(infos) == count
+        assert infos[-1].filename == f"{count - 1}.txt"
+
+
+def test_list_files_filters(zip_dl, folder):
+    folder_path, files = folder
+    os.utime(folder_path / "prompt.txt", (0, zip_dl.parse_date("2024-01-10")))
+    os.utime(folder_path / "image.png", (0, zip_dl.parse_date("2024-01-20") + 60))
+
+    def names(**kwargs):
+        return sorted(name.replace(os.sep, "/") for name, _, _ in zip_dl.list_files(str(folder_path), **kwargs))
+
+    assert names(patterns=["*.txt"]) == ["empty.txt", "prompt.txt", "sub/deeper/large.txt", "sub/日本語.txt"]
+    assert names(patterns=["sub/*.txt"]) == ["sub/deeper/large.txt", "sub/日本語.txt"]
+    assert names(since=zip_dl.parse_date("2024-01-01"), until=zip_dl.parse_date("2024-01-19", end=True)) == ["prompt.txt"]
+    assert names(since=zip_dl.parse_date("2024-01-20"), until=zip_dl.parse_date("2024-01-20", end=True)) == ["image.png"]
+
+
+def test_list_files_does_not_follow_directory_symlinks(zip_dl, folder):
+    folder_path, files = folder
+    try:
+        os.symlink(folder_path, folder_path / "sub" / "loop", target_is_directory=True)
+    except (OSError, NotImplementedError):
+        pytest.skip("symlinks are not supported")
+
+    assert sorted(name.replace(os.sep, "/") for name, _, _ in zip_dl.list_files(str(folder_path))) == sorted(files)
+
+
+def test_stream_zip_bounds_bytes_waiting_for_deflate(zip_dl, tmp_path, monkeypatch):
+    class Executor:
+        """runs work when it is submitted, so that submitted bytes are known at every step"""
+
+        def __init__(self, max_workers):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def submit(self, fn, *args):
+            future = concurrent.futures.Future()
+            future.set_result(fn(*args))
+            return future
+
+    class Writer(zip_dl.ZipStreamWriter):
+        instance = None
+
+        def __init__(self):
+            super().__init__()
+            Writer.instance = self
+
+    submitted = []
+
+    def deflate_file(file_path):
+        submitted.append(os.path.getsize(file_path))
+        return original_deflate_file(file_path)
+
+    original_deflate_file = zip_dl.deflate_file
+    monkeypatch.setattr(zip_dl, "ThreadPoolExecutor", Executor)
+    monkeypatch.setattr(zip_dl, "ZipStreamWriter", Writer)
+    monkeypatch.setattr(zip_dl, "deflate_file", deflate_file)
+    monkeypatch.setattr(zip_dl, "MAX_PENDING_DEFLATE_BYTES", 25000)
+
+    for i in range(8):
+        (tmp_path / f"{i}.txt").write_bytes(b"text " * 2000)
+
+    for _ in zip_dl.stream_zip(zip_dl.list_files(str(tmp_path)), max_workers=8):
+        written = sum(entry.size for entry in Writer.instance.entries if entry.method == zip_dl.ZIP_DEFLATED)
+        assert sum(submitted) - written <= 25000
+
+    assert len(submitted) == 8
@@ -23,27 +23,92 @@ initialize.check_versions()
 initialize.initialize()
 
 
-def create_api(app):
+def create_api(app, initialize_scripts=True):
     from modules.api.api import Api
     from modules.call_queue import queue_lock
 
-    api = Api(app, queue_lock)
+    api = Api(app, queue_lock, initialize_scripts=initialize_scripts)
     return api
 
 
+def wait_for_startup_middleware(app):
+    """With --api-fast-start, holds every request except health checks until startup is finished; if startup failed,
+    answers them with 503.
+
+    Requests wait on an asyncio event rather than in the threadpool, so that any number of them can wait without
+    starving the health check. Returns a function that the startup thread calls once startup_finished is set."""
+    import asyncio
+    from fastapi.responses import JSONResponse
+
+    startup_event = None
+    startup_loop = None
+
+    def notify_finished():
+        if startup_loop is not None:
+            startup_loop.call_soon_threadsafe(startup_event.set)
+
+    @app.middleware("http")
+    async def wait_for_startup(request, call_next):
+        nonlocal startup_event, startup_loop
+
+        if request.scope.get("path", "").endswith("/sdapi/v1/health"):
+            return await call_next(request)
+
+        if not initialize.startup_finished.is_set():
+            if startup_loop is None:
+                startup_event = asyncio.Event()
+                startup_loop = asyncio.get_running_loop()
+
+            # checked again after startup_loop is set, in case startup finished before notify_finished could see it
+            if not initialize.startup_finished.is_set():
+                await startup_event.wait()
+
+        if initialize.startup_error is not None:
+            return JSONResponse(status_code=503, content={"error": type(initialize.startup_error).__name__, "detail": "API startup failed", "errors": str(initialize.startup_error)})
+
+        return await call_next(request)
+
+
 def api_only_worker():
     from fastapi import FastAPI
     from modules.shared_cmd_options import cmd_opts
 
+    fast_start = initialize.is_api_fast_start()
+
     app = FastAPI()
     initialize_util.setup_middleware(app)
-    api = create_api(app)
+    api = create_api(app, initialize_scripts=not fast_start)
+
+    def finish_startup():
+        if fast_start:
+            initialize.initialize_deferred()
+            api.initialize_scripts()
+            startup_timer.record("initialize scripts")
+
+        from modules import script_callbacks
+        script_callbacks.before_ui_callback()
+        script_callbacks.app_started_callback(None, app)
 
-    from modules import script_callbacks
-    script_callbacks.before_ui_callback()
-    script_callbacks.app_started_callback(None, app)
+        initialize.startup_finished.set()
+        print(f"Startup time: {startup_timer.summary()}.")
+
+    def finish_startup_in_background(notify_finished):
+        try:
+            finish_startup()
+        except Exception as e:
+            from modules import errors
+            errors.report("Error finishing API startup", exc_info=True)
+            initialize.startup_error = e
+            initialize.startup_finished.set()  # release waiting requests instead of leaving them hanging
+        finally:
+            notify_finished()
+
+    if fast_start:
+        notify_finished = wait_for_startup_middleware(app)
+        Thread(target=finish_startup_in_background, args=(notify_finished,), daemon=True).start()
+    else:
+        finish_startup()
 
-    print(f"Startup time: {startup_timer.summary()}.")
     api.launch(
         server_name=initialize_util.gradio_server_name(),
         port=cmd_opts.port if cmd_opts.port else 7861,
@@ -155,6 +220,7 @@ def wui_worker():
         with startup_timer.subcategory("app_started_callback"):
             script_callbacks.app_started_callback(shared.demo, app)
 
+        initialize.startup_finished.set()
         timer.startup_record = startup_timer.dump()
         print(f"Startup time: {startup_timer.summary()}.")
 